@@ -2,7 +2,12 @@ from django.contrib import admin
 from .models import *
 
 # Register your models here.
-admin.site.register(Listing)
+
+@admin.register(Listing)
+class ListingAdmin(admin.ModelAdmin):
+    # Maintained by the bid signal handlers, saves leave it alone
+    readonly_fields = ("currentBid",)
+
 admin.site.register(Bid)
 admin.site.register(Comment)
 admin.site.register(Category)
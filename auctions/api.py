@@ -0,0 +1,183 @@
+"""
+Contains the read-only JSON API (version 1)
+
+Responses are serialized straight from values() querysets, without
+building model instances. Every endpoint supports conditional GET:
+ETag and Last-Modified are derived from listing and bid timestamps,
+so unchanged resources are answered with 304 before their rows are
+loaded or serialized. Lists only read the stamps of the requested page. Renamed owners, winners and categories bump
+the 'updated' stamp of their listings, see auctions.signals.
+"""
+import hashlib
+
+from django.db.models import F
+from django.http import JsonResponse
+from django.views.decorators.http import condition, require_GET
+
+from .models import Bid, Category, Listing
+from .pagination import page_query, paginate
+
+# Fields of a listing in list responses
+LISTING_FIELDS = ("id", "title", "current_price", "bid_count", "active", "time")
+LISTING_EXPRESSIONS = {
+    "owner_username": F("owner__username"),
+    "category_name": F("category__name"),
+    "image_url": F("imageURL"),
+    "starting_price": F("startingPrice"),
+}
+
+# Additional fields of a listing in detail responses
+LISTING_DETAIL_FIELDS = LISTING_FIELDS + ("category", "description", "updated")
+LISTING_DETAIL_EXPRESSIONS = {
+    **LISTING_EXPRESSIONS,
+    "winner_username": F("winner__username"),
+}
+
+
+def not_found():
+    return JsonResponse({"error": "Not found."}, status=404)
+
+
+def make_etag(*parts):
+    """
+    Returns an ETag value built from the given parts
+    """
+    return hashlib.md5("|".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def filtered_listings(request):
+    """
+    Returns the listings selected by the 'category' and 'active'
+    query parameters. Only active listings are returned by default.
+    """
+    listings = Listing.objects.all()
+    if request.GET.get("active", "true").lower() != "all":
+        listings = listings.filter(active=request.GET.get("active", "true").lower() == "true")
+    if request.GET.get("category", "").isdigit():
+        listings = listings.filter(category=request.GET["category"])
+    return listings
+
+
+def listing_stamp(request, pk):
+    """
+    Returns the 'updated' stamp of a listing, or None if it does
+    not exist. Memoized on the request, as both the ETag and the
+    Last-Modified function need it.
+    """
+    if not hasattr(request, "_listing_stamp"):
+        request._listing_stamp = Listing.objects.filter(pk=pk).values_list("updated", flat=True).first()
+    return request._listing_stamp
+
+
+def listings_stamp(request):
+    """
+    Returns the ids and 'updated' stamps of the requested page and the
+    row telling whether there is a next one, memoized on the request.
+    Only the page is read, so answering with 304 costs no more than one
+    page, however many listings match.
+    """
+    if not hasattr(request, "_listings_stamp"):
+        query, _ = page_query(
+            filtered_listings(request).values("id", "time", "updated"),
+            after=request.GET.get("after"),
+            before=request.GET.get("before")
+        )
+        request._listings_stamp = [(row["id"], row["updated"]) for row in query]
+    return request._listings_stamp
+
+
+def listings_etag(request):
+    return make_etag(request.get_full_path(), *listings_stamp(request))
+
+
+def listings_last_modified(request):
+    return max((updated for pk, updated in listings_stamp(request)), default=None)
+
+
+def listing_etag(request, pk):
+    stamp = listing_stamp(request, pk)
+    return stamp and make_etag(request.get_full_path(), stamp)
+
+
+def listing_last_modified(request, pk):
+    return listing_stamp(request, pk)
+
+
+def categories_etag(request):
+    # Categories have no timestamps, but there are only a few of them
+    return make_etag(*Category.objects.order_by("name").values_list("id", "name", "slug"))
+
+
+@require_GET
+@condition(etag_func=listings_etag, last_modified_func=listings_last_modified)
+def listings(request):
+    """
+    Returns one page of listings, newest first. Pages are selected
+    with the 'after'/'before' cursors of the previous response.
+    Listings can be filtered with 'category' (id) and 'active'
+    ('true', 'false' or 'all').
+    """
+    page = paginate(
+        filtered_listings(request).values(*LISTING_FIELDS, **LISTING_EXPRESSIONS),
+        after=request.GET.get("after"),
+        before=request.GET.get("before")
+    )
+    return JsonResponse({
+        "results": list(page),
+        "next": page.next_cursor,
+        "previous": page.previous_cursor
+    })
+
+
+@require_GET
+@condition(etag_func=listing_etag, last_modified_func=listing_last_modified)
+def listing(request, pk):
+    """
+    Returns details of a listing
+
+    Args:
+        pk: Primary key of a listing
+    """
+    listing = (Listing.objects
+        .filter(pk=pk)
+        .values(*LISTING_DETAIL_FIELDS, **LISTING_DETAIL_EXPRESSIONS)
+        .first())
+    if listing is None:
+        return not_found()
+    return JsonResponse(listing)
+
+
+@require_GET
+@condition(etag_func=listing_etag, last_modified_func=listing_last_modified)
+def bids(request, pk):
+    """
+    Returns one page of the bid history of a listing, newest first.
+    Bids bump the listing's 'updated' stamp, so it also versions
+    the bid history.
+
+    Args:
+        pk: Primary key of a listing
+    """
+    if listing_stamp(request, pk) is None:
+        return not_found()
+    page = paginate(
+        Bid.objects.filter(listing=pk).values("id", "bid", "time", bidder_username=F("bidder__username")),
+        after=request.GET.get("after"),
+        before=request.GET.get("before")
+    )
+    return JsonResponse({
+        "results": list(page),
+        "next": page.next_cursor,
+        "previous": page.previous_cursor
+    })
+
+
+@require_GET
+@condition(etag_func=categories_etag)
+def categories(request):
+    """
+    Returns all categories
+    """
+    return JsonResponse({
+        "results": list(Category.objects.order_by("name").values("id", "name", "slug"))
+    })
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class AuctionsConfig(AppConfig):
     name = 'auctions'
+
+    def ready(self):
+        # Connect signal handlers
+        from . import signals
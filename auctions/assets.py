@@ -0,0 +1,205 @@
+"""
+Contains storage and serving of precompressed static assets
+
+Production builds ('manage.py build_assets') collect static files under
+content-hashed names, compile the stylesheets offline and write a gzip
+and, if the 'brotli' package is installed, a brotli variant next to
+every text asset. 'serve' hands out the smallest variant the client
+accepts. Hashed files never change, so they are cached as immutable.
+"""
+import gzip
+import mimetypes
+import os
+import posixpath
+import re
+
+from compressor.storage import CompressorFileStorage
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404
+from django.utils._os import safe_join
+from django.views.decorators.http import require_safe
+from django_libsass import SassCompiler, get_include_paths
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Extensions of files worth compressing, images are compressed already
+COMPRESSIBLE = (".css", ".js", ".map", ".svg", ".json", ".txt", ".xml", ".html", ".ico", ".ttf", ".eot")
+
+# Files named by content: ManifestStaticFilesStorage copies ("styles.1a2b3c4d5e6f.css")
+# and compressor output ("CACHE/css/output.1a2b3c4d5e6f.css")
+HASHED_NAME = re.compile(r"(^|/)CACHE/|\.[0-9a-f]{12}\.[^/]+$")
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+# Imports in SCSS sources and the quoted names in them
+SASS_IMPORT = re.compile(r"@(?:import|use|forward)\s+([^;]+);")
+SASS_IMPORT_NAME = re.compile(r"[\"']([^\"']+)[\"']")
+
+# Compiled stylesheets by entry file, with the mtimes of their sources
+_compiled_sass = {}
+
+
+def resolve_sass_import(name, directories):
+    """
+    Returns the file an SCSS import refers to, trying partials
+    ("_name.scss") and index files like Sass does, or None
+    """
+    head, tail = os.path.split(name)
+    for directory in directories:
+        base = os.path.join(directory, head)
+        for candidate in (tail, f"{tail}.scss", f"_{tail}", f"_{tail}.scss",
+                          os.path.join(tail, "_index.scss"), os.path.join(tail, "index.scss")):
+            path = os.path.normpath(os.path.join(base, candidate))
+            if os.path.isfile(path):
+                return path
+    return None
+
+
+def sass_sources(filename, include_paths=(), sources=None):
+    """
+    Returns the set of files a stylesheet consists of:
+    the file itself and everything it imports, recursively
+    """
+    sources = set() if sources is None else sources
+    sources.add(filename)
+    with open(filename, encoding="utf-8") as f:
+        source = f.read()
+    for statement in SASS_IMPORT.findall(source):
+        for name in SASS_IMPORT_NAME.findall(statement):
+            # Plain CSS imports are left to the browser
+            if name.endswith(".css") or "://" in name:
+                continue
+            path = resolve_sass_import(name, [os.path.dirname(filename), *include_paths])
+            if path is not None and path not in sources:
+                sass_sources(path, include_paths, sources)
+    return sources
+
+
+def sass_mtimes(sources):
+    mtimes = {}
+    for path in sources:
+        try:
+            mtimes[path] = os.path.getmtime(path)
+        except OSError:
+            mtimes[path] = None
+    return mtimes
+
+
+class CachedSassCompiler(SassCompiler):
+    """
+    SassCompiler keeping its output per process until one of the files
+    of the stylesheet changes, partials included. Compiling Bootstrap
+    takes a few hundred milliseconds, which rendering pages in
+    development would otherwise pay on every request.
+    """
+    def input(self, **kwargs):
+        if not self.filename:
+            return super().input(**kwargs)
+        cached = _compiled_sass.get(self.filename)
+        if cached is not None and sass_mtimes(cached[0]) == cached[0]:
+            return cached[1]
+        mtimes = sass_mtimes(sass_sources(self.filename, get_include_paths()))
+        css = super().input(**kwargs)
+        _compiled_sass[self.filename] = (mtimes, css)
+        return css
+
+
+def write_compressed(path):
+    """
+    Writes gzip and brotli variants of a file, keeping only
+    those smaller than the file itself. Returns their paths.
+    """
+    if not path.endswith(COMPRESSIBLE):
+        return []
+    with open(path, "rb") as f:
+        data = f.read()
+    variants = [(".gz", gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append((".br", brotli.compress(data, quality=11)))
+    written = []
+    for suffix, compressed in variants:
+        if len(compressed) < len(data):
+            with open(path + suffix, "wb") as f:
+                f.write(compressed)
+            written.append(path + suffix)
+    return written
+
+
+class PrecompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Collects static files under content-hashed names and precompresses them
+    """
+    def post_process(self, paths, dry_run=False, **options):
+        names = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            names.update((name, hashed_name) if hashed_name else (name,))
+            yield name, hashed_name, processed
+        if dry_run:
+            return
+        # Files are rewritten while references are substituted, so compress at the end
+        for name in names:
+            if self.exists(name):
+                write_compressed(self.path(name))
+
+
+class PrecompressedCompressorStorage(CompressorFileStorage):
+    """
+    Storage of django-compressor output writing precompressed variants
+    """
+    def save(self, filename, content):
+        filename = super().save(filename, content)
+        write_compressed(self.path(filename))
+        return filename
+
+
+def accepted_encodings(header):
+    """
+    Returns the content codings an Accept-Encoding header allows
+    """
+    encodings = set()
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = params.strip()
+        if quality.startswith("q=") and quality[2:].strip() in ("0", "0.0", "0.00", "0.000"):
+            continue
+        encodings.add(coding.strip().lower())
+    return encodings
+
+
+@require_safe
+def serve(request, path):
+    """
+    Serves a file from STATIC_ROOT, precompressed if the client accepts
+    it. Content-hashed files are cached for a year, others revalidated.
+
+    Args:
+        path: Path of the file relative to STATIC_ROOT
+    """
+    try:
+        fullpath = safe_join(settings.STATIC_ROOT, posixpath.normpath(path).lstrip("/"))
+    except SuspiciousFileOperation:
+        raise Http404("No such file.")
+    if path.endswith((".gz", ".br")) or not os.path.isfile(fullpath):
+        raise Http404("No such file.")
+
+    content_type = mimetypes.guess_type(fullpath)[0] or "application/octet-stream"
+    encodings = accepted_encodings(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+    served, encoding = fullpath, None
+    for coding, suffix in (("br", ".br"), ("gzip", ".gz")):
+        if coding in encodings and os.path.isfile(fullpath + suffix):
+            served, encoding = fullpath + suffix, coding
+            break
+
+    response = FileResponse(open(served, "rb"), content_type=content_type)
+    if encoding:
+        response["Content-Encoding"] = encoding
+    if path.endswith(COMPRESSIBLE):
+        response["Vary"] = "Accept-Encoding"
+    response["Cache-Control"] = IMMUTABLE if HASHED_NAME.search(path) else "no-cache"
+    return response
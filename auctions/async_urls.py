@@ -0,0 +1,16 @@
+"""
+Routes the pages served by auctions.async_views under ASGI. They keep
+the URLs and names of their sync versions, all other URLs are routed
+by auctions.urls.
+"""
+from django.urls import path
+
+from . import async_views
+
+urlpatterns = [
+    path("", async_views.index, name="index"),
+    path("categories", async_views.categories, name="categories"),
+    path("categories/<slug:slug>", async_views.categories, name="category"),
+    path("listings/<str:pk>", async_views.listings, name="listings"),
+    path("watchlist/<str:username>", async_views.watchlist, name="watchlist"),
+]
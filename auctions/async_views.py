@@ -0,0 +1,160 @@
+"""
+Contains async versions of the read-heavy views, served under ASGI
+
+Under ASGI the pages below are handled on the event loop with the
+async ORM interfaces, so a worker keeps serving while requests wait
+on the database, slow clients or live update streams. Writes stay in
+the sync views, which Django runs in a thread: bids and comments use
+transactions, which need a single thread.
+
+auctions.async_urls maps these views to the same URLs and names as
+their sync versions in auctions.views. WSGI servers keep using the
+sync views, which avoid the cost of an event loop per request.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.shortcuts import render
+from django.utils import timezone
+
+from . import views
+from .bidding import abid_history
+from .caching import acategory_counts
+from .events import live_updates
+from .forms import AddBid, AddComment
+from .models import Category, Listing
+from .pagecache import cache_anonymous_page
+from .pagination import apaginate
+
+
+async def load_user(request):
+    """
+    Resolves the lazy 'request.user' in the sync thread, so views and
+    templates can use it on the event loop. With cached sessions and
+    users this costs no queries.
+    """
+    await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
+
+
+def login_required(view):
+    """
+    Async version of django.contrib.auth.decorators.login_required
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not (await load_user(request)).is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+async def alistings_page(request, queryset, **kwargs):
+    """
+    Async version of views.listings_page
+    """
+    return await apaginate(
+        queryset,
+        after=request.GET.get("after"),
+        before=request.GET.get("before"),
+        **kwargs
+    )
+
+
+@cache_anonymous_page("lists")
+async def index(request):
+    """
+    Async version of views.index
+    """
+    listings = Listing.objects.filter(active=True).cards()
+    if request.GET.get("sort") == "ending":
+        page = await alistings_page(
+            request,
+            listings.filter(ends_at__gt=timezone.now()),
+            field="ends_at",
+            descending=False
+        )
+        sort = "ending"
+    else:
+        page = await alistings_page(request, listings)
+        sort = None
+    await load_user(request)
+    return render(request, "auctions/index.html", {
+        "listings": page,
+        "page": page,
+        "sortable": True,
+        "sort": sort
+    })
+
+
+@cache_anonymous_page("lists")
+async def categories(request, slug=None):
+    """
+    Async version of views.categories
+
+    Args:
+        slug (optional): Category slug. Defaults to None.
+    """
+    if slug is None:
+        categories = await acategory_counts()
+        await load_user(request)
+        return render(request, "auctions/categories.html", {
+            "categories": categories
+        })
+    category = await Category.objects.filter(slug=slug).afirst()
+    if category is None:
+        return await sync_to_async(views.category_by_name)(slug)
+    page = await alistings_page(request, category.listings.filter(active=True).cards())
+    await load_user(request)
+    return render(request, "auctions/category.html", {
+        "category": category,
+        "listings": page,
+        "page": page
+    })
+
+
+@cache_anonymous_page("listing")
+async def listings(request, pk):
+    """
+    Async version of views.listings for GET requests. POSTs are handed
+    to the sync view.
+
+    Args:
+        pk: Primary key of a listing
+    """
+    if request.method == "POST":
+        return await sync_to_async(views.listings)(request, pk=pk)
+    # The template compares the winner to the user, so join it as well
+    listing = await Listing.objects.select_related("owner", "winner").aget(pk=pk)
+    user = await load_user(request)
+    watched = user.is_authenticated and await user.watchlist.filter(pk=listing.pk).aexists()
+    comments = await apaginate(
+        views.comments_query(listing.pk), page_size=getattr(settings, "COMMENTS_PER_PAGE", 10)
+    )
+    return render(request, "auctions/listing.html", {
+        "listing": listing,
+        "watched": watched,
+        "comments": comments,
+        "bids": await abid_history(listing.pk) if listing.bid_count else None,
+        "bid_form": AddBid(auto_id=False),
+        "comment_form": AddComment(auto_id=False),
+        "live_updates": live_updates(request)
+    })
+
+
+@login_required
+async def watchlist(request, username):
+    """
+    Async version of views.watchlist
+
+    Args:
+        username: Username of the logged in user.
+                  Only for aesthetic purpose.
+    """
+    page = await alistings_page(request, request.user.watchlist.cards())
+    return render(request, "auctions/watchlist.html", {
+        "listings": page,
+        "page": page
+    })
@@ -0,0 +1,43 @@
+"""
+Contains the authentication backend caching users
+
+AuthenticationMiddleware loads the logged in user on every request.
+The backend keeps users in the cache, so together with the cached
+session engine, a page view needs no session or user queries once the
+cache is warm. Signal handlers drop cached users whenever they are
+saved (profile and password changes, logins), deleted, log out or
+change their watchlist. Bulk updates through User.objects drop the
+users they touch, raw SQL has to call 'invalidate_user' itself.
+"""
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import transaction
+
+USER_CACHE_TIMEOUT = 60 * 60
+
+
+def user_cache_key(user_id):
+    return f"auth_user:{user_id}"
+
+
+def invalidate_user(user_id):
+    """
+    Drops a cached user once the current transaction commits, so the
+    user is not cached again from data about to change
+    """
+    transaction.on_commit(lambda: cache.delete(user_cache_key(user_id)))
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend loading logged in users from the cache
+    """
+    def get_user(self, user_id):
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            cache.set(key, user, USER_CACHE_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,564 @@
+"""
+Contains the end-to-end performance benchmark of the views
+
+A synthetic marketplace is seeded with bulk inserts, then every view
+is driven through the Django test client. Each scenario reports
+latency percentiles, the number of queries and the peak memory
+allocated while handling one request.
+
+'concurrency' measures the throughput of concurrent readers loading
+the index page and writers placing bids, to compare SQLite settings.
+
+'servers' serves the same pages through the WSGI and the ASGI handler
+while live update streams are requested, to compare both deployments.
+"""
+import asyncio
+import queue
+import random
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import Future
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO
+
+from django.contrib.auth.hashers import make_password
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.db import OperationalError, connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .bidding import place_bid
+from .events import get_broker
+from .models import Bid, Category, Comment, Listing, User
+from .pagination import paginate
+
+# Default size of the seeded marketplace
+DEFAULT_SCALE = {
+    "users": 200,
+    "categories": 20,
+    "listings": 5000,
+    "bids": 20000,
+    "comments": 10000,
+    "watchlist": 10,
+}
+
+
+def seed(scale, batch_size=2000, seed_value=0):
+    """
+    Fills the database with a synthetic marketplace
+
+    Args:
+        scale: Number of users, categories, listings, bids, comments and
+               watched listings per user, keyed as in DEFAULT_SCALE
+        batch_size (optional): Rows per bulk insert
+        seed_value (optional): Seed of the random generator
+    """
+    rng = random.Random(seed_value)
+    now = timezone.now()
+    password = make_password("benchmark")
+
+    User.objects.bulk_create((
+        User(username=f"user{i}", email=f"user{i}@example.com", password=password)
+        for i in range(scale["users"])
+    ), batch_size=batch_size)
+    user_ids = list(User.objects.values_list("pk", flat=True))
+
+    Category.objects.bulk_create((
+        Category(name=f"Category {i}", slug=f"category-{i}") for i in range(scale["categories"])
+    ), batch_size=batch_size)
+    category_ids = list(Category.objects.values_list("pk", flat=True))
+
+    def listings():
+        for i in range(scale["listings"]):
+            price = Decimal(rng.randint(100, 10000)) / 100
+            yield Listing(
+                owner_id=rng.choice(user_ids),
+                title=f"Item {i} {rng.choice(['lamp', 'chair', 'book', 'bike', 'watch'])}",
+                description=" ".join(rng.choice(["old", "new", "rare", "shiny", "used"]) for _ in range(30)),
+                startingPrice=price,
+                current_price=price,
+                category_id=rng.choice(category_ids) if rng.random() < 0.8 else None,
+                ends_at=now + timedelta(minutes=rng.randint(1, 60 * 24 * 7)) if rng.random() < 0.5 else None
+            )
+    Listing.objects.bulk_create(listings(), batch_size=batch_size)
+    listing_ids = list(Listing.objects.values_list("pk", flat=True))
+
+    Bid.objects.bulk_create((
+        Bid(
+            listing_id=rng.choice(listing_ids),
+            bidder_id=rng.choice(user_ids),
+            bid=Decimal(rng.randint(10000, 99999)) / 100
+        )
+        for _ in range(scale["bids"])
+    ), batch_size=batch_size)
+
+    Comment.objects.bulk_create((
+        Comment(
+            listing_id=rng.choice(listing_ids),
+            commenter_id=rng.choice(user_ids),
+            content="Is this still available?"
+        )
+        for _ in range(scale["comments"])
+    ), batch_size=batch_size)
+
+    Watchlist = User.watchlist.through
+    Watchlist.objects.bulk_create((
+        Watchlist(user_id=user_id, listing_id=listing_id)
+        for user_id in user_ids
+        for listing_id in rng.sample(listing_ids, min(scale["watchlist"], len(listing_ids)))
+    ), batch_size=batch_size)
+
+    # bulk_create skips the signal handlers maintaining listing data
+    Listing.objects.update_bid_stats()
+    Listing.objects.update_watcher_count()
+
+
+def scenarios():
+    """
+    Returns the benchmarked requests as (name, method, url, data, login)
+    tuples. 'data' is called with the iteration number.
+    """
+    user = User.objects.order_by("pk").first()
+    listing = Listing.objects.filter(active=True).order_by("-bid_count").first()
+    category = Category.objects.order_by("pk").first()
+    second_page = paginate(Listing.objects.filter(active=True)).next_cursor
+    return [
+        ("index", "get", reverse("index"), None, False),
+        ("index_page_2", "get", f"{reverse('index')}?after={second_page}", None, False),
+        ("index_ending_soon", "get", f"{reverse('index')}?sort=ending", None, False),
+        ("categories", "get", reverse("categories"), None, False),
+        ("category", "get", reverse("category", args=[category.slug]), None, False),
+        ("listing", "get", reverse("listings", args=[listing.pk]), None, False),
+        ("listing_logged_in", "get", reverse("listings", args=[listing.pk]), None, True),
+        ("watchlist", "get", reverse("watchlist", args=[user.username]), None, True),
+        ("search", "get", f"{reverse('search')}?q=lamp", None, False),
+        ("new_listing_form", "get", reverse("new_listing"), None, True),
+        ("new_listing_post", "post", reverse("new_listing"), lambda i: {
+            "title": f"Benchmark {i}", "description": "Benchmark listing", "startingPrice": "10"
+        }, True),
+        ("bid_post", "post", reverse("listings", args=[listing.pk]), lambda i: {
+            "new_bid": "", "bid": str(Decimal(100000 + i))
+        }, True),
+        ("comment_post", "post", reverse("listings", args=[listing.pk]), lambda i: {
+            "new_comment": "", "comment": "Benchmark comment"
+        }, True),
+        ("login_form", "get", reverse("login"), None, False),
+        ("api_listings", "get", reverse("api_listings"), None, False),
+        ("api_listing", "get", reverse("api_listing", args=[listing.pk]), None, False),
+    ]
+
+
+def percentile(values, fraction):
+    """
+    Returns the value below which 'fraction' of the sorted values lie
+    """
+    index = min(len(values) - 1, max(0, round(fraction * len(values)) - 1))
+    return values[index]
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+@override_settings(THROTTLE_RATES={})
+def run(requests=50, warmup=3):
+    """
+    Runs every scenario and returns the results keyed by scenario name.
+    Throttling is off, it would answer most of the repeated POSTs with
+    429. Raises BenchmarkError if a request fails, as the timings of
+    error responses say nothing about the view.
+
+    Args:
+        requests (optional): Timed requests per scenario. Defaults to 50.
+        warmup (optional): Untimed requests per scenario. Defaults to 3.
+    """
+    anonymous = Client()
+    logged_in = Client()
+    logged_in.force_login(User.objects.order_by("pk").first())
+    results = {}
+    for name, method, url, data, login in scenarios():
+        client = logged_in if login else anonymous
+        send = getattr(client, method)
+        iteration = 0
+
+        def request():
+            nonlocal iteration
+            iteration += 1
+            response = send(url, data(iteration)) if data else send(url)
+            if response.status_code >= 400:
+                raise BenchmarkError(f"{name}: {method.upper()} {url} answered {response.status_code}")
+            return response
+
+        for _ in range(warmup):
+            request()
+        timings = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            request()
+            timings.append((time.perf_counter() - start) * 1000)
+        # Queries and memory are measured separately, both slow requests down
+        with CaptureQueriesContext(connection) as queries:
+            tracemalloc.start()
+            response = request()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        timings.sort()
+        results[name] = {
+            "status": response.status_code,
+            "requests": requests,
+            "mean_ms": round(statistics.mean(timings), 3),
+            "p50_ms": round(percentile(timings, 0.50), 3),
+            "p95_ms": round(percentile(timings, 0.95), 3),
+            "p99_ms": round(percentile(timings, 0.99), 3),
+            "queries": len(queries),
+            "peak_memory_kb": round(peak / 1024, 1),
+        }
+    return results
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Returns a list of regressions against a baseline: scenarios whose
+    p95 latency grew by more than 'tolerance', that run more queries,
+    answer with another status or suddenly run no queries at all, which
+    means they no longer reach the view
+
+    Args:
+        results: Results as returned by 'run'
+        baseline: Earlier results
+        tolerance (optional): Allowed relative slowdown. Defaults to 0.25.
+    """
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: p95 {result['p95_ms']} ms, baseline {before['p95_ms']} ms"
+            )
+        if result["queries"] > before["queries"] or (before["queries"] and not result["queries"]):
+            regressions.append(
+                f"{name}: {result['queries']} queries, baseline {before['queries']}"
+            )
+        if "status" in before and result.get("status") != before["status"]:
+            regressions.append(
+                f"{name}: status {result['status']}, baseline {before['status']}"
+            )
+    return regressions
+
+
+def concurrency(readers=4, writers=4, seconds=5.0, seed_value=0):
+    """
+    Runs reader and writer threads against the database for a while and
+    returns their throughput, latency and number of failed operations.
+    Readers load the first index page, writers bid on random listings.
+    Each thread uses its own connection, so the database must be a file.
+
+    Args:
+        readers (optional): Number of reader threads
+        writers (optional): Number of writer threads
+        seconds (optional): Duration of the run
+        seed_value (optional): Seed of the random generator
+    """
+    listing_ids = list(Listing.objects.filter(active=True).values_list("pk", flat=True))
+    bidder_ids = list(User.objects.values_list("pk", flat=True))
+    timings = {"read": [], "write": []}
+    errors = {"read": 0, "write": 0}
+    lock = threading.Lock()
+    start = threading.Event()
+    deadline = 0
+
+    def read(rng):
+        list(paginate(Listing.objects.filter(active=True).cards()).object_list)
+
+    def write(rng):
+        listing_id = rng.choice(listing_ids)
+        price = Listing.objects.filter(pk=listing_id).values_list("current_price", flat=True).get()
+        place_bid(listing_id, User(pk=rng.choice(bidder_ids)), price + 1)
+
+    def worker(kind, operation, number):
+        rng = random.Random(f"{seed_value}-{kind}-{number}")
+        local_timings, local_errors = [], 0
+        start.wait()
+        try:
+            while time.perf_counter() < deadline:
+                began = time.perf_counter()
+                try:
+                    operation(rng)
+                except OperationalError:
+                    # "database is locked" once the busy timeout ran out
+                    local_errors += 1
+                else:
+                    local_timings.append((time.perf_counter() - began) * 1000)
+        finally:
+            connection.close()
+        with lock:
+            timings[kind].extend(local_timings)
+            errors[kind] += local_errors
+
+    threads = [
+        threading.Thread(target=worker, args=("read", read, i)) for i in range(readers)
+    ] + [
+        threading.Thread(target=worker, args=("write", write, i)) for i in range(writers)
+    ]
+    for thread in threads:
+        thread.start()
+    deadline = time.perf_counter() + seconds
+    start.set()
+    for thread in threads:
+        thread.join()
+
+    results = {}
+    for kind, values in timings.items():
+        values.sort()
+        results[kind] = {
+            "threads": readers if kind == "read" else writers,
+            "operations": len(values),
+            "per_second": round(len(values) / seconds, 1),
+            "p50_ms": round(percentile(values, 0.50), 3) if values else None,
+            "p95_ms": round(percentile(values, 0.95), 3) if values else None,
+            "errors": errors[kind],
+        }
+    return results
+
+
+def server_paths():
+    """
+    Returns the paths requested in the server benchmark: the read-heavy
+    pages served by async views under ASGI
+    """
+    listing = Listing.objects.filter(active=True).order_by("-bid_count").first()
+    category = Category.objects.order_by("pk").first()
+    return [
+        reverse("index"),
+        f"{reverse('index')}?sort=ending",
+        reverse("categories"),
+        reverse("category", args=[category.slug]),
+        reverse("listings", args=[listing.pk]),
+    ]
+
+
+def wsgi_environ(path):
+    path, _, query = path.partition("?")
+    return {
+        "REQUEST_METHOD": "GET",
+        "SCRIPT_NAME": "",
+        "PATH_INFO": path,
+        "QUERY_STRING": query,
+        "SERVER_NAME": "testserver",
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "HTTP_HOST": "testserver",
+        "REMOTE_ADDR": "127.0.0.1",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": "http",
+        "wsgi.input": BytesIO(),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+
+
+def asgi_scope(path):
+    path, _, query = path.partition("?")
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [(b"host", b"testserver")],
+        "client": ("127.0.0.1", 0),
+        "server": ("testserver", 80),
+    }
+
+
+def summarize(timings, errors, seconds):
+    timings.sort()
+    return {
+        "requests": len(timings),
+        "per_second": round(len(timings) / seconds, 1),
+        "p50_ms": round(percentile(timings, 0.50), 3) if timings else None,
+        "p95_ms": round(percentile(timings, 0.95), 3) if timings else None,
+        "p99_ms": round(percentile(timings, 0.99), 3) if timings else None,
+        "max_ms": round(timings[-1], 3) if timings else None,
+        "errors": errors,
+    }
+
+
+def end_streams(listing_id, deadline, done):
+    """
+    Ends live update streams of a listing at 'deadline' by announcing
+    it closed, until 'done' returns True
+    """
+    time.sleep(max(0, deadline - time.perf_counter()))
+    while not done():
+        get_broker().publish(listing_id, {"id": listing_id, "active": False})
+        time.sleep(0.01)
+
+
+def serve_wsgi(paths, stream_path, listing_id, clients, workers, streams, seconds):
+    """
+    Serves requests through the WSGI handler in 'workers' threads, like
+    a threaded WSGI server. Live update streams are answered with 204
+    under WSGI, so they only hold a worker for one request.
+    """
+    handler = get_wsgi_application()
+    jobs = queue.Queue()
+
+    def handle(path):
+        status = []
+        body = handler(wsgi_environ(path), lambda line, headers, exc_info=None: status.append(line))
+        try:
+            for _ in body:
+                pass
+        finally:
+            body.close()
+        return int(status[0].split()[0])
+
+    def worker():
+        try:
+            while (job := jobs.get()) is not None:
+                path, future = job
+                try:
+                    future.set_result(handle(path))
+                except Exception as e:
+                    future.set_exception(e)
+        finally:
+            connection.close()
+
+    def submit(path):
+        future = Future()
+        jobs.put((path, future))
+        return future
+
+    timings, errors, lock = [], 0, threading.Lock()
+
+    def client(number):
+        nonlocal errors
+        rng = random.Random(number)
+        local_timings, local_errors = [], 0
+        while time.perf_counter() < deadline:
+            began = time.perf_counter()
+            try:
+                status = submit(rng.choice(paths)).result()
+            except Exception:
+                status = 500
+            if status >= 500:
+                local_errors += 1
+            else:
+                local_timings.append((time.perf_counter() - began) * 1000)
+        with lock:
+            timings.extend(local_timings)
+            errors += local_errors
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for path in paths:
+        submit(path).result()
+    deadline = time.perf_counter() + seconds
+    stream_futures = [submit(stream_path) for _ in range(streams)]
+    ender = threading.Thread(
+        target=end_streams,
+        args=(listing_id, deadline, lambda: all(future.done() for future in stream_futures))
+    )
+    clients = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in [ender, *clients]:
+        thread.start()
+    for thread in [ender, *clients]:
+        thread.join()
+    for _ in threads:
+        jobs.put(None)
+    for thread in threads:
+        thread.join()
+    return summarize(timings, errors, seconds)
+
+
+async def serve_asgi(paths, stream_path, listing_id, clients, streams, seconds):
+    """
+    Serves requests through the ASGI handler on one event loop, like one
+    ASGI worker. Open streams only hold a suspended coroutine each.
+    """
+    handler = get_asgi_application()
+
+    async def handle(path):
+        status = None
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+        await handler(asgi_scope(path), receive, send)
+        return status
+
+    timings, errors = [], 0
+
+    async def client(number):
+        nonlocal errors
+        rng = random.Random(number)
+        while time.perf_counter() < deadline:
+            began = time.perf_counter()
+            try:
+                status = await handle(rng.choice(paths))
+            except Exception:
+                status = 500
+            if status >= 500:
+                errors += 1
+            else:
+                timings.append((time.perf_counter() - began) * 1000)
+
+    for path in paths:
+        await handle(path)
+    deadline = time.perf_counter() + seconds
+    stream_tasks = [asyncio.create_task(handle(stream_path)) for _ in range(streams)]
+    await asyncio.gather(
+        *(client(i) for i in range(clients)),
+        asyncio.to_thread(end_streams, listing_id, deadline, lambda: all(task.done() for task in stream_tasks)),
+        *stream_tasks
+    )
+    return summarize(timings, errors, seconds)
+
+
+def servers(clients=32, workers=8, streams=4, seconds=5.0):
+    """
+    Serves the same mix of pages through the WSGI and the ASGI handler
+    and returns the throughput and latency of both. 'clients' request
+    pages back to back, while 'streams' clients request a listing's live
+    update stream, like browsers on listing pages. Under ASGI the streams
+    stay open for the whole run.
+    Latencies include the time requests wait for a free WSGI worker.
+
+    Args:
+        clients (optional): Number of concurrent clients loading pages
+        workers (optional): Number of WSGI worker threads
+        streams (optional): Number of live update streams held open
+        seconds (optional): Duration of each run
+    """
+    paths = server_paths()
+    listing_id = Listing.objects.filter(active=True).order_by("pk").values_list("pk", flat=True).first()
+    stream_path = reverse("listing_events", args=[listing_id])
+    results = {"wsgi": serve_wsgi(paths, stream_path, listing_id, clients, workers, streams, seconds)}
+    results["wsgi"]["workers"] = workers
+    with override_settings(ROOT_URLCONF="commerce.asgi_urls"):
+        results["asgi"] = asyncio.run(serve_asgi(paths, stream_path, listing_id, clients, streams, seconds))
+    results["asgi"]["workers"] = 1
+    for result in results.values():
+        result.update(clients=clients, streams=streams)
+    return results
@@ -0,0 +1,137 @@
+"""
+Contains the bid placement service
+
+A bid is committed with a single conditional UPDATE on the listing
+(compare-and-swap on 'current_price'), so of two concurrent bidders
+only one can win a given price level. The transaction starts with
+BEGIN IMMEDIATE, so SQLite takes its write lock right away instead of
+upgrading a read lock later on.
+
+The bid history is computed in SQL as well. Its window functions only
+run over the rows of one page, cut by a keyset on (bid, id), so deep
+pages of listings with tens of thousands of bids stay cheap.
+"""
+import enum
+from collections import namedtuple
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import F, OuterRef, Q, Subquery, Window
+from django.db.models.functions import Lag
+from django.utils import timezone
+
+from .db import immediate_atomic
+from .models import Bid, Listing
+from .pagination import Page, decode_cursor, encode_cursor
+
+
+class BidStatus(enum.Enum):
+    """
+    Possible outcomes of placing a bid
+    """
+    ACCEPTED = "accepted"
+    OUTBID = "outbid"
+    CLOSED = "closed"
+
+
+# 'bid' is only set for accepted bids. 'current_price' is the listing's
+# price after the attempt, or None if the listing no longer exists.
+BidResult = namedtuple("BidResult", ["status", "bid", "current_price"])
+
+
+def place_bid(listing_id, bidder, amount):
+    """
+    Places a bid on a listing if it beats the current price.
+    The first bid only has to match the starting price.
+
+    Args:
+        listing_id: Primary key of the listing
+        bidder: User placing the bid
+        amount: Bid as a Decimal, e.g. from the 'AddBid' form
+    """
+    now = timezone.now()
+    with immediate_atomic():
+        # Claim the new price only if the auction is open and the bid is high enough
+        claimed = (Listing.objects
+            .filter(pk=listing_id, active=True)
+            .filter(Q(ends_at__isnull=True) | Q(ends_at__gt=now))
+            .filter(Q(current_price__lt=amount) | Q(bid_count=0, current_price__lte=amount))
+            .update(current_price=amount))
+        if claimed:
+            # The Bid signal handler counts the bid and sets 'currentBid'
+            bid = Bid.objects.create(bidder=bidder, listing_id=listing_id, bid=amount)
+            return BidResult(BidStatus.ACCEPTED, bid, amount)
+
+        listing = (Listing.objects
+            .filter(pk=listing_id)
+            .values("active", "ends_at", "current_price")
+            .first())
+    # Auctions past their end time are closed, even before the worker got to them
+    if listing is None or not listing["active"] or (listing["ends_at"] and listing["ends_at"] <= now):
+        return BidResult(BidStatus.CLOSED, None, listing and listing["current_price"])
+    return BidResult(BidStatus.OUTBID, None, listing["current_price"])
+
+
+def bid_history_query(listing_id, after=None, page_size=None):
+    """
+    Returns the queryset fetching one page of a listing's bid history
+    and a function turning its rows into the Page. Lets 'bid_history'
+    and 'abid_history' share everything but the fetch.
+    """
+    page_size = page_size or getattr(settings, "BIDS_PER_PAGE", 10)
+    bids = Bid.objects.filter(listing_id=listing_id)
+    cursor = decode_cursor(after, parse=Decimal)
+    if cursor:
+        amount, pk = cursor
+        bids = bids.filter(Q(bid__lt=amount) | Q(bid=amount, pk__lt=pk))
+    # The page plus the next lower bid, which the last increment is taken
+    # over. Windows see only these rows, not the listing's whole history.
+    window = bids.order_by("-bid", "-pk").values("pk")[:page_size + 1]
+    query = (Bid.objects
+        .filter(pk__in=window)
+        .select_related("bidder")
+        .only("bid", "time", "bidder__username")
+        .annotate(
+            increment=F("bid") - Window(Lag("bid"), order_by=[F("bid").asc(), F("pk").asc()]),
+            bidder_max=Subquery(Bid.objects
+                .filter(listing_id=listing_id, bidder=OuterRef("bidder"))
+                .order_by("-bid")
+                .values("bid")[:1])
+        )
+        .order_by("-bid", "-pk"))
+
+    def make_page(rows):
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        # SQLite computes on floats, round the results to the column's precision
+        precision = Decimal(1).scaleb(-Bid._meta.get_field("bid").decimal_places)
+        for bid in rows:
+            bid.bidder_max = bid.bidder_max.quantize(precision)
+            if bid.increment is not None:
+                bid.increment = bid.increment.quantize(precision)
+        return Page(rows, next_cursor=encode_cursor(rows[-1], "bid") if has_next else None)
+    return query, make_page
+
+
+def bid_history(listing_id, after=None, page_size=None):
+    """
+    Returns one page of a listing's bids, highest first, with the
+    bidders joined. Each bid is annotated with
+        - 'increment': amount over the next lower bid, None for the first bid
+        - 'bidder_max': highest bid of the same bidder on the listing
+
+    Args:
+        listing_id: Primary key of the listing
+        after (optional): Cursor of the last bid of the previous page
+        page_size (optional): Defaults to settings.BIDS_PER_PAGE
+    """
+    query, make_page = bid_history_query(listing_id, after, page_size)
+    return make_page(list(query))
+
+
+async def abid_history(listing_id, after=None, page_size=None):
+    """
+    Async version of 'bid_history' for async views
+    """
+    query, make_page = bid_history_query(listing_id, after, page_size)
+    return make_page([bid async for bid in query])
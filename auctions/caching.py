@@ -0,0 +1,54 @@
+"""
+Contains cached data shared between views
+
+The number of active listings per category is computed for all
+categories in one aggregate query and kept in the cache until a
+listing is created, edited, closed or deleted.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import Category
+
+CATEGORY_COUNTS_KEY = "category_counts"
+# Upper bound on staleness, should an invalidation ever be missed
+CATEGORY_COUNTS_TIMEOUT = 60 * 60
+
+
+def category_counts_query():
+    return (Category.objects
+        .order_by("name")
+        .values("id", "name", "slug")
+        .annotate(listing_count=Count("listings", filter=Q(listings__active=True))))
+
+
+def category_counts():
+    """
+    Returns all categories ordered by name as dicts with 'id', 'name',
+    'slug' and 'listing_count', the number of active listings
+    """
+    categories = cache.get(CATEGORY_COUNTS_KEY)
+    if categories is None:
+        categories = list(category_counts_query())
+        cache.set(CATEGORY_COUNTS_KEY, categories, CATEGORY_COUNTS_TIMEOUT)
+    return categories
+
+
+async def acategory_counts():
+    """
+    Async version of 'category_counts' for async views
+    """
+    categories = await cache.aget(CATEGORY_COUNTS_KEY)
+    if categories is None:
+        categories = [category async for category in category_counts_query()]
+        await cache.aset(CATEGORY_COUNTS_KEY, categories, CATEGORY_COUNTS_TIMEOUT)
+    return categories
+
+
+def invalidate_category_counts():
+    """
+    Drops the cached category counts once the current transaction
+    commits, so they are not recomputed from uncommitted data
+    """
+    transaction.on_commit(lambda: cache.delete(CATEGORY_COUNTS_KEY))
@@ -0,0 +1,55 @@
+"""
+Contains closing of auctions whose end time has passed
+
+Due listings are found through the (active, ends_at) index and closed
+in batches with set-based UPDATEs, winners coming from the current
+bid. Claiming and closing happen in the same UPDATE, so any number of
+workers can run at once without closing a listing twice.
+"""
+from django.utils import timezone
+
+from .caching import invalidate_category_counts
+from .dashboard import invalidate_listing_dashboards
+from .db import immediate_atomic
+from .models import Listing
+from .pagecache import purge_listing_pages
+from .signals import publish_listing
+
+
+def due_listings(now=None):
+    """
+    Returns active listings whose end time has passed, earliest first
+    """
+    return (Listing.objects
+        .filter(active=True, ends_at__lte=now or timezone.now())
+        .order_by("ends_at"))
+
+
+def close_due_listings(batch_size=500, now=None):
+    """
+    Closes one batch of due listings and returns the ids of the
+    listings closed by this call
+
+    Args:
+        batch_size (optional): Maximum number of listings to close. Defaults to 500.
+        now (optional): Reference time. Defaults to the current time.
+    """
+    now = now or timezone.now()
+    # Unique stamp telling this batch apart from concurrent ones
+    stamp = timezone.now()
+    with immediate_atomic():
+        # The UPDATE comes first so SQLite takes its write lock right away
+        closed = (Listing.objects
+            .filter(pk__in=due_listings(now).values("pk")[:batch_size])
+            .close(now=stamp))
+        if not closed:
+            return []
+        ids = list(Listing.objects
+            .filter(active=False, updated=stamp, ends_at__lte=now)
+            .values_list("pk", flat=True))
+        for pk in ids:
+            publish_listing(pk)
+        invalidate_category_counts()
+        invalidate_listing_dashboards(ids)
+        purge_listing_pages(ids)
+    return ids
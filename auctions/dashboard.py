@@ -0,0 +1,136 @@
+"""
+Contains the per-user dashboard
+
+The dashboard shows a user's own listings, the auctions they are
+leading, those where they have been outbid, and their winnings. Every
+section is one query, however many listings it spans: the user's
+highest bid is a correlated subquery served by the (listing, bidder,
+bid) index and compared to the denormalized current price, and the
+current bid and its bidder are joined.
+
+The section counters are one aggregate query, cached per user until
+a listing the user owns, bids on or wins changes.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+
+from .models import Bid, Listing
+
+# Section names and headings in display order
+SECTIONS = {
+    "listings": "My listings",
+    "leading": "Leading bids",
+    "outbid": "Outbid",
+    "won": "Won auctions",
+}
+
+DASHBOARD_COUNTS_KEY = "dashboard_counts:{}"
+# Upper bound on staleness, should an invalidation ever be missed
+DASHBOARD_COUNTS_TIMEOUT = 60 * 60
+
+
+def highest_bid(user):
+    """
+    Returns a subquery of the user's highest bid on the outer listing
+    """
+    return Subquery(Bid.objects
+        .filter(listing=OuterRef("pk"), bidder=user)
+        .order_by("-bid")
+        .values("bid")[:1])
+
+
+def section(user, name):
+    """
+    Returns the listings of a dashboard section, with the current bid
+    and its bidder joined. All but "listings" are annotated with
+    'my_bid', the user's highest bid.
+
+    Args:
+        user: User the dashboard belongs to
+        name: One of SECTIONS
+    """
+    listings = (Listing.objects
+        .select_related("currentBid__bidder")
+        .only(
+            "title", "current_price", "bid_count", "time", "active", "ends_at",
+            "currentBid__bid", "currentBid__bidder__username"
+        ))
+    if name == "listings":
+        return listings.filter(owner=user)
+    if name == "won":
+        return listings.filter(winner=user).annotate(my_bid=highest_bid(user))
+    # Only look at listings the user has bid on, through the index on Bid.bidder
+    bid_on = (listings
+        .filter(active=True, pk__in=Bid.objects.filter(bidder=user).values("listing"))
+        .annotate(my_bid=highest_bid(user)))
+    if name == "leading":
+        return bid_on.filter(my_bid__gte=F("current_price"))
+    if name == "outbid":
+        return bid_on.filter(my_bid__lt=F("current_price"))
+    raise ValueError(f"Unknown dashboard section {name!r}")
+
+
+def dashboard_counts(user):
+    """
+    Returns the number of listings in each dashboard section as a dict
+    """
+    key = DASHBOARD_COUNTS_KEY.format(user.pk)
+    counts = cache.get(key)
+    if counts is None:
+        counts = (Listing.objects
+            .filter(
+                Q(owner=user) | Q(winner=user)
+                | Q(active=True, pk__in=Bid.objects.filter(bidder=user).values("listing"))
+            )
+            .annotate(my_bid=highest_bid(user))
+            .aggregate(
+                listings=Count("pk", filter=Q(owner=user)),
+                leading=Count("pk", filter=Q(active=True, my_bid__gte=F("current_price"))),
+                outbid=Count("pk", filter=Q(active=True, my_bid__lt=F("current_price"))),
+                won=Count("pk", filter=Q(winner=user))
+            ))
+        cache.set(key, counts, DASHBOARD_COUNTS_TIMEOUT)
+    return counts
+
+
+def invalidate_dashboards(user_ids):
+    """
+    Drops the cached counters of users once the current transaction commits
+    """
+    keys = [DASHBOARD_COUNTS_KEY.format(pk) for pk in set(user_ids) if pk is not None]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_listing_dashboards(listing_ids):
+    """
+    Drops the cached counters of the owners and bidders of listings,
+    e.g. after closing them, once the current transaction commits
+    """
+    listing_ids = list(listing_ids)
+
+    def invalidate():
+        user_ids = set(Listing.objects.filter(pk__in=listing_ids).values_list("owner", flat=True))
+        user_ids.update(Bid.objects
+            .filter(listing__in=listing_ids)
+            .order_by()
+            .values_list("bidder", flat=True)
+            .distinct())
+        cache.delete_many([DASHBOARD_COUNTS_KEY.format(pk) for pk in user_ids])
+    transaction.on_commit(invalidate)
+
+
+def invalidate_bid_dashboards(bid):
+    """
+    Drops the cached counters of a new bid's bidder and of the bidder
+    it outbid, once the current transaction commits
+    """
+    def invalidate():
+        outbid = (Bid.objects
+            .filter(listing=bid.listing_id, bid__lt=bid.bid)
+            .order_by("-bid")
+            .values_list("bidder", flat=True)
+            .first())
+        cache.delete_many([DASHBOARD_COUNTS_KEY.format(pk) for pk in {bid.bidder_id, outbid} if pk is not None])
+    transaction.on_commit(invalidate)
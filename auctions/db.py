@@ -0,0 +1,63 @@
+"""
+Contains SQLite tuning for production use
+
+New connections get the pragmas in settings.SQLITE_PRAGMAS: a busy
+timeout and larger page and mmap caches, and under the WSGI and ASGI
+servers a WAL journal so readers don't wait for writers, with
+'synchronous=NORMAL' which is safe with WAL. The journal mode sticks to
+the database file, so manage.py commands leave it alone.
+
+Write transactions use 'immediate_atomic', which starts them with
+BEGIN IMMEDIATE. A deferred transaction that reads before it writes
+fails with "database is locked" if another writer got in between,
+without waiting for the busy timeout. Taking the write lock up front
+makes concurrent writers queue up instead.
+"""
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+
+
+def apply_pragmas(connection, pragmas=None):
+    """
+    Applies pragmas to a SQLite connection
+
+    Args:
+        connection: Django database connection
+        pragmas (optional): Mapping of pragma names to values.
+                            Defaults to settings.SQLITE_PRAGMAS.
+    """
+    if connection.vendor != "sqlite":
+        return
+    if pragmas is None:
+        pragmas = getattr(settings, "SQLITE_PRAGMAS", {})
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+@contextmanager
+def immediate_atomic(using=None):
+    """
+    Works like transaction.atomic, but the outermost block of a SQLite
+    connection takes the write lock when it starts (BEGIN IMMEDIATE)
+    """
+    connection = transaction.get_connection(using)
+    if connection.vendor != "sqlite" or connection.in_atomic_block:
+        with transaction.atomic(using=using):
+            yield
+        return
+
+    def begin_immediate():
+        connection.cursor().execute("BEGIN IMMEDIATE")
+
+    # Django starts SQLite transactions through this hook, see
+    # BaseDatabaseWrapper.set_autocommit. Connections are per thread.
+    connection._start_transaction_under_autocommit = begin_immediate
+    try:
+        with transaction.atomic(using=using):
+            del connection._start_transaction_under_autocommit
+            yield
+    finally:
+        connection.__dict__.pop("_start_transaction_under_autocommit", None)
@@ -0,0 +1,131 @@
+"""
+Contains the broker pushing live listing updates to subscribers
+
+Each subscriber is an asyncio queue holding at most one event. Events
+are full snapshots of a listing's price and status, so a slow client
+only ever needs the latest one and older events are dropped instead
+of piling up. Idle subscribers cost one suspended coroutine each.
+
+The in-process broker only reaches subscribers of the same process.
+Deployments with several processes can plug in another broker with
+the same interface through settings.LIVE_UPDATES_BROKER.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.utils.module_loading import import_string
+
+
+class Subscription:
+    """
+    Receives the events of one listing in an event loop
+    """
+    def __init__(self, listing_id):
+        self.listing_id = listing_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=1)
+
+    def deliver(self, event):
+        """
+        Puts an event into the queue, replacing an unread one.
+        Must run in the subscriber's event loop.
+        """
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout=None):
+        """
+        Waits for the next event. Returns None on timeout.
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class InProcessBroker:
+    """
+    Broker delivering events to subscribers in the same process.
+    Publishing is thread-safe, so synchronous views can publish to
+    subscribers waiting in an event loop.
+    """
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, listing_id):
+        """
+        Returns a new subscription to events of a listing.
+        Must be called from within an event loop.
+        """
+        subscription = Subscription(listing_id)
+        with self._lock:
+            self._subscriptions[listing_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.listing_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.listing_id]
+
+    def has_subscribers(self, listing_id):
+        return bool(self._subscriptions.get(listing_id))
+
+    def publish(self, listing_id, event):
+        """
+        Sends an event to all subscribers of a listing
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(listing_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            # The subscriber's event loop is gone
+            except RuntimeError:
+                self.unsubscribe(subscription)
+
+
+_broker = None
+
+
+def get_broker():
+    """
+    Returns the broker configured in settings.LIVE_UPDATES_BROKER
+    """
+    global _broker
+    if _broker is None:
+        _broker = import_string(
+            getattr(settings, "LIVE_UPDATES_BROKER", "auctions.events.InProcessBroker")
+        )()
+    return _broker
+
+
+def live_updates(request):
+    """
+    Returns whether live updates can be streamed in reply to a request.
+    Only ASGI servers send an async stream as it is produced, WSGI
+    servers buffer it whole while holding a worker.
+    """
+    return isinstance(request, ASGIRequest)
+
+
+def listing_event(listing):
+    """
+    Returns the event published for a listing
+
+    Args:
+        listing: values() row with 'id', 'current_price', 'bid_count' and 'active'
+    """
+    return {
+        "id": listing["id"],
+        "current_price": str(listing["current_price"]),
+        "bid_count": listing["bid_count"],
+        "active": listing["active"],
+    }
@@ -1,9 +1,13 @@
 """
 Contains form definitions
 """
+from decimal import Decimal
+
 from django import forms
+from django.conf import settings
+from django.utils import timezone
 
-from .models import Listing
+from .models import Category, Listing
 
 class ListingForm(forms.ModelForm):
     """
@@ -11,14 +15,21 @@ class ListingForm(forms.ModelForm):
     """
     class Meta:
         model = Listing
-        fields = ['title', 'description', 'startingPrice', 'imageURL', 'category']
+        fields = ['title', 'description', 'startingPrice', 'image', 'imageURL', 'category', 'ends_at']
         labels = {
             'startingPrice': "Starting Price",
+            'image': "Image upload (optional)",
             'imageURL': "Image URL (optional)",
-            'category': "Category (optional)"
+            'category': "Category (optional)",
+            'ends_at': "Auction end (optional)"
         }
         widgets = {
-            'description': forms.Textarea(attrs={'rows': 3, 'placeholder': "Add details about your item here"})
+            'description': forms.Textarea(attrs={'rows': 3, 'placeholder': "Add details about your item here"}),
+            'ends_at': forms.DateTimeInput(attrs={'type': "datetime-local"})
+        }
+        # Checks that uploads are images Pillow can open, not just named like one
+        field_classes = {
+            'image': forms.ImageField
         }
 
     def __init__(self, *args, **kwargs):
@@ -31,6 +42,26 @@ class ListingForm(forms.ModelForm):
         self.fields['title'].widget.attrs.update({'placeholder': "Your title here"})
         self.fields['startingPrice'].widget.attrs.update({'placeholder': "$0.00"})
         self.fields['imageURL'].widget.attrs.update({'placeholder': "Add an image url for your item"})
+        self.fields['image'].widget.attrs.update({'class': "form-control-file", 'accept': "image/*"})
+
+    def clean_image(self):
+        """
+        Limits the size of uploaded images
+        """
+        image = self.cleaned_data["image"]
+        max_size = getattr(settings, "MAX_IMAGE_SIZE", 10 * 1024 * 1024)
+        if image and image.size > max_size:
+            raise forms.ValidationError(f"Images can be at most {max_size // (1024 * 1024)} MB.")
+        return image
+
+    def clean_ends_at(self):
+        """
+        Makes sure auctions end in the future
+        """
+        ends_at = self.cleaned_data["ends_at"]
+        if ends_at is not None and ends_at <= timezone.now():
+            raise forms.ValidationError("The auction has to end in the future.")
+        return ends_at
 
 class AddBid(forms.Form):
     """
@@ -39,6 +70,7 @@ class AddBid(forms.Form):
     bid = forms.DecimalField(
         max_digits=8,
         decimal_places=2,
+        min_value=Decimal("0.01"),
         widget=forms.NumberInput({
             'class': "form-control",
             'placeholder': "$0.00"
@@ -57,4 +89,29 @@ class AddComment(forms.Form):
             'rows': 3,
             'cols': 15
         })
-    )
\ No newline at end of file
+    )
+
+class SearchForm(forms.Form):
+    """
+    Form to search listings, optionally filtered by category
+    """
+    q = forms.CharField(
+        max_length=200,
+        label="Search",
+        widget=forms.TextInput({
+            'class': "form-control",
+            'placeholder': "Search listings"
+        })
+    )
+    category = forms.ModelChoiceField(
+        queryset=Category.objects.order_by("name"),
+        required=False,
+        empty_label="All categories",
+        widget=forms.Select({'class': "form-control"})
+    )
+    closed = forms.BooleanField(
+        required=False,
+        label="Include closed auctions",
+        widget=forms.CheckboxInput({'class': "form-check-input"})
+    )
+    page = forms.IntegerField(min_value=1, required=False, widget=forms.HiddenInput)
@@ -0,0 +1,290 @@
+"""
+Contains the thumbnail pipeline for uploaded listing images
+
+Uploaded originals are resized into a card and a detail variant, each
+in two widths for 1x and 2x screens, and encoded as WebP. Resizing runs
+in a pool of worker processes, fed by a few threads that read the
+original, store the results and update the listing, so requests never
+wait for it. Files are named after a hash of their content and never
+change, which lets them be served with far-future cache headers.
+
+Pillow is only needed where images are actually processed, which
+includes validating uploads. Worker processes import this module
+without setting up Django, hence the deferred model imports.
+
+Hot-linked images are only downloaded from public http(s) hosts, so
+image URLs cannot be used to reach internal services.
+"""
+import hashlib
+import io
+import ipaddress
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import urllib.parse
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models.functions import Now
+
+logger = logging.getLogger("auctions.images")
+
+# Widths generated per variant, for 1x and 2x screens
+VARIANTS = {
+    "card": (240, 480),
+    "detail": (720, 1440),
+}
+# Rendered size of the variants, for the 'sizes' attribute
+SIZES = {
+    "card": "(min-width: 1200px) 240px, 45vw",
+    "detail": "(min-width: 768px) 720px, 100vw",
+}
+FORMAT = "WEBP"
+EXTENSION = ".webp"
+QUALITY = 80
+ORIGINALS_DIR = "listings/originals"
+THUMBNAILS_DIR = "listings/thumbnails"
+
+
+def content_name(directory, data, extension):
+    """
+    Returns a storage name derived from the hash of a file's content
+    """
+    return f"{directory}/{hashlib.sha256(data).hexdigest()[:32]}{extension}"
+
+
+def original_name(upload, filename):
+    """
+    Returns the storage name of an uploaded original, derived from
+    the hash of its content
+    """
+    digest = hashlib.sha256()
+    for chunk in upload.chunks():
+        digest.update(chunk)
+    extension = os.path.splitext(filename)[1].lower()
+    return f"{ORIGINALS_DIR}/{digest.hexdigest()[:32]}{extension}"
+
+
+def original_upload_to(instance, filename):
+    """
+    Names uploaded originals after their content
+    """
+    try:
+        return original_name(instance.image, filename)
+    # FieldFile.save() asks for the name before attaching the content
+    except ValueError:
+        return f"{ORIGINALS_DIR}/{filename}"
+
+
+def stored_original(upload):
+    """
+    Returns the name of an already stored original with the same
+    content as an upload, or the upload itself. Assigning the name
+    instead of the upload reuses the file, as saving the upload would
+    store another copy under a suffixed name.
+    """
+    name = original_name(upload, upload.name)
+    return name if default_storage.exists(name) else upload
+
+
+def render_variants(data, variants=VARIANTS):
+    """
+    Resizes an image into all variants. Runs in a worker process.
+
+    Args:
+        data: Content of the original image
+        variants (optional): Widths per variant name
+
+    Returns:
+        Dict of variant names to lists of (width, height, data) tuples.
+        Images are never scaled up, so small originals yield fewer widths.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as original:
+        original.draft("RGB", (max(max(widths) for widths in variants.values()),) * 2)
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        rendered = {}
+        for name, widths in variants.items():
+            rendered[name] = []
+            for width in sorted(set(min(width, image.width) for width in widths)):
+                height = max(1, round(image.height * width / image.width))
+                output = io.BytesIO()
+                image.resize((width, height), Image.LANCZOS).save(output, FORMAT, quality=QUALITY, method=4)
+                rendered[name].append((width, height, output.getvalue()))
+    return rendered
+
+
+def store_variants(rendered):
+    """
+    Saves rendered variants under content-hashed names and returns
+    the value for 'Listing.thumbnails'
+    """
+    thumbnails = {}
+    for name, images in rendered.items():
+        thumbnails[name] = []
+        for width, height, data in images:
+            path = content_name(THUMBNAILS_DIR, data, EXTENSION)
+            if not default_storage.exists(path):
+                path = default_storage.save(path, ContentFile(data))
+            thumbnails[name].append({"name": path, "width": width, "height": height})
+    return thumbnails
+
+
+def image_variant(listing, variant):
+    """
+    Returns the 'src', 'srcset', 'sizes', 'width' and 'height' of an
+    image tag showing a variant of a listing's image, or None if there
+    are no thumbnails yet
+    """
+    images = (listing.thumbnails or {}).get(variant)
+    if not images:
+        return None
+    return {
+        "src": default_storage.url(images[0]["name"]),
+        "srcset": ", ".join(f"{default_storage.url(image['name'])} {image['width']}w" for image in images),
+        "sizes": SIZES[variant],
+        "width": images[0]["width"],
+        "height": images[0]["height"],
+    }
+
+
+_lock = threading.Lock()
+_processes = None
+_threads = None
+
+
+def get_process_pool():
+    """
+    Returns the pool of worker processes resizing images. Workers are
+    spawned rather than forked, so they don't inherit open database
+    connections or threads.
+    """
+    global _processes
+    with _lock:
+        if _processes is None:
+            _processes = ProcessPoolExecutor(
+                # One process per CPU if thumbnails are otherwise created inline
+                max_workers=getattr(settings, "THUMBNAIL_WORKERS", 2) or None,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _processes
+
+
+def get_thread_pool():
+    global _threads
+    with _lock:
+        if _threads is None:
+            _threads = ThreadPoolExecutor(
+                max_workers=getattr(settings, "THUMBNAIL_WORKERS", 2),
+                thread_name_prefix="thumbnails"
+            )
+        return _threads
+
+
+def create_thumbnails(listing_id):
+    """
+    Generates the thumbnails of a listing's uploaded image and stores
+    them on the listing. Bumping 'updated' invalidates cached cards,
+    cached pages are purged. Returns whether thumbnails were created.
+    """
+    from .models import Listing
+    from .pagecache import purge_listing_pages
+
+    listing = Listing.objects.filter(pk=listing_id).only("image").first()
+    if listing is None or not listing.image:
+        return False
+    with listing.image.open("rb") as f:
+        data = f.read()
+    if getattr(settings, "THUMBNAIL_WORKERS", 2) == 0:
+        rendered = render_variants(data)
+    else:
+        rendered = get_process_pool().submit(render_variants, data).result()
+    Listing.objects.filter(pk=listing_id).update(thumbnails=store_variants(rendered), updated=Now())
+    purge_listing_pages([listing_id])
+    return True
+
+
+def _create_thumbnails_job(listing_id):
+    try:
+        create_thumbnails(listing_id)
+    except Exception:
+        logger.exception("Creating thumbnails of listing %s failed", listing_id)
+    finally:
+        # Jobs run outside the request cycle, which closes connections otherwise
+        connection.close()
+
+
+def schedule_thumbnails(listing_id):
+    """
+    Creates the thumbnails of a listing in the background once the
+    current transaction commits. With THUMBNAIL_WORKERS = 0 they are
+    created right away, e.g. for tests.
+    """
+    if getattr(settings, "THUMBNAIL_WORKERS", 2) == 0:
+        transaction.on_commit(lambda: create_thumbnails(listing_id))
+    else:
+        transaction.on_commit(lambda: get_thread_pool().submit(_create_thumbnails_job, listing_id))
+
+
+def check_public_url(url):
+    """
+    Raises ValueError unless a URL uses http(s) and its host only
+    resolves to public addresses, e.g. not to loopback, private,
+    link-local or reserved ones
+    """
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError(f"{url} is not an http(s) URL")
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        addresses = socket.getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM)
+    except (OSError, ValueError) as e:
+        raise ValueError(f"{url} cannot be resolved") from e
+    for *_, sockaddr in addresses:
+        address = ipaddress.ip_address(sockaddr[0].split("%")[0])
+        # Such as ::ffff:127.0.0.1
+        address = getattr(address, "ipv4_mapped", None) or address
+        if not address.is_global or address.is_multicast:
+            raise ValueError(f"{url} points to a non-public address ({address})")
+
+
+class PublicRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """
+    Only follows redirects to public http(s) URLs
+    """
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        check_public_url(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+def fetch_image(url, timeout=10):
+    """
+    Downloads a hot-linked image from a public http(s) URL, refusing
+    files larger than settings.MAX_IMAGE_SIZE. Returns its content and
+    file extension.
+    """
+    check_public_url(url)
+    max_size = getattr(settings, "MAX_IMAGE_SIZE", 10 * 1024 * 1024)
+    request = urllib.request.Request(url, headers={"User-Agent": "commerce-thumbnails"})
+    opener = urllib.request.build_opener(PublicRedirectHandler)
+    with opener.open(request, timeout=timeout) as response:
+        # Refuse early when the size is announced
+        if int(response.headers.get("Content-Length") or 0) > max_size:
+            raise ValueError(f"{url} is larger than {max_size} bytes")
+        data = response.read(max_size + 1)
+        content_type = response.headers.get_content_type()
+    if len(data) > max_size:
+        raise ValueError(f"{url} is larger than {max_size} bytes")
+    if not content_type.startswith("image/"):
+        raise ValueError(f"{url} is not an image ({content_type})")
+    extension = "." + content_type.split("/")[1].split("+")[0]
+    return data, extension.replace(".jpeg", ".jpg")
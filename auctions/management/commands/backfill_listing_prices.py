@@ -0,0 +1,34 @@
+"""
+Recomputes the denormalized bid data of existing listings
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from auctions.models import Listing
+
+
+class Command(BaseCommand):
+    help = "Recomputes current price, bid count and current bid of all listings from their bids"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=1000,
+            help="Number of listings updated per transaction"
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        updated = 0
+        last_pk = 0
+        # Walk the table in primary key ranges to keep each write short
+        while True:
+            pks = list(Listing.objects
+                .filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size])
+            if not pks:
+                break
+            with transaction.atomic():
+                updated += Listing.objects.filter(pk__gte=pks[0], pk__lte=pks[-1]).update_bid_stats()
+            last_pk = pks[-1]
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} listings."))
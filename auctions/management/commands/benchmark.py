@@ -0,0 +1,70 @@
+"""
+Benchmarks every view against a seeded, throwaway database
+"""
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from auctions import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a throwaway database with a synthetic marketplace, drives every view "
+        "through the test client and reports latency percentiles, query counts and "
+        "peak memory as JSON. Fails if results regress against a baseline."
+    )
+
+    def add_arguments(self, parser):
+        for name, default in benchmark.DEFAULT_SCALE.items():
+            parser.add_argument(
+                f"--{name}", type=int, default=default,
+                help=f"Number of {name} to seed (default {default})"
+            )
+        parser.add_argument(
+            "--requests", type=int, default=50,
+            help="Timed requests per view"
+        )
+        parser.add_argument(
+            "--database-file",
+            help="SQLite file for the throwaway database. Defaults to an in-memory database"
+        )
+        parser.add_argument("--output", "-o", help="Write the results to this file")
+        parser.add_argument("--baseline", help="Compare against results saved earlier")
+        parser.add_argument(
+            "--tolerance", type=float, default=0.25,
+            help="Allowed relative p95 slowdown against the baseline"
+        )
+
+    def handle(self, *args, **options):
+        scale = {name: options[name] for name in benchmark.DEFAULT_SCALE}
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)["results"]
+
+        if options["database_file"]:
+            connection.settings_dict["TEST"]["NAME"] = options["database_file"]
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(ALLOWED_HOSTS=["testserver"]):
+                benchmark.seed(scale)
+                results = benchmark.run(requests=options["requests"])
+        except benchmark.BenchmarkError as e:
+            raise CommandError(f"Benchmark request failed: {e}")
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = json.dumps({"scale": scale, "results": results}, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(report)
+        self.stdout.write(report)
+
+        if baseline is not None:
+            regressions = benchmark.compare(results, baseline, options["tolerance"])
+            if regressions:
+                raise CommandError("Performance regressions:\n" + "\n".join(regressions))
+            self.stderr.write("No regressions against the baseline.")
@@ -0,0 +1,67 @@
+"""
+Benchmarks serving pages through the WSGI and the ASGI handler
+"""
+import json
+import logging
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from auctions import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a throwaway SQLite file and serves the same mix of pages through "
+        "the WSGI handler in a pool of worker threads and through the ASGI handler "
+        "on one event loop, with and without live update streams held open. "
+        "Reports throughput and latency percentiles of both as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=32, help="Concurrent clients loading pages")
+        parser.add_argument("--workers", type=int, default=8, help="WSGI worker threads")
+        parser.add_argument(
+            "--streams", default="0,4,8",
+            help="Comma separated numbers of live update streams held open, one run each"
+        )
+        parser.add_argument("--seconds", type=float, default=5, help="Duration of each run")
+        parser.add_argument("--listings", type=int, default=2000, help="Number of listings to seed")
+        parser.add_argument(
+            "--database-file",
+            default=os.path.join(tempfile.gettempdir(), "commerce_benchmark.sqlite3"),
+            help="SQLite file for the throwaway database"
+        )
+        parser.add_argument("--output", "-o", help="Write the results to this file")
+
+    def handle(self, *args, **options):
+        scale = dict(benchmark.DEFAULT_SCALE, listings=options["listings"],
+                     bids=options["listings"] * 4, comments=options["listings"])
+        connection.settings_dict["TEST"]["NAME"] = options["database_file"]
+        connection.close()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        results = {}
+        # Requests queue for workers, so every one of them would be logged as slow
+        logging.getLogger("auctions.profiling").setLevel(logging.ERROR)
+        try:
+            benchmark.seed(scale)
+            connection.close()
+            with override_settings(ALLOWED_HOSTS=["testserver"]):
+                for streams in (int(n) for n in options["streams"].split(",")):
+                    results[f"{streams}_streams"] = benchmark.servers(
+                        clients=options["clients"],
+                        workers=options["workers"],
+                        streams=streams,
+                        seconds=options["seconds"]
+                    )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = json.dumps({"scale": scale, "results": results}, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(report)
+        self.stdout.write(report)
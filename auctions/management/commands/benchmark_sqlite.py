@@ -0,0 +1,68 @@
+"""
+Benchmarks concurrent reads and writes with and without SQLite tuning
+"""
+import json
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from auctions import benchmark
+
+# SQLite's own defaults, as used before settings.SQLITE_PRAGMAS
+DEFAULT_PRAGMAS = {"journal_mode": "delete", "synchronous": "full"}
+# Added to settings.SQLITE_PRAGMAS under the WSGI and ASGI servers
+WAL_PRAGMAS = {"journal_mode": "wal", "synchronous": "normal"}
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a throwaway SQLite file twice, once with SQLite's default settings "
+        "and once with the pragmas used by the WSGI and ASGI servers, and reports the throughput of "
+        "concurrent readers and bidders for both as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--readers", type=int, default=4, help="Reader threads")
+        parser.add_argument("--writers", type=int, default=4, help="Writer threads")
+        parser.add_argument("--seconds", type=float, default=5, help="Duration of each run")
+        parser.add_argument("--listings", type=int, default=2000, help="Number of listings to seed")
+        parser.add_argument(
+            "--database-file",
+            default=os.path.join(tempfile.gettempdir(), "commerce_benchmark.sqlite3"),
+            help="SQLite file for the throwaway database"
+        )
+        parser.add_argument("--output", "-o", help="Write the results to this file")
+
+    def handle(self, *args, **options):
+        scale = dict(benchmark.DEFAULT_SCALE, listings=options["listings"],
+                     bids=options["listings"] * 4, comments=0)
+        connection.settings_dict["TEST"]["NAME"] = options["database_file"]
+        results = {}
+        tuned = {**WAL_PRAGMAS, **settings.SQLITE_PRAGMAS}
+        for name, pragmas in (("before", DEFAULT_PRAGMAS), ("after", tuned)):
+            with override_settings(SQLITE_PRAGMAS=pragmas):
+                connection.close()
+                old_name = connection.creation.create_test_db(
+                    verbosity=0, autoclobber=True, serialize=False
+                )
+                try:
+                    benchmark.seed(scale)
+                    connection.close()
+                    results[name] = benchmark.concurrency(
+                        readers=options["readers"],
+                        writers=options["writers"],
+                        seconds=options["seconds"]
+                    )
+                finally:
+                    connection.creation.destroy_test_db(old_name, verbosity=0)
+            results[name]["pragmas"] = pragmas
+
+        report = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(report)
+        self.stdout.write(report)
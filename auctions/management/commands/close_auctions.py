@@ -0,0 +1,45 @@
+"""
+Worker closing auctions once their end time has passed
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from auctions.closing import close_due_listings
+
+
+class Command(BaseCommand):
+    help = "Closes expired auctions in batches. Several instances may run at once."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="Maximum number of listings closed per transaction"
+        )
+        parser.add_argument(
+            "--interval", type=float, default=5,
+            help="Seconds to wait when no auctions are due"
+        )
+        parser.add_argument(
+            "--once", action="store_true",
+            help="Close all currently due auctions and exit"
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        total = 0
+        try:
+            while True:
+                closed = close_due_listings(batch_size)
+                total += len(closed)
+                if closed:
+                    self.stdout.write(f"Closed {len(closed)} auctions.")
+                # Full batches mean there may be more due auctions
+                if len(closed) == batch_size:
+                    continue
+                if options["once"]:
+                    break
+                time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Closed {total} auctions in total."))
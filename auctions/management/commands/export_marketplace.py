@@ -0,0 +1,35 @@
+"""
+Streams users, listings or bids to a CSV or JSON Lines file
+"""
+from django.core.management.base import BaseCommand
+
+from auctions.marketplace import FIELDS, export_records
+
+
+class Command(BaseCommand):
+    help = "Exports users, listings or bids as CSV or JSON Lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=FIELDS.keys())
+        parser.add_argument(
+            "--output", "-o",
+            help="File to write to. Defaults to standard output"
+        )
+        parser.add_argument(
+            "--format", choices=["csv", "jsonl"],
+            help="Output format. Defaults to the file extension, or jsonl"
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=2000,
+            help="Rows fetched from the database at once"
+        )
+
+    def handle(self, *args, **options):
+        output = options["output"]
+        file_format = options["format"] or ("csv" if output and output.endswith(".csv") else "jsonl")
+        if output:
+            with open(output, "w", newline="", encoding="utf-8") as stream:
+                count = export_records(options["kind"], stream, file_format, options["chunk_size"])
+        else:
+            count = export_records(options["kind"], self.stdout, file_format, options["chunk_size"])
+        self.stderr.write(f"Exported {count} {options['kind']}.")
@@ -0,0 +1,97 @@
+"""
+Creates thumbnails for existing listings
+"""
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models.functions import Now
+
+from auctions.images import (
+    ORIGINALS_DIR, content_name, fetch_image, get_process_pool, render_variants, store_variants
+)
+from auctions.models import Listing
+from auctions.pagecache import purge_listing_pages
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates thumbnails for listings with an uploaded image but no thumbnails. "
+        "With --download, hot-linked images are downloaded and stored first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--download", action="store_true",
+            help="Download hot-linked images of listings without an uploaded image"
+        )
+        parser.add_argument(
+            "--force", action="store_true",
+            help="Recreate existing thumbnails, e.g. after changing the variants"
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=20,
+            help="Number of images resized in parallel"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            import PIL  # noqa: F401
+        except ImportError:
+            raise CommandError("Creating thumbnails requires Pillow.")
+
+        if options["download"]:
+            self.download()
+
+        listings = Listing.objects.exclude(image="").order_by("pk")
+        if not options["force"]:
+            listings = listings.filter(thumbnails={})
+        pool = get_process_pool()
+        created = failed = 0
+        last_pk = 0
+        while True:
+            batch = list(listings.filter(pk__gt=last_pk).only("image")[:options["batch_size"]])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            originals, updated = [], []
+            for listing in batch:
+                try:
+                    with listing.image.open("rb") as f:
+                        originals.append((listing, pool.submit(render_variants, f.read())))
+                except OSError as e:
+                    self.stderr.write(f"Listing {listing.pk}: {e}")
+                    failed += 1
+            for listing, future in originals:
+                try:
+                    thumbnails = store_variants(future.result())
+                # Pillow raises various errors for broken images
+                except Exception as e:
+                    self.stderr.write(f"Listing {listing.pk}: {e}")
+                    failed += 1
+                    continue
+                Listing.objects.filter(pk=listing.pk).update(thumbnails=thumbnails, updated=Now())
+                updated.append(listing.pk)
+                created += 1
+            # Cached pages still point to the original images
+            purge_listing_pages(updated)
+        self.stdout.write(self.style.SUCCESS(f"Created thumbnails for {created} listings, {failed} failed."))
+
+    def download(self):
+        """
+        Stores hot-linked images as uploaded originals
+        """
+        downloaded = failed = 0
+        listings = Listing.objects.filter(image="").exclude(imageURL="").only("imageURL")
+        for listing in listings.iterator():
+            try:
+                data, extension = fetch_image(listing.imageURL)
+            except (OSError, ValueError) as e:
+                self.stderr.write(f"Listing {listing.pk}: {e}")
+                failed += 1
+                continue
+            name = content_name(ORIGINALS_DIR, data, extension)
+            if not default_storage.exists(name):
+                name = default_storage.save(name, ContentFile(data))
+            Listing.objects.filter(pk=listing.pk).update(image=name)
+            downloaded += 1
+        self.stdout.write(f"Downloaded {downloaded} images, {failed} failed.")
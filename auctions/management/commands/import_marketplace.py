@@ -0,0 +1,66 @@
+"""
+Streams users, listings or bids from a CSV or JSON Lines file into the database
+"""
+import os
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+
+from auctions.marketplace import FIELDS, Importer, read_records
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports users, listings or bids from CSV or JSON Lines in constant memory. "
+        "Import users first, then listings, then bids."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=FIELDS.keys())
+        parser.add_argument("file")
+        parser.add_argument(
+            "--format", choices=["csv", "jsonl"],
+            help="Input format. Defaults to the file extension, or jsonl"
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=5000,
+            help="Records inserted per transaction"
+        )
+        parser.add_argument(
+            "--resume", action="store_true",
+            help="Skip the records committed by a previous, interrupted run"
+        )
+
+    def handle(self, *args, **options):
+        path = options["file"]
+        file_format = options["format"] or ("csv" if path.endswith(".csv") else "jsonl")
+        batch_size = options["batch_size"]
+        # Number of committed records, written after every batch
+        checkpoint = f"{path}.progress"
+        done = 0
+        if options["resume"] and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                done = int(f.read() or 0)
+            self.stdout.write(f"Resuming after {done} records.")
+
+        importer = Importer(options["kind"])
+        imported = 0
+        with open(path, newline="", encoding="utf-8") as stream:
+            records = islice(read_records(stream, file_format), done, None)
+            while True:
+                batch = list(islice(records, batch_size))
+                if not batch:
+                    break
+                imported += importer.import_batch(batch)
+                done += len(batch)
+                with open(checkpoint, "w") as f:
+                    f.write(str(done))
+                if options["verbosity"] > 1:
+                    self.stdout.write(f"{done} records processed.")
+
+        # The whole file went in, a later run starts from scratch
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {imported} {options['kind']}, skipped {importer.skipped}."
+        ))
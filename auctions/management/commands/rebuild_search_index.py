@@ -0,0 +1,25 @@
+"""
+Rebuilds the full-text search index of listings
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from auctions.search import create_search_index, fts_available, optimize_search_index
+
+
+class Command(BaseCommand):
+    help = "Recreates missing search index triggers and reindexes all listings"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--optimize", action="store_true",
+            help="Merge the index segments after rebuilding"
+        )
+
+    def handle(self, *args, **options):
+        if not fts_available():
+            raise CommandError("Full-text search requires SQLite with FTS5.")
+        # Table remakes during migrations drop triggers, so recreate them too
+        create_search_index()
+        if options["optimize"]:
+            optimize_search_index()
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt."))
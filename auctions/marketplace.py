@@ -0,0 +1,256 @@
+"""
+Contains streaming import and export of users, listings and bids
+
+Records are read and written one line at a time in CSV or JSON Lines
+format, so memory use does not depend on the size of a file. Imports
+insert with bulk_create in batches, resolving usernames and category
+names through in-memory lookup maps instead of a query per row.
+Primary keys of listings and bids are kept, which makes re-running
+an import idempotent and lets bids refer to imported listings.
+"""
+import csv
+import json
+from contextlib import contextmanager
+from datetime import datetime
+from decimal import Decimal
+
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .caching import invalidate_category_counts
+from .dashboard import invalidate_dashboards, invalidate_listing_dashboards
+from .db import immediate_atomic
+from .models import Bid, Category, Listing, User
+from .pagecache import purge_list_pages, purge_listing_pages
+
+# Exported columns per kind of record
+FIELDS = {
+    "users": ["username", "email", "password", "first_name", "last_name", "time"],
+    "listings": [
+        "id", "owner", "title", "description", "starting_price", "category",
+        "image_url", "time", "ends_at", "active", "winner"
+    ],
+    "bids": ["id", "listing", "bidder", "bid", "time"],
+}
+
+
+def export_queryset(kind):
+    """
+    Returns a values() queryset with the exported columns of a kind
+    """
+    if kind == "users":
+        return User.objects.order_by("pk").values(*FIELDS["users"])
+    if kind == "listings":
+        return Listing.objects.order_by("pk").values(
+            "id", "title", "description", "time", "ends_at", "active",
+            owner_username=F("owner__username"),
+            starting_price=F("startingPrice"),
+            category_name=F("category__name"),
+            image_url=F("imageURL"),
+            winner_username=F("winner__username")
+        )
+    return Bid.objects.order_by("pk").values(
+        "id", "bid", "time",
+        listing_ref=F("listing_id"),
+        bidder_username=F("bidder__username")
+    )
+
+
+# values() can't reuse field names for expressions, so they are renamed on the way out
+EXPORT_RENAMES = {
+    "owner_username": "owner",
+    "category_name": "category",
+    "winner_username": "winner",
+    "listing_ref": "listing",
+    "bidder_username": "bidder",
+}
+
+
+def serialize(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def export_records(kind, stream, file_format, chunk_size=2000):
+    """
+    Writes all records of a kind to a text stream and returns their number
+
+    Args:
+        kind: "users", "listings" or "bids"
+        stream: Writable text stream
+        file_format: "csv" or "jsonl"
+        chunk_size (optional): Rows fetched from the database at once
+    """
+    writer = None
+    if file_format == "csv":
+        writer = csv.DictWriter(stream, fieldnames=FIELDS[kind])
+        writer.writeheader()
+    count = 0
+    for row in export_queryset(kind).iterator(chunk_size=chunk_size):
+        record = {EXPORT_RENAMES.get(key, key): serialize(value) for key, value in row.items()}
+        if writer:
+            writer.writerow(record)
+        else:
+            stream.write(json.dumps(record) + "\n")
+        count += 1
+    return count
+
+
+def read_records(stream, file_format):
+    """
+    Yields records from a text stream one at a time. Missing CSV
+    values are returned as None.
+    """
+    if file_format == "csv":
+        for record in csv.DictReader(stream):
+            yield {key: (value if value != "" else None) for key, value in record.items()}
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def parse_bool(value, default):
+    """
+    Parses a boolean field, returning 'default' for missing or blank values
+    """
+    if value is None or value == "":
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() in ("true", "1", "yes")
+
+
+@contextmanager
+def original_timestamps(*models):
+    """
+    Keeps bulk_create from overwriting imported timestamps with the
+    current time, by switching off auto_now and auto_now_add
+    """
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Importer:
+    """
+    Imports records of one kind in batches
+
+        - 'user_ids' maps usernames to primary keys, loaded once
+        - 'category_ids' maps category names to primary keys,
+          missing categories are created on first use
+        - 'skipped' counts records referring to unknown users or listings
+        - records without a time get the time of the import
+    """
+    def __init__(self, kind):
+        self.kind = kind
+        self.skipped = 0
+        self.now = timezone.now()
+        self.user_ids = {}
+        self.category_ids = {}
+        if kind != "users":
+            self.user_ids = dict(User.objects.values_list("username", "pk").iterator(chunk_size=10000))
+        if kind == "listings":
+            self.category_ids = dict(Category.objects.values_list("name", "pk"))
+
+    def category_id(self, name):
+        if not name:
+            return None
+        if name not in self.category_ids:
+            self.category_ids[name] = Category.objects.create(name=name).pk
+        return self.category_ids[name]
+
+    def build(self, record):
+        """
+        Returns an unsaved model instance for a record, or None
+        if the record refers to an unknown user
+        """
+        time = parse_datetime(record["time"]) if record.get("time") else self.now
+        if self.kind == "users":
+            return User(
+                username=record["username"],
+                email=record.get("email") or "",
+                password=record.get("password") or "!",
+                first_name=record.get("first_name") or "",
+                last_name=record.get("last_name") or "",
+                time=time
+            )
+        if self.kind == "listings":
+            owner_id = self.user_ids.get(record["owner"])
+            if owner_id is None:
+                return None
+            price = Decimal(record["starting_price"])
+            return Listing(
+                pk=record.get("id"),
+                owner_id=owner_id,
+                title=record["title"],
+                description=record.get("description") or "",
+                startingPrice=price,
+                current_price=price,
+                category_id=self.category_id(record.get("category")),
+                imageURL=record.get("image_url") or "",
+                time=time,
+                updated=time,
+                ends_at=parse_datetime(record["ends_at"]) if record.get("ends_at") else None,
+                active=parse_bool(record.get("active"), True),
+                winner_id=self.user_ids.get(record.get("winner"))
+            )
+        bidder_id = self.user_ids.get(record["bidder"])
+        if bidder_id is None:
+            return None
+        return Bid(
+            pk=record.get("id"),
+            listing_id=int(record["listing"]),
+            bidder_id=bidder_id,
+            bid=Decimal(record["bid"]),
+            time=time
+        )
+
+    def import_batch(self, records):
+        """
+        Inserts a batch of records in one transaction. Rows that
+        already exist are left alone. Returns the number of records
+        handed to the database.
+        """
+        objects = []
+        for record in records:
+            obj = self.build(record)
+            if obj is None:
+                self.skipped += 1
+            else:
+                objects.append(obj)
+        if self.kind == "bids":
+            # One query per batch instead of a foreign key error at commit
+            known = set(Listing.objects
+                .filter(pk__in={bid.listing_id for bid in objects})
+                .values_list("pk", flat=True))
+            self.skipped += sum(1 for bid in objects if bid.listing_id not in known)
+            objects = [bid for bid in objects if bid.listing_id in known]
+        if not objects:
+            return 0
+        model = type(objects[0])
+        with immediate_atomic(), original_timestamps(model):
+            model.objects.bulk_create(objects, ignore_conflicts=True)
+            # bulk_create skips the signal handlers maintaining listing data
+            if model is Bid:
+                Listing.objects.filter(pk__in=known).update_bid_stats()
+                invalidate_listing_dashboards(known)
+                purge_listing_pages(known)
+            elif model is Listing:
+                invalidate_category_counts()
+                invalidate_dashboards(listing.owner_id for listing in objects)
+                purge_list_pages()
+        return len(objects)
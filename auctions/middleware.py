@@ -0,0 +1,241 @@
+"""
+Contains middleware
+"""
+import json
+import logging
+import random
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.template.backends.django import Template
+
+from .routers import primary_until
+
+logger = logging.getLogger("auctions.profiling")
+
+# Profile of the request handled in the current thread or task
+current_profile = ContextVar("current_profile", default=None)
+
+
+class RequestProfile:
+    """
+    Collects timings of one request
+        - 'queries' counts all queries, 'sql_time' sums up their durations
+        - 'worst_queries' keeps the slowest queries as (duration, sql) pairs
+        - 'template_time' sums up top-level template renderings
+    """
+    def __init__(self, keep_queries):
+        self.keep_queries = keep_queries
+        self.queries = 0
+        self.sql_time = 0.0
+        self.worst_queries = []
+        self.template_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        """
+        Database execute wrapper timing every query
+        """
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.queries += 1
+            self.sql_time += duration
+            if self.keep_queries:
+                self.worst_queries.append((duration, sql))
+                self.worst_queries.sort(reverse=True)
+                del self.worst_queries[self.keep_queries:]
+
+
+def profile_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper handing queries to the current request
+    profile. Installed on every connection when it is created, as async
+    views query through connections of a worker thread the middleware
+    never sees. The profile follows the request there as a context variable.
+    """
+    profile = current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    return profile(execute, sql, params, many, context)
+
+
+def install_query_profiling(connection):
+    if profile_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(profile_query)
+
+
+def timed_render(render):
+    """
+    Wraps the template backend's render method to add its duration to
+    the current request profile. Included templates render through the
+    engine directly, so nothing is counted twice.
+    """
+    def wrapper(self, *args, **kwargs):
+        profile = current_profile.get()
+        if profile is None:
+            return render(self, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            profile.template_time += time.perf_counter() - start
+    wrapper.timed = True
+    return wrapper
+
+
+class ProfilingMiddleware:
+    """
+    Measures query count, SQL time, template render time and view time
+    of a sample of requests and reports them to staff users in a
+    Server-Timing header. Requests slower than
+    settings.SLOW_REQUEST_THRESHOLD_MS are logged to the
+    "auctions.profiling" logger with their slowest queries.
+
+    Settings:
+        PROFILING_SAMPLE_RATE: Fraction of requests profiled (default 0.01)
+        PROFILING_SERVER_TIMING: Whether all users get the Server-Timing
+            header, not just staff (default False)
+        SLOW_REQUEST_THRESHOLD_MS: Slow request threshold (default 500)
+        SLOW_REQUEST_QUERIES: Slowest queries logged per request (default 5)
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, "PROFILING_SAMPLE_RATE", 0.01)
+        self.server_timing = getattr(settings, "PROFILING_SERVER_TIMING", False)
+        self.threshold = getattr(settings, "SLOW_REQUEST_THRESHOLD_MS", 500)
+        self.keep_queries = getattr(settings, "SLOW_REQUEST_QUERIES", 5)
+        if not getattr(Template.render, "timed", False):
+            Template.render = timed_render(Template.render)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        profile = RequestProfile(self.keep_queries)
+        token = current_profile.set(profile)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self.report(request, response, profile, start, self.show_timing(request))
+
+    async def __acall__(self, request):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return await self.get_response(request)
+
+        profile = RequestProfile(self.keep_queries)
+        token = current_profile.set(profile)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        # Loading the user may query the database
+        show_timing = self.server_timing or await sync_to_async(self.show_timing)(request)
+        return self.report(request, response, profile, start, show_timing)
+
+    def show_timing(self, request):
+        """
+        Returns whether the response reveals its timings. By default
+        only staff gets them, as they tell how long queries take.
+        """
+        if self.server_timing:
+            return True
+        user = getattr(request, "user", None)
+        return user is not None and user.is_staff
+
+    def report(self, request, response, profile, start, show_timing):
+        """
+        Adds the Server-Timing header and logs slow requests
+        """
+        total = (time.perf_counter() - start) * 1000
+
+        sql = profile.sql_time * 1000
+        template = profile.template_time * 1000
+        # Time spent in Python outside of queries and templates
+        view = max(total - sql - template, 0)
+        if show_timing:
+            response["Server-Timing"] = ", ".join([
+                f'db;dur={sql:.1f};desc="{profile.queries} queries"',
+                f"tpl;dur={template:.1f}",
+                f"view;dur={view:.1f}",
+                f"total;dur={total:.1f}",
+            ])
+        if total >= self.threshold:
+            logger.warning(json.dumps({
+                "method": request.method,
+                "path": request.get_full_path(),
+                "status": response.status_code,
+                "total_ms": round(total, 1),
+                "sql_ms": round(sql, 1),
+                "template_ms": round(template, 1),
+                "view_ms": round(view, 1),
+                "queries": profile.queries,
+                "worst_queries": [
+                    {"ms": round(duration * 1000, 1), "sql": statement}
+                    for duration, statement in profile.worst_queries
+                ],
+            }))
+        return response
+
+
+class ReplicaPinningMiddleware:
+    """
+    Keeps the reads of a user who just wrote on the primary database
+    for the following requests, by remembering the end of the pin in a
+    cookie. See auctions.routers.
+    """
+    cookie_name = "primary_until"
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        pinned_until = self.pinned_until(request)
+        token = primary_until.set(pinned_until)
+        try:
+            return self.extend_pin(self.get_response(request), pinned_until)
+        finally:
+            primary_until.reset(token)
+
+    async def __acall__(self, request):
+        pinned_until = self.pinned_until(request)
+        token = primary_until.set(pinned_until)
+        try:
+            return self.extend_pin(await self.get_response(request), pinned_until)
+        finally:
+            primary_until.reset(token)
+
+    def pinned_until(self, request):
+        try:
+            return float(request.COOKIES.get(self.cookie_name, 0))
+        except ValueError:
+            return 0.0
+
+    def extend_pin(self, response, pinned_until):
+        # The request wrote to the primary and extended the pin
+        if primary_until.get() > pinned_until:
+            response.set_cookie(
+                self.cookie_name, f"{primary_until.get():.3f}",
+                max_age=getattr(settings, "REPLICA_PIN_SECONDS", 5),
+                httponly=True, samesite="Lax"
+            )
+        return response
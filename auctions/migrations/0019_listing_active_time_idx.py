@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0018_auto_20201127_1147'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['active', 'time'], name='listing_active_time_idx'),
+        ),
+    ]
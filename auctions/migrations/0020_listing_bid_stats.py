@@ -0,0 +1,38 @@
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_bid_stats(apps, schema_editor):
+    Bid = apps.get_model("auctions", "Bid")
+    Listing = apps.get_model("auctions", "Listing")
+    bids = Bid.objects.filter(listing=OuterRef("pk"))
+    highest = bids.order_by("-bid", "time")
+    Listing.objects.update(
+        bid_count=Coalesce(Subquery(
+            bids.order_by().values("listing").annotate(count=Count("pk")).values("count")
+        ), 0),
+        current_price=Coalesce(Subquery(highest.values("bid")[:1]), F("startingPrice"))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0019_listing_active_time_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='bid_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='current_price',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, editable=False, max_digits=8),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_bid_stats, migrations.RunPython.noop),
+    ]
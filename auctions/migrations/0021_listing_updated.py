@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0020_listing_bid_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
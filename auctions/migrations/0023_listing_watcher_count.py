@@ -0,0 +1,28 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_watcher_count(apps, schema_editor):
+    Listing = apps.get_model("auctions", "Listing")
+    User = apps.get_model("auctions", "User")
+    watchers = User.watchlist.through.objects.filter(listing=OuterRef("pk"))
+    Listing.objects.update(watcher_count=Coalesce(Subquery(
+        watchers.order_by().values("listing").annotate(count=Count("pk")).values("count")
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0022_listing_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='watcher_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_watcher_count, migrations.RunPython.noop),
+    ]
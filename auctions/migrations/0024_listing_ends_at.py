@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0023_listing_watcher_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='ends_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['active', 'ends_at'], name='listing_active_ends_at_idx'),
+        ),
+    ]
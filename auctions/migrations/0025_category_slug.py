@@ -0,0 +1,37 @@
+from django.db import migrations, models
+from django.utils.text import slugify
+
+
+def backfill_slugs(apps, schema_editor):
+    Category = apps.get_model("auctions", "Category")
+    taken = set()
+    for category in Category.objects.order_by("pk"):
+        base = slugify(category.name)[:58] or "category"
+        slug, number = base, 1
+        while slug in taken:
+            number += 1
+            slug = f"{base}-{number}"
+        taken.add(slug)
+        category.slug = slug
+        category.save(update_fields=["slug"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0024_listing_ends_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='slug',
+            field=models.SlugField(max_length=64, null=True),
+        ),
+        migrations.RunPython(backfill_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='category',
+            name='slug',
+            field=models.SlugField(blank=True, max_length=64, unique=True),
+        ),
+    ]
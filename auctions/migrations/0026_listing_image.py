@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:26
+
+import auctions.images
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0025_category_slug'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='image',
+            field=models.FileField(blank=True, upload_to=auctions.images.original_upload_to, validators=[django.core.validators.FileExtensionValidator(['jpg', 'jpeg', 'png', 'gif', 'webp'])]),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='thumbnails',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
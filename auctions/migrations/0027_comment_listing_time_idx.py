@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0026_listing_image'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['listing', 'time'], name='comment_listing_time_idx'),
+        ),
+    ]
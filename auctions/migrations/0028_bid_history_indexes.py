@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0027_comment_listing_time_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bid',
+            index=models.Index(fields=['listing', 'bid'], name='bid_listing_bid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bid',
+            index=models.Index(fields=['listing', 'bidder', 'bid'], name='bid_listing_bidder_bid_idx'),
+        ),
+    ]
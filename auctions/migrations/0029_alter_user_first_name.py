@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    Catches the migration state up with AbstractUser.first_name, which
+    Django 3.1 widened from 30 to 150 characters. Unrelated to the listing
+    indexes; makemigrations picks it up on any model change.
+    """
+
+    dependencies = [
+        ('auctions', '0028_bid_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='first_name',
+            field=models.CharField(blank=True, max_length=150, verbose_name='first name'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:07
+
+import auctions.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0029_alter_user_first_name'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='user',
+            managers=[
+                ('objects', auctions.models.UserManager()),
+            ],
+        ),
+    ]
@@ -1,8 +1,36 @@
 """
 Contains model definitions
 """
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager as BaseUserManager
+from django.core.validators import FileExtensionValidator
 from django.db import models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Left, Now
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .images import image_variant, original_upload_to
+
+class UserQuerySet(models.QuerySet):
+    """
+    Custom queryset for users
+    """
+    def update(self, **kwargs):
+        """
+        Drops the cached users of updated rows, as bulk updates send
+        no save signals
+        """
+        # The backend module loads the user model on import
+        from .auth import invalidate_user
+
+        user_ids = list(self.values_list("pk", flat=True))
+        rows = super().update(**kwargs)
+        for user_id in user_ids:
+            invalidate_user(user_id)
+        return rows
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
+    pass
 
 class User(AbstractUser):
     """
@@ -11,30 +39,150 @@ class User(AbstractUser):
     time = models.DateTimeField(auto_now_add=True)
     watchlist = models.ManyToManyField("Listing", blank=True, related_name="watchers")
 
+    objects = UserManager()
+
     def __str__(self):
         return self.username
 
+class ListingQuerySet(models.QuerySet):
+    """
+    Custom queryset for listings
+    """
+    # Number of description characters shown on a listing card
+    CARD_DESCRIPTION_LENGTH = 200
+
+    def cards(self):
+        """
+        Loads only what a listing card renders, joining owner and
+        current bid and truncating the description in SQL, so a
+        whole page of cards costs a single query
+        """
+        return (self
+            .select_related("owner")
+            .only(
+                "title", "imageURL", "image", "thumbnails", "current_price", "bid_count", "time",
+                "updated", "ends_at", "category", "owner__username"
+            )
+            .annotate(summary=Left("description", self.CARD_DESCRIPTION_LENGTH + 1)))
+
+    def close(self, now=None):
+        """
+        Closes the active listings of the queryset in one UPDATE,
+        setting the bidder of the current bid as winner. Listings
+        can only be switched from active to closed once, so
+        concurrent closers never close a listing twice.
+
+        Args:
+            now (optional): Stamp stored in 'updated'. Defaults to the current time.
+        """
+        return self.filter(active=True).update(
+            active=False,
+            winner=Subquery(Bid.objects.filter(pk=OuterRef("currentBid")).values("bidder")[:1]),
+            updated=now or timezone.now()
+        )
+
+    def update_watcher_count(self):
+        """
+        Recomputes 'watcher_count' of all listings in the queryset
+        """
+        watchers = User.watchlist.through.objects.filter(listing=OuterRef("pk"))
+        return self.update(watcher_count=Coalesce(Subquery(
+            watchers.order_by().values("listing").annotate(count=Count("pk")).values("count")
+        ), 0))
+
+    def update_bid_stats(self):
+        """
+        Recomputes 'currentBid', 'current_price' and 'bid_count' of
+        all listings in the queryset from their bids in one statement
+        """
+        bids = Bid.objects.filter(listing=OuterRef("pk"))
+        highest = bids.order_by("-bid", "time")
+        return self.update(
+            bid_count=Coalesce(Subquery(
+                bids.order_by().values("listing").annotate(count=Count("pk")).values("count")
+            ), 0),
+            currentBid=Subquery(highest.values("pk")[:1]),
+            current_price=Coalesce(Subquery(highest.values("bid")[:1]), F("startingPrice")),
+            updated=Now()
+        )
+
+
 class Listing(models.Model):
     """
     Models a listed item
         - 'currentBid' only gets updated once the first bid is made
+        - 'current_price' and 'bid_count' are denormalized from the
+          bids and maintained by the Bid signal handlers, so list pages
+          never have to join Bid
+        - 'watcher_count' is maintained by the watchlist signal handlers
+        - saves of existing listings never write these maintained
+          fields, so a stale instance cannot undo concurrent bids
+        - 'updated' changes on every edit and bid and serves as
+          version stamp for cached renderings of the listing
         - 'active' stores whether the auction is ongoing - could be
           determined through 'winner', but is more readable this way
+        - 'ends_at' is optional, auctions without it run until the
+          owner closes them
     """
     owner = models.ForeignKey(User, on_delete=models.SET("deleted"), related_name="listings")
     title = models.CharField(max_length=128)
     description = models.CharField(max_length=1024)
     startingPrice = models.DecimalField(max_digits=8, decimal_places=2)
+    current_price = models.DecimalField(max_digits=8, decimal_places=2, db_index=True, editable=False)
+    bid_count = models.PositiveIntegerField(default=0, editable=False)
+    watcher_count = models.PositiveIntegerField(default=0, editable=False)
     currentBid = models.ForeignKey("Bid", null=True, blank=True, on_delete=models.SET_NULL, related_name="highestBid")
     imageURL = models.URLField(max_length=200, blank=True)
+    image = models.FileField(
+        upload_to=original_upload_to, blank=True,
+        validators=[FileExtensionValidator(["jpg", "jpeg", "png", "gif", "webp"])]
+    )
+    # Generated variants of 'image', see auctions.images
+    thumbnails = models.JSONField(default=dict, blank=True, editable=False)
     category = models.ForeignKey("Category", null=True, blank=True, on_delete=models.SET_NULL, related_name="listings")
     time = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
     active = models.BooleanField(default=True)
+    ends_at = models.DateTimeField(null=True, blank=True)
     winner = models.ForeignKey(User, blank=True, null=True, on_delete=models.SET_NULL, related_name="winnings")
 
+    objects = ListingQuerySet.as_manager()
+
+    # Fields maintained by conditional UPDATEs of 'place_bid', the signal
+    # handlers and the thumbnail pipeline, left out of saves
+    MAINTAINED_FIELDS = ("current_price", "bid_count", "currentBid", "watcher_count", "thumbnails")
+
+    class Meta:
+        indexes = [
+            # Serves the keyset paginated list pages
+            models.Index(fields=["active", "time"], name="listing_active_time_idx"),
+            # Finds due auctions and serves the "ending soon" ordering
+            models.Index(fields=["active", "ends_at"], name="listing_active_ends_at_idx"),
+        ]
+
     def __str__(self):
         return f"{self.title} - {self.owner}"
 
+    @property
+    def card_image(self):
+        return image_variant(self, "card")
+
+    @property
+    def detail_image(self):
+        return image_variant(self, "detail")
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        # New listings start out at their starting price
+        if self._state.adding:
+            if self.current_price is None:
+                self.current_price = self.startingPrice
+        elif update_fields is None and not force_insert:
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.MAINTAINED_FIELDS
+            ]
+        super().save(force_insert, force_update, using, update_fields)
+
 class Bid(models.Model):
     """
     Models a bid on an item
@@ -44,6 +192,14 @@ class Bid(models.Model):
     bid = models.DecimalField(max_digits=8, decimal_places=2)
     time = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Serves the keyset paginated bid history of a listing
+            models.Index(fields=["listing", "bid"], name="bid_listing_bid_idx"),
+            # Finds each bidder's highest bid on a listing with one seek
+            models.Index(fields=["listing", "bidder", "bid"], name="bid_listing_bidder_bid_idx"),
+        ]
+
     def __str__(self):
         return f"{self.bidder}, {self.listing}, {self.bid}"
 
@@ -56,14 +212,39 @@ class Comment(models.Model):
     content = models.CharField(max_length=500)
     time = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Serves the keyset paginated comments of a listing
+            models.Index(fields=["listing", "time"], name="comment_listing_time_idx"),
+        ]
+
     def __str__(self):
         return f"{self.commenter}, {self.time}, {self.content}"
 
 class Category(models.Model):
     """
-    A category of listings
+    A category of listings, addressed by its slug in URLs
     """
     name = models.CharField(max_length=64)
+    slug = models.SlugField(max_length=64, unique=True, blank=True)
 
     def __str__(self):
         return self.name
+
+    def save(self, *args, **kwargs):
+        if not self.slug:
+            self.slug = self.make_slug(self.name)
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def make_slug(cls, name):
+        """
+        Returns a slug for a category name that is not taken yet,
+        numbering it if needed, e.g. 'books-2'
+        """
+        base = slugify(name)[:58] or "category"
+        slug, number = base, 1
+        while cls.objects.filter(slug=slug).exists():
+            number += 1
+            slug = f"{base}-{number}"
+        return slug
@@ -0,0 +1,201 @@
+"""
+Contains the whole-page cache for anonymous visitors
+
+Anonymous visitors get the same index, category and listing pages, so
+these are cached whole, keyed by URL, and served without running the
+view. Requests carrying a session cookie always reach the view, and
+cached pages are sent with "Vary: Cookie" so shared caches tell the
+two apart. Every page comes with an ETag, revalidations are answered
+with 304.
+
+Writes purge pages through version keys that are part of every page
+key: listing pages depend on their listing's version, list pages on a
+version of all lists, and all pages on a global version. Purging
+deletes version keys once the transaction commits, after which the
+next request starts a new version and the old pages are never read
+again. Pages expire after settings.PAGE_CACHE_TIMEOUT seconds, which
+bounds their staleness should a purge be missed, e.g. by the cache of
+another process or a lagging replica.
+
+Hits, misses and purges are counted in the cache, see 'page_cache_stats'.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers, set_response_etag
+
+VERSION_KEY = "page_version:{}"
+PAGE_KEY = "page:{}:{}"
+STATS_KEY = "page_cache:{}"
+# Kinds of purges counted in the stats
+PURGES = ("listing", "lists", "all")
+
+
+def get_cache():
+    return caches[getattr(settings, "PAGE_CACHE", "default")]
+
+
+def version_keys(request, scope, kwargs):
+    """
+    Returns the version keys of the page requested, or None if
+    the request must not be served from the cache
+
+    Args:
+        scope: "listing" for listing pages, "lists" for pages listing listings
+        kwargs: Keyword arguments of the view
+    """
+    timeout = getattr(settings, "PAGE_CACHE_TIMEOUT", 60)
+    if not timeout or request.method not in ("GET", "HEAD"):
+        return None
+    if settings.SESSION_COOKIE_NAME in request.COOKIES:
+        return None
+    if scope == "listing":
+        pk = str(kwargs["pk"])
+        # Other spellings of a listing's URL would not be purged with it
+        if not pk.isdigit():
+            return None
+        return [VERSION_KEY.format("all"), VERSION_KEY.format(f"listing:{int(pk)}")]
+    return [VERSION_KEY.format("all"), VERSION_KEY.format("lists")]
+
+
+def count(cache, name, delta=1):
+    key = STATS_KEY.format(name)
+    if not cache.add(key, delta, timeout=None):
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            # Evicted between add() and incr()
+            cache.set(key, delta, timeout=None)
+
+
+def lookup(request, keys):
+    """
+    Returns the key of the requested page and the response to send
+    from the cache, if there is one
+    """
+    cache = get_cache()
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Start a new version, unless a concurrent request just did
+            cache.add(key, time.time_ns(), getattr(settings, "PAGE_CACHE_TIMEOUT", 60))
+            versions[key] = cache.get(key)
+    url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    page_key = PAGE_KEY.format(url, ".".join(str(versions[key]) for key in keys))
+    response = cache.get(page_key)
+    if response is None:
+        count(cache, "misses")
+        return page_key, None
+    count(cache, "hits")
+    return page_key, get_conditional_response(request, etag=response.get("ETag"), response=response)
+
+
+def store(request, page_key, response):
+    """
+    Caches a freshly rendered page, unless it is personal or an error.
+    Returns the response to send.
+    """
+    if response.status_code != 200 or response.streaming or response.cookies:
+        return response
+    set_response_etag(response)
+    patch_cache_control(response, public=True, max_age=getattr(settings, "PAGE_CACHE_MAX_AGE", 0))
+    patch_vary_headers(response, ("Cookie",))
+    get_cache().set(page_key, response, getattr(settings, "PAGE_CACHE_TIMEOUT", 60))
+    return get_conditional_response(request, etag=response.get("ETag"), response=response)
+
+
+def cache_anonymous_page(scope):
+    """
+    Decorator serving a view's pages to anonymous visitors from the cache.
+    Works with sync and async views.
+
+    Args:
+        scope: "listing" for views of a listing taking its 'pk',
+               "lists" for views listing listings or categories
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                keys = version_keys(request, scope, kwargs)
+                if keys is None:
+                    return await view(request, *args, **kwargs)
+                # One switch to the sync thread for all cache calls
+                page_key, response = await sync_to_async(lookup)(request, keys)
+                if response is not None:
+                    return response
+                response = await view(request, *args, **kwargs)
+                return await sync_to_async(store)(request, page_key, response)
+        else:
+            @wraps(view)
+            def wrapper(request, *args, **kwargs):
+                keys = version_keys(request, scope, kwargs)
+                if keys is None:
+                    return view(request, *args, **kwargs)
+                page_key, response = lookup(request, keys)
+                if response is not None:
+                    return response
+                return store(request, page_key, view(request, *args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def purge(kind, names):
+    """
+    Drops the versions of cached pages once the current transaction commits
+    """
+    keys = [VERSION_KEY.format(name) for name in names]
+
+    def delete():
+        cache = get_cache()
+        cache.delete_many(keys)
+        count(cache, f"purges:{kind}", len(keys))
+    transaction.on_commit(delete)
+
+
+def purge_listing_pages(listing_ids, lists=True):
+    """
+    Purges the cached pages of listings and, unless 'lists' is False,
+    the pages listing them, e.g. after new bids. Comments only show on
+    the listing's own page.
+    """
+    listing_ids = set(listing_ids)
+    if listing_ids:
+        purge("listing", [f"listing:{pk}" for pk in listing_ids])
+    if lists:
+        purge_list_pages()
+
+
+def purge_list_pages():
+    """
+    Purges the cached index and category pages, e.g. after new listings
+    """
+    purge("lists", ["lists"])
+
+
+def purge_all_pages():
+    """
+    Purges all cached pages, e.g. after categories change
+    """
+    purge("all", ["all"])
+
+
+def page_cache_stats():
+    """
+    Returns hits, misses, the hit ratio and the number of purged
+    versions per kind, as counted since the cache was cleared
+    """
+    names = ["hits", "misses"] + [f"purges:{kind}" for kind in PURGES]
+    counts = get_cache().get_many([STATS_KEY.format(name) for name in names])
+    hits, misses, *purges = (counts.get(STATS_KEY.format(name), 0) for name in names)
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / (hits + misses), 3) if hits + misses else None,
+        "purges": dict(zip(PURGES, purges)),
+    }
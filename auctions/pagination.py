@@ -0,0 +1,165 @@
+"""
+Contains keyset (cursor) pagination for listing querysets
+
+Pages are cut on a (field, id) pair instead of an OFFSET,
+so the database can seek straight to the start of a page through an
+index like (active, time), no matter how deep the page is.
+"""
+import base64
+import binascii
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db.models import Q
+
+
+def get_page_size():
+    """
+    Returns the configured number of listings per page
+    """
+    return getattr(settings, "LISTINGS_PER_PAGE", 20)
+
+
+def encode_cursor(obj, field="time"):
+    """
+    Encodes the sort key of an object into an url-safe cursor
+
+    Args:
+        obj: Model instance with 'field' and 'pk' attributes,
+             or a values() row with 'field' and 'id' keys
+        field (optional): Datetime or decimal field sorted on. Defaults to "time".
+    """
+    if isinstance(obj, dict):
+        value, pk = obj[field], obj["id"]
+    else:
+        value, pk = getattr(obj, field), obj.pk
+    raw = f"{value.isoformat() if isinstance(value, datetime) else value}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, parse=datetime.fromisoformat):
+    """
+    Decodes a cursor into a (value, pk) tuple.
+    Returns None if the cursor is missing or malformed.
+
+    Args:
+        cursor: Cursor string as produced by 'encode_cursor'
+        parse (optional): Parser of the sort key. Defaults to datetimes,
+                          pass Decimal for cursors on decimal fields.
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, pk = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        value = parse(value)
+        # Decimal() accepts "NaN" and "Infinity", which no column holds
+        if isinstance(value, Decimal) and not value.is_finite():
+            return None
+        return value, int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError, InvalidOperation):
+        return None
+
+
+class Page:
+    """
+    One page of keyset paginated objects
+        - 'next_cursor' points to the page after the last object
+        - 'previous_cursor' points to the page before the first object
+    """
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+def page_query(queryset, after=None, before=None, page_size=None, field="time", descending=True):
+    """
+    Returns the queryset fetching one page of a queryset ordered by
+    (field, id), and a function turning its rows into the Page. Lets
+    'paginate' and 'apaginate' share everything but the fetch.
+    Arguments as for 'paginate'.
+    """
+    page_size = page_size or get_page_size()
+    after = decode_cursor(after)
+    before = None if after else decode_cursor(before)
+    # Lookups and orderings walking in page order and against it
+    forward, backward = ("lt", "gt") if descending else ("gt", "lt")
+    sign = "-" if descending else ""
+    reverse_sign = "" if descending else "-"
+
+    # Walking backwards: fetch in reverse order, then flip the page
+    if before:
+        time, pk = before
+        query = (queryset
+            .filter(Q(**{f"{field}__{backward}": time}) | Q(**{field: time, f"pk__{backward}": pk}))
+            .order_by(f"{reverse_sign}{field}", f"{reverse_sign}pk")[:page_size + 1])
+    else:
+        if after:
+            time, pk = after
+            queryset = queryset.filter(
+                Q(**{f"{field}__{forward}": time}) | Q(**{field: time, f"pk__{forward}": pk})
+            )
+        query = queryset.order_by(f"{sign}{field}", f"{sign}pk")[:page_size + 1]
+
+    def make_page(rows):
+        if before:
+            has_previous = len(rows) > page_size
+            rows = rows[:page_size][::-1]
+            has_next = True
+        else:
+            has_next = len(rows) > page_size
+            rows = rows[:page_size]
+            has_previous = after is not None
+        return Page(
+            rows,
+            next_cursor=encode_cursor(rows[-1], field) if rows and has_next else None,
+            previous_cursor=encode_cursor(rows[0], field) if rows and has_previous else None
+        )
+    return query, make_page
+
+
+def paginate(queryset, after=None, before=None, page_size=None, field="time", descending=True):
+    """
+    Returns one page of a queryset ordered by (field, id), newest first
+    by default. Only one of 'after' and 'before' is used, 'after' taking
+    precedence.
+
+    Args:
+        queryset: Queryset of objects with a non-null datetime 'field',
+                  values() querysets have to include 'field' and 'id'
+        after (optional): Cursor of the last object of the previous page
+        before (optional): Cursor of the first object of the next page
+        page_size (optional): Defaults to settings.LISTINGS_PER_PAGE
+        field (optional): Datetime field to sort on. Defaults to "time".
+        descending (optional): Sort order. Defaults to True.
+    """
+    query, make_page = page_query(queryset, after, before, page_size, field, descending)
+    return make_page(list(query))
+
+
+async def apaginate(queryset, after=None, before=None, page_size=None, field="time", descending=True):
+    """
+    Async version of 'paginate' for async views
+    """
+    query, make_page = page_query(queryset, after, before, page_size, field, descending)
+    return make_page([row async for row in query])
@@ -0,0 +1,54 @@
+"""
+Contains the database router spreading reads over read replicas
+
+Writes always go to the primary ('default'). Reads go to a random
+replica in settings.DATABASE_REPLICAS, except:
+    - for REPLICA_PIN_SECONDS after a write, so users see their own bids
+      even if the replicas lag behind. ReplicaPinningMiddleware carries
+      the pin over to the user's following requests in a cookie.
+    - inside a transaction on the primary, which would otherwise miss
+      its own uncommitted changes
+"""
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Time until which reads of the current request or thread use the primary
+primary_until = ContextVar("primary_until", default=0.0)
+
+
+def pin_to_primary():
+    """
+    Sends reads to the primary for the next REPLICA_PIN_SECONDS
+    """
+    primary_until.set(time.time() + getattr(settings, "REPLICA_PIN_SECONDS", 5))
+
+
+def is_pinned():
+    return primary_until.get() > time.time()
+
+
+class PrimaryReplicaRouter:
+    """
+    Routes reads to replicas and writes to the primary
+    """
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, "DATABASE_REPLICAS", [])
+        if not replicas or is_pinned() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        return db not in getattr(settings, "DATABASE_REPLICAS", [])
@@ -0,0 +1,181 @@
+"""
+Contains full-text search over listing titles and descriptions
+
+On SQLite, listings are indexed in an external content FTS5 table.
+Triggers keep it in sync with every write to auctions_listing,
+including bulk inserts and queryset updates that bypass signals. The
+update trigger only fires for the indexed columns, so the frequent
+price updates from bidding never touch the index.
+"""
+import re
+
+from django.db import connection
+
+from .models import Listing
+
+FTS_TABLE = "auctions_listing_fts"
+
+# Column weights for bm25: title matches count more than description matches
+TITLE_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+CREATE_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, description,
+        content='auctions_listing', content_rowid='id',
+        tokenize='porter unicode61'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON auctions_listing BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON auctions_listing BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF title, description ON auctions_listing BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END
+    """,
+]
+
+DROP_SQL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_insert",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_delete",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_update",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+
+def fts_available(conn=connection):
+    """
+    Returns whether full-text search is supported by the database
+    """
+    return conn.vendor == "sqlite"
+
+
+def create_search_index(conn=connection):
+    """
+    Creates the FTS table and its triggers if they are missing
+    and fills the table from the listings
+    """
+    if not fts_available(conn):
+        return
+    with conn.cursor() as cursor:
+        for statement in CREATE_SQL:
+            cursor.execute(statement)
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def ensure_search_index(conn=connection):
+    """
+    Recreates and refills the search index if any of its triggers is
+    missing. SQLite migrations that remake auctions_listing drop them.
+    Does nothing if the index has not been created by its migration.
+    """
+    if not fts_available(conn) or FTS_TABLE not in conn.introspection.table_names():
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+            [f"{FTS_TABLE}_%"]
+        )
+        if cursor.fetchone()[0] == len(CREATE_SQL) - 1:
+            return
+    create_search_index(conn)
+
+
+def drop_search_index(conn=connection):
+    """
+    Drops the FTS table and its triggers
+    """
+    if not fts_available(conn):
+        return
+    with conn.cursor() as cursor:
+        for statement in DROP_SQL:
+            cursor.execute(statement)
+
+
+def optimize_search_index(conn=connection):
+    """
+    Merges the FTS index segments for faster queries
+    """
+    if not fts_available(conn):
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+
+def build_match_query(query):
+    """
+    Turns free text into an FTS5 query matching all words, the last
+    one as prefix. Words are quoted so user input can never produce
+    an FTS5 syntax error. Returns None if there are no words.
+
+    Args:
+        query: Search string as typed by the user
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def search_listings(query, category=None, active=True, limit=20, offset=0):
+    """
+    Returns listing cards matching a search query, best match first.
+    Fetches one listing more than 'limit' to tell whether there is a
+    next page.
+
+    Args:
+        query: Search string as typed by the user
+        category (optional): Only return listings of this category
+        active (optional): Only return active listings. Defaults to True.
+        limit (optional): Maximum number of results. Defaults to 20.
+        offset (optional): Number of results to skip. Defaults to 0.
+    """
+    match = build_match_query(query)
+    if match is None:
+        return []
+
+    # Fallback for databases without FTS5
+    if not fts_available():
+        listings = Listing.objects.cards().filter(title__icontains=query.strip())
+        if category is not None:
+            listings = listings.filter(category=category)
+        if active:
+            listings = listings.filter(active=True)
+        return list(listings.order_by("-time")[offset:offset + limit + 1])
+
+    sql = f"""
+        SELECT l.id FROM {FTS_TABLE} f
+        JOIN auctions_listing l ON l.id = f.rowid
+        WHERE {FTS_TABLE} MATCH %s
+    """
+    params = [match]
+    if category is not None:
+        sql += " AND l.category_id = %s"
+        params.append(category.pk)
+    if active:
+        sql += " AND l.active"
+    sql += f" ORDER BY bm25({FTS_TABLE}, {TITLE_WEIGHT}, {DESCRIPTION_WEIGHT}) LIMIT %s OFFSET %s"
+    params += [limit + 1, offset]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        ids = [row[0] for row in cursor.fetchall()]
+
+    # Load the cards and restore the ranking
+    cards = Listing.objects.cards().in_bulk(ids)
+    return [cards[pk] for pk in ids if pk in cards]
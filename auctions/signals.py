@@ -0,0 +1,225 @@
+"""
+Contains signal handlers keeping denormalized listing data in sync
+"""
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.db.models.functions import Greatest, Now
+from django.db import connections
+from django.contrib.auth.signals import user_logged_out
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .auth import invalidate_user
+from .caching import invalidate_category_counts
+from .dashboard import invalidate_bid_dashboards, invalidate_dashboards, invalidate_listing_dashboards
+from .db import apply_pragmas
+from .events import get_broker, listing_event
+from .middleware import install_query_profiling
+from .models import Bid, Category, Comment, Listing, User
+from .pagecache import purge_all_pages, purge_listing_pages
+from .search import ensure_search_index
+
+
+def publish_listing(listing_id):
+    """
+    Publishes the latest price and status of a listing to its live
+    subscribers once the current transaction commits
+    """
+    def publish():
+        broker = get_broker()
+        # Skip the query if nobody is listening
+        if not broker.has_subscribers(listing_id):
+            return
+        listing = (Listing.objects
+            .filter(pk=listing_id)
+            .values("id", "current_price", "bid_count", "active")
+            .first())
+        if listing is not None:
+            broker.publish(listing_id, listing_event(listing))
+    transaction.on_commit(publish)
+
+
+def touch_listings(listings):
+    """
+    Bumps the 'updated' stamp of listings showing the name of a changed
+    owner, winner or category, so API ETags and cached cards change
+    with it, and purges their cached pages
+    """
+    listing_ids = list(listings.values_list("pk", flat=True))
+    if listing_ids:
+        Listing.objects.filter(pk__in=listing_ids).update(updated=Now())
+        purge_listing_pages(listing_ids)
+
+
+@receiver(post_save, sender=Bid)
+def bid_saved(sender, instance, created, **kwargs):
+    """
+    Updates price, bid count and current bid of the listing a bid
+    was written for. New bids are applied in a single conditional
+    UPDATE, so concurrent bids cannot overwrite each other. Bumping
+    'updated' invalidates cached listing cards.
+    """
+    listing = Listing.objects.filter(pk=instance.listing_id)
+    if created:
+        listing.update(
+            bid_count=F("bid_count") + 1,
+            current_price=Greatest("current_price", Value(instance.bid)),
+            currentBid=Case(
+                When(current_price__lte=instance.bid, then=Value(instance.pk)),
+                default=F("currentBid"),
+                output_field=IntegerField()
+            ),
+            updated=Now()
+        )
+        invalidate_bid_dashboards(instance)
+    # Edited bids (e.g. through the admin) may change the ranking
+    else:
+        listing.update_bid_stats()
+        invalidate_listing_dashboards([instance.listing_id])
+    purge_listing_pages([instance.listing_id])
+    publish_listing(instance.listing_id)
+
+
+@receiver(post_delete, sender=Bid)
+def bid_deleted(sender, instance, **kwargs):
+    """
+    Recomputes the listing's bid data once a bid is deleted
+    """
+    Listing.objects.filter(pk=instance.listing_id).update_bid_stats()
+    invalidate_listing_dashboards([instance.listing_id])
+    invalidate_dashboards([instance.bidder_id])
+    purge_listing_pages([instance.listing_id])
+    publish_listing(instance.listing_id)
+
+
+@receiver(post_save, sender=Listing)
+def listing_saved(sender, instance, created, **kwargs):
+    """
+    Pushes status changes, e.g. closing an auction, to live subscribers.
+    New and edited listings may change the category counts and
+    the dashboards of their owners and bidders.
+    """
+    invalidate_category_counts()
+    purge_listing_pages([instance.pk])
+    if created:
+        invalidate_dashboards([instance.owner_id])
+    else:
+        invalidate_listing_dashboards([instance.pk])
+        publish_listing(instance.pk)
+
+
+@receiver(post_delete, sender=Listing)
+def listing_deleted(sender, instance, **kwargs):
+    invalidate_category_counts()
+    purge_listing_pages([instance.pk])
+    invalidate_dashboards([instance.owner_id, instance.winner_id])
+
+
+@receiver(m2m_changed, sender=User.watchlist.through)
+def watchlist_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Recomputes the watcher counts of listings added to or removed
+    from watchlists, from either side of the relation
+    """
+    if action == "pre_clear" and not reverse:
+        # Remember the listings, they are gone after clearing
+        instance._cleared_watchlist = list(instance.watchlist.values_list("pk", flat=True))
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if reverse:
+        listing_ids = [instance.pk]
+    elif action == "post_clear":
+        listing_ids = instance.__dict__.pop("_cleared_watchlist", [])
+    else:
+        listing_ids = pk_set
+    if listing_ids:
+        Listing.objects.filter(pk__in=listing_ids).update_watcher_count()
+        # Listing pages show the number of watchers
+        purge_listing_pages(listing_ids, lists=False)
+    # Drop the cached users whose watchlist changed
+    for user_id in (pk_set or []) if reverse else [instance.pk]:
+        invalidate_user(user_id)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_changed(sender, instance, **kwargs):
+    purge_listing_pages([instance.listing_id], lists=False)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    """
+    Category names show on the categories page and on listing cards
+    """
+    invalidate_category_counts()
+    purge_all_pages()
+
+
+@receiver(post_save, sender=Category)
+@receiver(pre_delete, sender=Category)
+def category_renamed(sender, instance, **kwargs):
+    """
+    Listings show their category's name. Deleted categories are
+    handled before their listings lose them.
+    """
+    touch_listings(Listing.objects.filter(category=instance))
+
+
+@receiver(post_migrate)
+def restore_search_index(sender, using, **kwargs):
+    """
+    Restores search index triggers dropped by table remakes
+    """
+    if sender.name == "auctions":
+        ensure_search_index(connections[using])
+
+
+@receiver(connection_created)
+def configure_connection(sender, connection, **kwargs):
+    """
+    Applies settings.SQLITE_PRAGMAS to new SQLite connections and
+    reports their queries to the request profiler
+    """
+    apply_pragmas(connection)
+    install_query_profiling(connection)
+
+
+@receiver(pre_save, sender=User)
+def user_saving(sender, instance, update_fields=None, **kwargs):
+    """
+    Remembers whether the username changes. Logins only save 'last_login'
+    and skip the query.
+    """
+    instance._username_changed = bool(
+        instance.pk
+        and (update_fields is None or "username" in update_fields)
+        and User.objects.filter(pk=instance.pk).exclude(username=instance.username).exists()
+    )
+
+
+@receiver(post_save, sender=User)
+def user_renamed(sender, instance, **kwargs):
+    """
+    Listings show the usernames of their owner and winner
+    """
+    if instance.__dict__.pop("_username_changed", False):
+        touch_listings(Listing.objects.filter(Q(owner=instance) | Q(winner=instance)))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    """
+    Drops cached users after profile and password changes or logins
+    """
+    invalidate_user(instance.pk)
+
+
+@receiver(user_logged_out)
+def logged_out(sender, request, user, **kwargs):
+    if user is not None:
+        invalidate_user(user.pk)
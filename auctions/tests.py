@@ -1,3 +1,1867 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import urllib.request
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, connections, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.http import Http404
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from . import assets, auth, benchmark, dashboard, images, marketplace, pagecache, throttling
+from .bidding import BidStatus, bid_history, place_bid
+from .closing import close_due_listings
+from .db import immediate_atomic
+from .events import InProcessBroker, get_broker
+from .models import Bid, Category, Comment, Listing, User
+from .pagination import decode_cursor, encode_cursor, paginate
+from .routers import primary_until
+from .search import build_match_query, search_listings
+
+
+def create_listings(owner, count, **kwargs):
+    """
+    Creates 'count' listings with strictly decreasing timestamps,
+    newest first
+    """
+    now = timezone.now()
+    listings = []
+    for i in range(count):
+        listing = Listing.objects.create(
+            owner=owner, title=f"Item {i}", description="Description",
+            startingPrice=10, **kwargs
+        )
+        listing.time = now - timedelta(minutes=i)
+        listing.save()
+        listings.append(listing)
+    return listings
+
+
+class PaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("seller", "seller@example.com", "password")
+        cls.listings = create_listings(cls.user, 7)
+
+    def test_cursor_round_trip(self):
+        listing = self.listings[3]
+        self.assertEqual(decode_cursor(encode_cursor(listing)), (listing.time, listing.pk))
+
+    def test_malformed_cursor_is_ignored(self):
+        self.assertIsNone(decode_cursor("not-a-cursor"))
+        page = paginate(Listing.objects.all(), after="not-a-cursor", page_size=3)
+        self.assertEqual(list(page), self.listings[:3])
+
+    def test_walk_forward_and_back(self):
+        queryset = Listing.objects.filter(active=True)
+        first = paginate(queryset, page_size=3)
+        self.assertEqual(list(first), self.listings[:3])
+        self.assertFalse(first.has_previous)
+        second = paginate(queryset, after=first.next_cursor, page_size=3)
+        self.assertEqual(list(second), self.listings[3:6])
+        last = paginate(queryset, after=second.next_cursor, page_size=3)
+        self.assertEqual(list(last), self.listings[6:])
+        self.assertFalse(last.has_next)
+        back = paginate(queryset, before=last.previous_cursor, page_size=3)
+        self.assertEqual(list(back), self.listings[3:6])
+        self.assertTrue(back.has_previous)
+
+    def test_ties_on_time_are_split_by_id(self):
+        Listing.objects.update(time=self.listings[0].time)
+        queryset = Listing.objects.all()
+        first = paginate(queryset, page_size=4)
+        second = paginate(queryset, after=first.next_cursor, page_size=4)
+        seen = [listing.pk for listing in first] + [listing.pk for listing in second]
+        self.assertEqual(sorted(seen, reverse=True), seen)
+        self.assertEqual(len(set(seen)), 7)
+
+    @override_settings(LISTINGS_PER_PAGE=5)
+    def test_index_renders_one_page(self):
+        response = self.client.get(reverse("index"))
+        self.assertEqual(len(response.context["listings"]), 5)
+        self.assertContains(response, "?after=")
+        response = self.client.get(reverse("index"), {"after": response.context["page"].next_cursor})
+        self.assertEqual(list(response.context["listings"]), self.listings[5:])
+
+    @override_settings(LISTINGS_PER_PAGE=2)
+    def test_category_page_is_paginated(self):
+        category = Category.objects.create(name="Books")
+        Listing.objects.filter(pk__in=[l.pk for l in self.listings[:3]]).update(category=category)
+        response = self.client.get(reverse("category", args=[category.slug]))
+        self.assertEqual(list(response.context["listings"]), self.listings[:2])
+        self.assertTrue(response.context["page"].has_next)
+
+
+# Renders the pages every time, without the anonymous page cache
+@override_settings(PAGE_CACHE_TIMEOUT=0)
+class ListingCardQueryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("seller", "seller@example.com", "password")
+        cls.bidder = User.objects.create_user("bidder", "bidder@example.com", "password")
+        cls.category = Category.objects.create(name="Books")
+        cls.listings = create_listings(cls.user, 10, category=cls.category)
+        for listing in cls.listings:
+            Bid.objects.create(bidder=cls.bidder, listing=listing, bid=20)
+        cls.bidder.watchlist.add(*cls.listings)
+
+    def setUp(self):
+        cache.clear()
+
+    def assert_constant_queries(self, url, expected):
+        """
+        Asserts that rendering 'url' takes 'expected' queries both
+        with a few listings and with many listings on the page
+        """
+        for page_size in (2, 10):
+            with self.settings(LISTINGS_PER_PAGE=page_size):
+                with self.assertNumQueries(expected):
+                    response = self.client.get(url)
+                self.assertEqual(len(response.context["listings"]), page_size)
+                self.assertContains(response, "$20.00")
+
+    def test_index_queries(self):
+        self.assert_constant_queries(reverse("index"), 1)
+
+    def test_category_queries(self):
+        self.assert_constant_queries(reverse("category", args=[self.category.slug]), 2)
+
+    def test_watchlist_queries(self):
+        self.client.force_login(self.bidder)
+        url = reverse("watchlist", args=[self.bidder.username])
+        # Session and user come from the cache once it is warm
+        self.client.get(url)
+        self.assert_constant_queries(url, 1)
+
+    def test_long_description_is_truncated(self):
+        Listing.objects.filter(pk=self.listings[0].pk).update(description="x" * 1000)
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, "x" * 199 + "…")
+        self.assertNotContains(response, "x" * 201)
+
+
+class BidStatsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "seller@example.com", "password")
+        cls.bidder = User.objects.create_user("bidder", "bidder@example.com", "password")
+
+    def setUp(self):
+        self.listing = Listing.objects.create(
+            owner=self.seller, title="Lamp", description="Old lamp", startingPrice=10
+        )
+
+    def assert_stats(self, price, count, current_bid):
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.current_price, Decimal(price))
+        self.assertEqual(self.listing.bid_count, count)
+        self.assertEqual(self.listing.currentBid, current_bid)
+
+    def test_new_listing_starts_at_starting_price(self):
+        self.assert_stats("10", 0, None)
+
+    def test_bids_update_listing(self):
+        first = Bid.objects.create(bidder=self.bidder, listing=self.listing, bid=15)
+        self.assert_stats("15", 1, first)
+        second = Bid.objects.create(bidder=self.bidder, listing=self.listing, bid=25)
+        self.assert_stats("25", 2, second)
+        # A lower bid is counted but leaves the price alone
+        Bid.objects.create(bidder=self.bidder, listing=self.listing, bid=20)
+        self.assert_stats("25", 3, second)
+
+    def test_edited_and_deleted_bids_are_recomputed(self):
+        first = Bid.objects.create(bidder=self.bidder, listing=self.listing, bid=15)
+        second = Bid.objects.create(bidder=self.bidder, listing=self.listing, bid=25)
+        first.bid = 30
+        first.save()
+        self.assert_stats("30", 2, first)
+        first.delete()
+        self.assert_stats("25", 1, second)
+        second.delete()
+        self.assert_stats("10", 0, None)
+
+    def test_backfill_command(self):
+        bid = Bid.objects.create(bidder=self.bidder, listing=self.listing, bid=15)
+        Listing.objects.update(current_price=0, bid_count=0, currentBid=None)
+        call_command("backfill_listing_prices", batch_size=1, stdout=StringIO())
+        self.assert_stats("15", 1, bid)
+
+
+class PlaceBidTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "seller@example.com", "password")
+        cls.alice = User.objects.create_user("alice", "alice@example.com", "password")
+        cls.bob = User.objects.create_user("bob", "bob@example.com", "password")
+
+    def setUp(self):
+        self.listing = Listing.objects.create(
+            owner=self.seller, title="Lamp", description="Old lamp", startingPrice=10
+        )
+
+    def test_first_bid_may_match_starting_price(self):
+        result = place_bid(self.listing.pk, self.alice, Decimal("10"))
+        self.assertEqual(result.status, BidStatus.ACCEPTED)
+        self.assertEqual(result.bid.bid, Decimal("10"))
+
+    def test_bid_below_starting_price_is_outbid(self):
+        result = place_bid(self.listing.pk, self.alice, Decimal("9.99"))
+        self.assertEqual(result.status, BidStatus.OUTBID)
+        self.assertEqual(result.current_price, Decimal("10"))
+        self.assertFalse(Bid.objects.exists())
+
+    def test_later_bids_must_beat_current_price(self):
+        place_bid(self.listing.pk, self.alice, Decimal("15"))
+        self.assertEqual(place_bid(self.listing.pk, self.bob, Decimal("15")).status, BidStatus.OUTBID)
+        self.assertEqual(place_bid(self.listing.pk, self.bob, Decimal("15.01")).status, BidStatus.ACCEPTED)
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.currentBid.bidder, self.bob)
+        self.assertEqual(self.listing.bid_count, 2)
+
+    def test_stale_lower_bid_cannot_overwrite_higher_bid(self):
+        # Both bidders saw a price of 10, the higher bid lands first
+        place_bid(self.listing.pk, self.bob, Decimal("30"))
+        result = place_bid(self.listing.pk, self.alice, Decimal("20"))
+        self.assertEqual(result.status, BidStatus.OUTBID)
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.current_price, Decimal("30"))
+        self.assertEqual(self.listing.currentBid.bidder, self.bob)
+
+    def test_saving_stale_listing_keeps_bid_that_landed_after_load(self):
+        # The owner loaded the listing before the bid and edits it after
+        place_bid(self.listing.pk, self.alice, Decimal("15"))
+        self.listing.title = "Brass lamp"
+        self.listing.save()
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.title, "Brass lamp")
+        self.assertEqual(self.listing.current_price, Decimal("15"))
+        self.assertEqual(self.listing.bid_count, 1)
+        self.assertEqual(self.listing.currentBid.bidder, self.alice)
+
+    def test_closed_listing_rejects_bids(self):
+        Listing.objects.filter(pk=self.listing.pk).update(active=False)
+        self.assertEqual(place_bid(self.listing.pk, self.alice, Decimal("50")).status, BidStatus.CLOSED)
+
+    def test_bid_view(self):
+        self.client.force_login(self.alice)
+        url = reverse("listings", args=[self.listing.pk])
+        response = self.client.post(url, {"new_bid": "", "bid": "12.50"})
+        self.assertContains(response, "Your bid has been added to the auction.")
+        self.assertContains(response, "$12.50")
+        response = self.client.post(url, {"new_bid": "", "bid": "12"})
+        self.assertContains(response, "Your bid must be higher than the current bid.")
+        response = self.client.post(url, {"new_bid": "", "bid": "abc"})
+        self.assertContains(response, "Please enter a valid bid.")
+
+
+# Renders the pages every time, without the anonymous page cache
+@override_settings(PAGE_CACHE_TIMEOUT=0)
+class ListingCardCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "seller@example.com", "password")
+        cls.bidder = User.objects.create_user("bidder", "bidder@example.com", "password")
+
+    def setUp(self):
+        cache.clear()
+        self.listing = Listing.objects.create(
+            owner=self.seller, title="Lamp", description="Old lamp", startingPrice=10
+        )
+        # The card's cache key contains its age, keep it in one bucket for the whole test
+        Listing.objects.filter(pk=self.listing.pk).update(time=timezone.now() - timedelta(days=2))
+        self.listing.refresh_from_db()
+
+    def test_card_is_served_from_cache(self):
+        self.client.get(reverse("index"))
+        # Bypasses signals and 'updated', so the cached card is shown
+        Listing.objects.filter(pk=self.listing.pk).update(title="Chair")
+        self.assertContains(self.client.get(reverse("index")), "Lamp")
+
+    def test_bid_invalidates_card(self):
+        self.assertContains(self.client.get(reverse("index")), "$10.00")
+        place_bid(self.listing.pk, self.bidder, Decimal("12"))
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, "$12.00")
+        self.assertContains(response, "(1 bid)")
+
+    def test_edit_invalidates_card(self):
+        self.client.get(reverse("index"))
+        self.listing.title = "Chair"
+        self.listing.save()
+        self.assertContains(self.client.get(reverse("index")), "Chair")
+
+    def test_age_stays_current(self):
+        self.assertContains(self.client.get(reverse("index")), "2\xa0days ago")
+        Listing.objects.filter(pk=self.listing.pk).update(time=timezone.now() - timedelta(hours=3))
+        self.assertContains(self.client.get(reverse("index")), "3\xa0hours ago")
+
+
+class SearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "seller@example.com", "password")
+        cls.books = Category.objects.create(name="Books")
+        cls.lamp = Listing.objects.create(
+            owner=cls.seller, title="Brass lamp", description="Lights up any room", startingPrice=10
+        )
+        cls.novel = Listing.objects.create(
+            owner=cls.seller, title="Novel", description="A story about a brass lamp",
+            startingPrice=5, category=cls.books
+        )
+        cls.closed = Listing.objects.create(
+            owner=cls.seller, title="Lamp shade", description="Fits most lamps",
+            startingPrice=5, active=False
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_match_query_is_sanitized(self):
+        self.assertEqual(build_match_query('brass "lamp'), '"brass" "lamp"*')
+        self.assertIsNone(build_match_query('"*()'))
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual(search_listings("brass lamp"), [self.lamp, self.novel])
+
+    def test_prefix_and_stemming(self):
+        self.assertEqual(search_listings("lamps"), [self.lamp, self.novel])
+        self.assertEqual(search_listings("nov"), [self.novel])
+
+    def test_filters(self):
+        self.assertEqual(search_listings("lamp", category=self.books), [self.novel])
+        self.assertIn(self.closed, search_listings("shade", active=False))
+        self.assertEqual(search_listings("shade"), [])
+
+    def test_index_follows_edits_and_deletes(self):
+        self.lamp.title = "Copper kettle"
+        self.lamp.save()
+        self.assertEqual(search_listings("kettle"), [self.lamp])
+        self.assertEqual(search_listings("brass"), [self.novel])
+        self.novel.delete()
+        self.assertEqual(search_listings("brass"), [])
+
+    def test_rebuild_command(self):
+        call_command("rebuild_search_index", optimize=True, stdout=StringIO())
+        self.assertEqual(search_listings("brass lamp"), [self.lamp, self.novel])
+
+    @override_settings(LISTINGS_PER_PAGE=1)
+    def test_search_view(self):
+        response = self.client.get(reverse("search"), {"q": "lamp"})
+        self.assertEqual(response.context["listings"], [self.lamp])
+        self.assertIsNone(response.context["previous_url"])
+        response = self.client.get(reverse("search"), {"q": "lamp", "page": 2})
+        self.assertEqual(response.context["listings"], [self.novel])
+        self.assertIn("page=1", response.context["previous_url"])
+        response = self.client.get(reverse("search"), {"q": '")('})
+        self.assertContains(response, "No listings match your search.")
+
+
+class ApiTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "seller@example.com", "password")
+        cls.bidder = User.objects.create_user("bidder", "bidder@example.com", "password")
+        cls.books = Category.objects.create(name="Books")
+        cls.listings = create_listings(cls.seller, 3, category=cls.books)
+        cls.listing = cls.listings[0]
+        place_bid(cls.listing.pk, cls.bidder, Decimal("12.50"))
+
+    @override_settings(LISTINGS_PER_PAGE=2)
+    def test_listings(self):
+        data = self.client.get(reverse("api_listings")).json()
+        self.assertEqual([row["id"] for row in data["results"]], [l.pk for l in self.listings[:2]])
+        self.assertEqual(data["results"][0]["current_price"], "12.50")
+        self.assertEqual(data["results"][0]["owner_username"], "seller")
+        data = self.client.get(reverse("api_listings"), {"after": data["next"]}).json()
+        self.assertEqual([row["id"] for row in data["results"]], [self.listings[2].pk])
+        self.assertIsNone(data["next"])
+
+    def test_listing_filters(self):
+        Listing.objects.filter(pk=self.listing.pk).update(active=False)
+        data = self.client.get(reverse("api_listings"), {"active": "false"}).json()
+        self.assertEqual([row["id"] for row in data["results"]], [self.listing.pk])
+        data = self.client.get(reverse("api_listings"), {"category": self.books.pk + 1}).json()
+        self.assertEqual(data["results"], [])
+
+    def test_listing_detail_and_bids(self):
+        data = self.client.get(reverse("api_listing", args=[self.listing.pk])).json()
+        self.assertEqual(data["bid_count"], 1)
+        self.assertEqual(data["description"], "Description")
+        data = self.client.get(reverse("api_bids", args=[self.listing.pk])).json()
+        self.assertEqual(data["results"][0]["bidder_username"], "bidder")
+        self.assertEqual(data["results"][0]["bid"], "12.50")
+        self.assertEqual(self.client.get(reverse("api_listing", args=[0])).status_code, 404)
+
+    def test_categories(self):
+        data = self.client.get(reverse("api_categories")).json()
+        self.assertEqual(data["results"], [{"id": self.books.pk, "name": "Books", "slug": "books"}])
+
+    def test_conditional_get(self):
+        url = reverse("api_listing", args=[self.listing.pk])
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertIn("Last-Modified", response)
+        # Unchanged resources are answered by the stamp query alone
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # A new bid changes the listing's stamp
+        place_bid(self.listing.pk, self.bidder, Decimal("20"))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_conditional_get_on_list(self):
+        url = reverse("api_listings")
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Listing.objects.create(owner=self.seller, title="New", description="New", startingPrice=1)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    @override_settings(LISTINGS_PER_PAGE=1)
+    def test_conditional_get_reads_only_the_page(self):
+        url = reverse("api_listings")
+        etag = self.client.get(url)["ETag"]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(len(queries), 1)
+        self.assertIn("LIMIT 2", queries[0]["sql"])
+        # Changes beyond the page and the row after it leave it alone
+        Listing.objects.filter(pk=self.listings[2].pk).update(updated=timezone.now())
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Listing.objects.filter(pk=self.listings[0].pk).update(updated=timezone.now())
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_renames_change_etags(self):
+        urls = [reverse("api_listings"), reverse("api_listing", args=[self.listing.pk])]
+        etags = [self.client.get(url)["ETag"] for url in urls]
+        # Logins do not touch the listings
+        self.client.login(username="seller", password="password")
+        self.client.logout()
+        for url, etag in zip(urls, etags):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        for instance, field, name in ((self.books, "name", "Old books"), (self.seller, "username", "vendor")):
+            setattr(instance, field, name)
+            instance.save()
+            responses = [self.client.get(url, HTTP_IF_NONE_MATCH=etag) for url, etag in zip(urls, etags)]
+            self.assertEqual([response.status_code for response in responses], [200, 200])
+            etags = [response["ETag"] for response in responses]
+        data = self.client.get(urls[1]).json()
+        self.assertEqual((data["category_name"], data["owner_username"]), ("Old books", "vendor"))
+
+
+class LiveUpdateTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "seller@example.com", "password")
+        cls.bidder = User.objects.create_user("bidder", "bidder@example.com", "password")
+        cls.listing = Listing.objects.create(
+            owner=cls.seller, title="Lamp", description="Old lamp", startingPrice=10
+        )
+
+    async def test_broker_keeps_latest_event(self):
+        broker = InProcessBroker()
+        subscription = broker.subscribe(1)
+        # Publish from another thread, like a synchronous view would
+        publisher = threading.Thread(target=lambda: [broker.publish(1, n) for n in range(3)])
+        publisher.start()
+        publisher.join()
+        self.assertEqual(await subscription.get(timeout=1), 2)
+        self.assertIsNone(await subscription.get(timeout=0.01))
+        broker.unsubscribe(subscription)
+        self.assertFalse(broker.has_subscribers(1))
+
+    async def test_event_stream(self):
+        response = await self.async_client.get(reverse("listing_events", args=[self.listing.pk]))
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = response.streaming_content
+        # The current state comes first
+        chunk = await anext(stream)
+        self.assertEqual(json.loads(chunk.decode().split("data: ")[1])["current_price"], "10.00")
+        # Followed by published changes
+        next_chunk = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0.01)
+        get_broker().publish(self.listing.pk, {"current_price": "12.00", "active": True})
+        chunk = await asyncio.wait_for(next_chunk, 1)
+        self.assertEqual(json.loads(chunk.decode().split("data: ")[1])["current_price"], "12.00")
+        await stream.aclose()
+
+    def test_no_stream_under_wsgi(self):
+        path = reverse("listing_events", args=[self.listing.pk])
+        status = []
+        body = get_wsgi_application()(benchmark.wsgi_environ(path), lambda line, headers, exc_info=None: status.append(line))
+        try:
+            # Answered right away instead of buffering a stream that never ends
+            self.assertEqual(b"".join(body), b"")
+        finally:
+            body.close()
+        self.assertEqual(status, ["204 No Content"])
+
+    @override_settings(PAGE_CACHE_TIMEOUT=0)
+    async def test_listing_page_opens_stream_under_asgi_only(self):
+        url = reverse("listings", args=[self.listing.pk])
+        self.assertNotContains(await sync_to_async(self.client.get)(url), "EventSource")
+        self.assertContains(await self.async_client.get(url), "EventSource")
+
+    def test_bids_are_published_on_commit(self):
+        published = []
+        broker = get_broker()
+        broker.has_subscribers = lambda listing_id: True
+        broker.publish = lambda listing_id, event: published.append(event)
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                place_bid(self.listing.pk, self.bidder, Decimal("15"))
+        finally:
+            del broker.has_subscribers, broker.publish
+        self.assertEqual(published[-1]["current_price"], "15.00")
+        self.assertEqual(published[-1]["bid_count"], 1)
+
+
+class WatchlistTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "seller@example.com", "password")
+        cls.alice = User.objects.create_user("alice", "alice@example.com", "password")
+        cls.bob = User.objects.create_user("bob", "bob@example.com", "password")
+        cls.listings = create_listings(cls.seller, 3)
+
+    def watcher_counts(self):
+        return list(Listing.objects.order_by("-time").values_list("watcher_count", flat=True))
+
+    def test_watcher_counts_follow_both_sides(self):
+        self.alice.watchlist.add(*self.listings[:2])
+        self.listings[0].watchers.add(self.bob)
+        self.assertEqual(self.watcher_counts(), [2, 1, 0])
+        self.alice.watchlist.remove(self.listings[0])
+        self.assertEqual(self.watcher_counts(), [1, 1, 0])
+        self.alice.watchlist.clear()
+        self.listings[0].watchers.clear()
+        self.assertEqual(self.watcher_counts(), [0, 0, 0])
+
+    def test_listing_page_checks_membership(self):
+        listing = self.listings[0]
+        self.alice.watchlist.add(listing)
+        self.client.force_login(self.alice)
+        response = self.client.get(reverse("listings", args=[listing.pk]))
+        self.assertTrue(response.context["watched"])
+        self.assertContains(response, "Remove from Watchlist")
+        self.assertContains(response, "watched by 1 user")
+        response = self.client.post(reverse("listings", args=[listing.pk]), {"watchlist": "checked"})
+        self.assertFalse(response.context["watched"])
+        self.assertEqual(response.context["listing"].watcher_count, 0)
+
+    def test_bulk_endpoints(self):
+        Listing.objects.filter(pk=self.listings[2].pk).update(active=False)
+        self.client.force_login(self.alice)
+        ids = [listing.pk for listing in self.listings] + ["x"]
+        response = self.client.post(reverse("watchlist_add"), {"listings": ids})
+        # Closed listings are not added
+        self.assertEqual(response.json(), {"count": 2})
+        self.assertEqual(self.watcher_counts(), [1, 1, 0])
+        response = self.client.post(reverse("watchlist_remove"), {"listings": ids[:1]})
+        self.assertEqual(response.json(), {"count": 1})
+        self.assertEqual(self.client.get(reverse("watchlist_add")).status_code, 405)
+
+
+class ClosingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "seller@example.com", "password")
+        cls.bidder = User.objects.create_user("bidder", "bidder@example.com", "password")
+
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.due, self.unsold, self.running, self.open_ended = create_listings(self.seller, 4)
+        for listing, ends_at in (
+            (self.due, now + timedelta(minutes=5)),
+            (self.unsold, now - timedelta(minutes=1)),
+            (self.running, now + timedelta(hours=1)),
+        ):
+            listing.ends_at = ends_at
+            listing.save()
+        place_bid(self.due.pk, self.bidder, Decimal("15"))
+        Listing.objects.filter(pk=self.due.pk).update(ends_at=now - timedelta(minutes=2))
+
+    def test_close_due_listings(self):
+        closed = close_due_listings()
+        self.assertEqual(sorted(closed), sorted([self.due.pk, self.unsold.pk]))
+        self.due.refresh_from_db()
+        self.assertFalse(self.due.active)
+        self.assertEqual(self.due.winner, self.bidder)
+        self.unsold.refresh_from_db()
+        self.assertFalse(self.unsold.active)
+        self.assertIsNone(self.unsold.winner)
+        self.assertEqual(Listing.objects.filter(active=True).count(), 2)
+        # Nothing is closed twice
+        self.assertEqual(close_due_listings(), [])
+
+    def test_batches(self):
+        self.assertEqual(close_due_listings(batch_size=1), [self.due.pk])
+        self.assertEqual(close_due_listings(batch_size=1), [self.unsold.pk])
+
+    def test_command(self):
+        out = StringIO()
+        call_command("close_auctions", once=True, stdout=out)
+        self.assertIn("Closed 2 auctions in total.", out.getvalue())
+
+    def test_expired_listing_rejects_bids(self):
+        result = place_bid(self.unsold.pk, self.bidder, Decimal("100"))
+        self.assertEqual(result.status, BidStatus.CLOSED)
+
+    def test_owner_close_sets_winner(self):
+        self.client.force_login(self.seller)
+        listing = self.running
+        place_bid(listing.pk, self.bidder, Decimal("20"))
+        self.client.post(reverse("listings", args=[listing.pk]), {"close": ""})
+        listing.refresh_from_db()
+        self.assertFalse(listing.active)
+        self.assertEqual(listing.winner, self.bidder)
+
+    @override_settings(LISTINGS_PER_PAGE=1)
+    def test_ending_soon_ordering(self):
+        Listing.objects.filter(pk=self.open_ended.pk).update(ends_at=timezone.now() + timedelta(days=1))
+        response = self.client.get(reverse("index"), {"sort": "ending"})
+        self.assertEqual(list(response.context["listings"]), [self.running])
+        self.assertContains(response, "?sort=ending&after=")
+        response = self.client.get(reverse("index"), {
+            "sort": "ending", "after": response.context["page"].next_cursor
+        })
+        self.assertEqual(list(response.context["listings"]), [self.open_ended])
+        # Listings past their end time are not ending soon, even before they are closed
+        self.assertFalse(response.context["page"].has_next)
+
+
+class MarketplaceTransferTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "seller@example.com", "password")
+        cls.bidder = User.objects.create_user("bidder", "bidder@example.com", "password")
+        books = Category.objects.create(name="Books")
+        cls.listings = create_listings(cls.seller, 3, category=books)
+        place_bid(cls.listings[0].pk, cls.bidder, Decimal("12"))
+        place_bid(cls.listings[0].pk, cls.bidder, Decimal("15"))
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def export(self, kind, extension):
+        path = os.path.join(self.directory.name, f"{kind}.{extension}")
+        call_command("export_marketplace", kind, output=path, stderr=StringIO())
+        return path
+
+    def round_trip(self, extension):
+        paths = [self.export(kind, extension) for kind in ("users", "listings", "bids")]
+        times = list(Listing.objects.order_by("pk").values_list("time", flat=True))
+        Listing.objects.all().delete()
+        Category.objects.all().delete()
+        # Deleting users through the ORM trips over on_delete=SET("deleted")
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM auctions_user")
+        for kind, path in zip(("users", "listings", "bids"), paths):
+            call_command("import_marketplace", kind, path, batch_size=2, stdout=StringIO())
+        self.assertTrue(User.objects.get(username="bidder").check_password("password"))
+        self.assertEqual(list(Listing.objects.order_by("pk").values_list("time", flat=True)), times)
+        listing = Listing.objects.get(pk=self.listings[0].pk)
+        self.assertEqual(listing.category.name, "Books")
+        self.assertEqual(listing.current_price, Decimal("15"))
+        self.assertEqual(listing.bid_count, 2)
+        self.assertEqual(listing.currentBid.bidder.username, "bidder")
+
+    def test_round_trip_csv(self):
+        self.round_trip("csv")
+
+    def test_round_trip_jsonl(self):
+        self.round_trip("jsonl")
+
+    def test_resume_and_idempotency(self):
+        path = self.export("bids", "jsonl")
+        Bid.objects.all().delete()
+        # Pretend the first bid was committed by an interrupted run
+        with open(f"{path}.progress", "w") as f:
+            f.write("1")
+        out = StringIO()
+        call_command("import_marketplace", "bids", path, resume=True, stdout=out)
+        self.assertIn("Imported 1 bids", out.getvalue())
+        self.assertEqual(Bid.objects.count(), 1)
+        self.assertFalse(os.path.exists(f"{path}.progress"))
+        # Re-importing leaves existing rows alone
+        call_command("import_marketplace", "bids", path, stdout=StringIO())
+        self.assertEqual(Bid.objects.count(), 2)
+        self.assertEqual(Listing.objects.get(pk=self.listings[0].pk).bid_count, 2)
+
+    def test_unknown_references_are_skipped(self):
+        path = os.path.join(self.directory.name, "bids.jsonl")
+        with open(path, "w") as f:
+            f.write(json.dumps({"listing": self.listings[1].pk, "bidder": "nobody", "bid": "20"}) + "\n")
+            f.write(json.dumps({"listing": 0, "bidder": "bidder", "bid": "20"}) + "\n")
+        out = StringIO()
+        call_command("import_marketplace", "bids", path, stdout=out)
+        self.assertIn("Imported 0 bids, skipped 2.", out.getvalue())
+
+    def test_blank_active_defaults_to_true(self):
+        path = os.path.join(self.directory.name, "listings.csv")
+        with open(path, "w") as f:
+            f.write("owner,title,starting_price,active\n")
+            f.write("seller,Blank,5,\n")
+            f.write("seller,Closed,5,false\n")
+        call_command("import_marketplace", "listings", path, stdout=StringIO())
+        self.assertTrue(Listing.objects.get(title="Blank").active)
+        self.assertFalse(Listing.objects.get(title="Closed").active)
+        self.assertTrue(marketplace.parse_bool("", True))
+
+
+class BenchmarkTests(TestCase):
+
+    def test_seed(self):
+        scale = {"users": 5, "categories": 2, "listings": 20, "bids": 50, "comments": 10, "watchlist": 3}
+        benchmark.seed(scale)
+        self.assertEqual(Listing.objects.count(), 20)
+        self.assertEqual(Comment.objects.count(), 10)
+        # Denormalized listing data matches the seeded rows
+        self.assertEqual(sum(Listing.objects.values_list("bid_count", flat=True)), 50)
+        self.assertEqual(sum(Listing.objects.values_list("watcher_count", flat=True)), 15)
+
+    def test_compare(self):
+        baseline = {"index": {"p95_ms": 10, "queries": 1}, "gone": {"p95_ms": 1, "queries": 1}}
+        self.assertEqual(benchmark.compare({"index": {"p95_ms": 12, "queries": 1}}, baseline), [])
+        regressions = benchmark.compare({"index": {"p95_ms": 13, "queries": 2}}, baseline)
+        self.assertEqual(len(regressions), 2)
+        # Faster because the view is no longer reached
+        regressions = benchmark.compare({"index": {"p95_ms": 1, "queries": 0, "status": 302}}, {
+            "index": {"p95_ms": 10, "queries": 1, "status": 200}
+        })
+        self.assertEqual(len(regressions), 2)
+
+    def test_run(self):
+        scale = {"users": 5, "categories": 2, "listings": 30, "bids": 50, "comments": 10, "watchlist": 3}
+        benchmark.seed(scale)
+        results = benchmark.run(requests=12, warmup=0)
+        # Repeated POSTs are not throttled
+        for name in ("bid_post", "comment_post"):
+            self.assertEqual(results[name]["status"], 200)
+            self.assertGreater(results[name]["queries"], 0)
+
+    def test_run_fails_on_errors(self):
+        User.objects.create_user("user", "user@example.com", "password")
+        scenarios = [("missing", "get", "/no-such-page", None, False)]
+        with mock.patch.object(benchmark, "scenarios", return_value=scenarios):
+            with self.assertRaisesMessage(benchmark.BenchmarkError, "missing: GET /no-such-page answered 404"):
+                benchmark.run(requests=1, warmup=0)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(values, 0.5), 50)
+        self.assertEqual(benchmark.percentile(values, 0.99), 99)
+        self.assertEqual(benchmark.percentile([7], 0.95), 7)
+
+    def test_summarize(self):
+        summary = benchmark.summarize([float(ms) for ms in range(100, 0, -1)], errors=1, seconds=2)
+        self.assertEqual(summary["requests"], 100)
+        self.assertEqual(summary["per_second"], 50)
+        self.assertEqual((summary["p50_ms"], summary["p99_ms"], summary["max_ms"]), (50, 99, 100))
+        self.assertEqual(summary["errors"], 1)
+        self.assertIsNone(benchmark.summarize([], errors=0, seconds=1)["p95_ms"])
+
+
+@override_settings(PROFILING_SAMPLE_RATE=1)
+class ProfilingMiddlewareTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("owner", "owner@example.com", "password")
+        create_listings(self.user, 3)
+
+    def timings(self, response):
+        timings = {}
+        for metric in response["Server-Timing"].split(", "):
+            name, *params = metric.split(";")
+            timings[name] = dict(param.split("=", 1) for param in params)
+        return timings
+
+    @override_settings(PROFILING_SERVER_TIMING=True)
+    def test_server_timing_header(self):
+        response = self.client.get(reverse("index"))
+        timings = self.timings(response)
+        self.assertEqual(set(timings), {"db", "tpl", "view", "total"})
+        self.assertEqual(timings["db"]["desc"], '"1 queries"')
+        self.assertGreater(float(timings["tpl"]["dur"]), 0)
+
+    @override_settings(SLOW_REQUEST_THRESHOLD_MS=0, SLOW_REQUEST_QUERIES=2)
+    def test_slow_request_logged(self):
+        with self.assertLogs("auctions.profiling", "WARNING") as logs:
+            self.client.get(reverse("index"), {"sort": "ending"})
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["path"], "/?sort=ending")
+        self.assertEqual(record["status"], 200)
+        self.assertEqual(record["queries"], 1)
+        self.assertEqual(len(record["worst_queries"]), 1)
+        self.assertIn("auctions_listing", record["worst_queries"][0]["sql"])
+
+    def test_server_timing_only_for_staff(self):
+        self.assertNotIn("Server-Timing", self.client.get(reverse("index")))
+        self.client.force_login(self.user)
+        self.assertNotIn("Server-Timing", self.client.get(reverse("index")))
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        cache.clear()
+        self.assertIn("Server-Timing", self.client.get(reverse("index")))
+
+    @override_settings(PROFILING_SAMPLE_RATE=0, PROFILING_SERVER_TIMING=True)
+    def test_unsampled_request(self):
+        response = self.client.get(reverse("index"))
+        self.assertNotIn("Server-Timing", response)
+
+
+class SQLiteTuningTests(TransactionTestCase):
+
+    def pragmas(self, *names):
+        with tempfile.TemporaryDirectory() as directory:
+            db = DatabaseWrapper({**connection.settings_dict, "NAME": os.path.join(directory, "db.sqlite3")})
+            try:
+                with db.cursor() as cursor:
+                    values = []
+                    for name in names:
+                        cursor.execute(f"PRAGMA {name}")
+                        values.append(cursor.fetchone()[0])
+                    return values
+            finally:
+                db.close()
+
+    def test_pragmas_applied_to_new_connections(self):
+        # Without the servers' WAL, as for manage.py commands
+        self.assertEqual(self.pragmas("journal_mode", "busy_timeout"), ["delete", 20000])
+        wal = {"journal_mode": "wal", "synchronous": "normal", **settings.SQLITE_PRAGMAS}
+        with self.settings(SQLITE_PRAGMAS=wal):
+            self.assertEqual(self.pragmas("journal_mode", "synchronous", "busy_timeout"), ["wal", 1, 20000])
+
+    def test_immediate_atomic(self):
+        with CaptureQueriesContext(connection) as queries:
+            with immediate_atomic():
+                self.assertTrue(connection.in_atomic_block)
+                # Nested blocks use savepoints
+                with immediate_atomic():
+                    Category.objects.create(name="Lamps")
+        statements = [query["sql"] for query in queries]
+        self.assertEqual(statements.count("BEGIN IMMEDIATE"), 1)
+        self.assertFalse(connection.in_atomic_block)
+        self.assertNotIn("_start_transaction_under_autocommit", connection.__dict__)
+        self.assertTrue(Category.objects.filter(name="Lamps").exists())
+
+    def test_immediate_atomic_rolls_back(self):
+        with self.assertRaises(ValueError):
+            with immediate_atomic():
+                Category.objects.create(name="Lamps")
+                raise ValueError
+        self.assertFalse(Category.objects.exists())
+
+
+
+class ConcurrentBidTests(TransactionTestCase):
+    """
+    Races bids from many threads, each with its own connection,
+    through the compare-and-swap in 'place_bid'
+    """
+    bidders = 8
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Writers on the shared in-memory test database fail with "table is
+        # locked" instead of waiting, so race on a file like in production.
+        # New threads connect with the handler's settings, this one gets a
+        # connection of its own, as in-memory connections are never closed.
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.memory_settings, cls.memory_connection = connections.settings["default"], connections["default"]
+        connections.settings["default"] = {
+            **cls.memory_settings, "NAME": os.path.join(cls.directory.name, "bids.sqlite3")
+        }
+        connections["default"] = connections.create_connection("default")
+        call_command("migrate", verbosity=0, interactive=False)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections["default"].close()
+        connections.settings["default"] = cls.memory_settings
+        connections["default"] = cls.memory_connection
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        seller = User.objects.create_user("seller", "seller@example.com", "password")
+        self.listing = Listing.objects.create(
+            owner=seller, title="Lamp", description="Old lamp", startingPrice=10
+        )
+        self.users = [
+            User.objects.create_user(f"bidder{n}", f"bidder{n}@example.com", "password")
+            for n in range(self.bidders)
+        ]
+
+    def race(self, amounts):
+        """
+        Places one bid per user and amount at once, returns the results
+        """
+        barrier = threading.Barrier(len(amounts))
+        results = []
+
+        def bid(user, amount):
+            try:
+                barrier.wait()
+                results.append(place_bid(self.listing.pk, user, amount))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=bid, args=args) for args in zip(self.users, amounts)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), len(amounts))
+        return results
+
+    def test_same_amount_has_one_winner(self):
+        results = self.race([Decimal("15")] * self.bidders)
+        accepted = [result for result in results if result.status == BidStatus.ACCEPTED]
+        self.assertEqual(len(accepted), 1)
+        self.assertTrue(all(result.status == BidStatus.OUTBID for result in results if result not in accepted))
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.bid_count, 1)
+        self.assertEqual(self.listing.current_price, Decimal("15"))
+        self.assertEqual(self.listing.currentBid, accepted[0].bid)
+
+    def test_highest_bid_wins(self):
+        amounts = [Decimal(11 + n) for n in range(self.bidders)]
+        results = self.race(amounts)
+        accepted = [result.bid for result in results if result.status == BidStatus.ACCEPTED]
+        self.listing.refresh_from_db()
+        # Only accepted bids are stored and counted
+        self.assertEqual(self.listing.bid_count, len(accepted))
+        self.assertEqual(Bid.objects.filter(listing=self.listing).count(), len(accepted))
+        self.assertEqual(self.listing.current_price, max(amounts))
+        Listing.objects.filter(pk=self.listing.pk).close()
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.winner, self.users[amounts.index(max(amounts))])
+
+
+@override_settings(DATABASE_REPLICAS=["replica"], REPLICA_PIN_SECONDS=60)
+class ReplicaRoutingTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("owner", "owner@example.com", "password")
+        self.bidder = User.objects.create_user("bidder", "bidder@example.com", "password")
+        self.listing = create_listings(self.user, 1)[0]
+        # File-backed replica holding a snapshot of the primary
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "replica.sqlite3")
+        connection.ensure_connection()
+        replica = sqlite3.connect(path)
+        connection.connection.backup(replica)
+        replica.close()
+        connections.settings["replica"] = {**connection.settings_dict, "NAME": path}
+        self.addCleanup(self.remove_replica)
+        # Writes above pinned the test's reads to the primary
+        primary_until.set(0.0)
+
+    def remove_replica(self):
+        connections["replica"].close()
+        del connections["replica"]
+        del connections.settings["replica"]
+
+    def test_reads_use_replica(self):
+        Listing.objects.using("default").filter(pk=self.listing.pk).update(title="Renamed")
+        primary_until.set(0.0)
+        self.assertEqual(Listing.objects.get(pk=self.listing.pk).title, "Item 0")
+        self.assertEqual(Listing.objects.get(pk=self.listing.pk)._state.db, "replica")
+
+    def test_write_pins_reads_to_primary(self):
+        Listing.objects.filter(pk=self.listing.pk).update(title="Renamed")
+        self.assertEqual(Listing.objects.get(pk=self.listing.pk).title, "Renamed")
+
+    def test_transactions_read_primary(self):
+        with transaction.atomic():
+            self.assertEqual(Listing.objects.all().db, "default")
+
+    def test_pin_carried_over_by_cookie(self):
+        self.client.force_login(self.bidder)
+        url = reverse("listings", args=[self.listing.pk])
+        response = self.client.post(url, {"new_bid": "", "bid": "20"})
+        self.assertIn("primary_until", response.cookies)
+        # The next request sees the bid, although the replica doesn't have it
+        response = self.client.get(url)
+        self.assertEqual(response.context["listing"].current_price, Decimal("20"))
+        self.assertFalse(Bid.objects.using("replica").exists())
+
+    def test_replica_read_without_cookie(self):
+        Listing.objects.filter(pk=self.listing.pk).update(title="Renamed")
+        primary_until.set(0.0)
+        response = self.client.get(reverse("listings", args=[self.listing.pk]))
+        self.assertEqual(response.context["listing"].title, "Item 0")
+        self.assertNotIn("primary_until", response.cookies)
+
+
+class CategoryTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("owner", "owner@example.com", "password")
+        self.books = Category.objects.create(name="Old Books")
+        self.lamps = Category.objects.create(name="Lamps")
+        create_listings(self.user, 3, category=self.books)
+        create_listings(self.user, 1, category=self.books, active=False)
+
+    def test_slugs(self):
+        self.assertEqual(self.books.slug, "old-books")
+        self.assertEqual(Category.objects.create(name="Old books!").slug, "old-books-2")
+        self.assertEqual(Category.objects.create(name="???").slug, "category")
+
+    def test_category_page_by_slug(self):
+        response = self.client.get(reverse("category", args=["old-books"]))
+        self.assertEqual(response.context["category"], self.books)
+        self.assertEqual(len(response.context["listings"]), 3)
+        self.assertEqual(self.client.get(reverse("category", args=["unknown"])).status_code, 404)
+
+    def test_old_urls_redirect(self):
+        for name, slug in (("Old Books", "old-books"), ("Lamps", "lamps")):
+            response = self.client.get(f"/categories/{name}")
+            self.assertRedirects(response, reverse("category", args=[slug]), status_code=301)
+        self.assertEqual(self.client.get("/categories/Unknown Name").status_code, 404)
+
+    def test_counts_cached(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("categories"))
+        self.assertEqual(
+            [(c["name"], c["listing_count"]) for c in response.context["categories"]],
+            [("Lamps", 0), ("Old Books", 3)]
+        )
+        self.assertContains(response, reverse("category", args=["old-books"]))
+        with self.assertNumQueries(0):
+            self.client.get(reverse("categories"))
+
+    def test_counts_invalidated(self):
+        self.client.get(reverse("categories"))
+        with self.captureOnCommitCallbacks(execute=True):
+            create_listings(self.user, 1, category=self.lamps)
+        counts = {c["name"]: c["listing_count"] for c in self.client.get(reverse("categories")).context["categories"]}
+        self.assertEqual(counts["Lamps"], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Listing.objects.filter(category=self.books).update(ends_at=timezone.now())
+            close_due_listings()
+        counts = {c["name"]: c["listing_count"] for c in self.client.get(reverse("categories")).context["categories"]}
+        self.assertEqual(counts["Old Books"], 0)
+
+
+try:
+    import PIL.Image
+except ImportError:
+    PIL = None
+
+
+class ListingImageTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = self.settings(MEDIA_ROOT=directory.name, THUMBNAIL_WORKERS=0)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.user = User.objects.create_user("owner", "owner@example.com", "password")
+
+    def thumbnails(self):
+        return {
+            "card": [
+                {"name": "listings/thumbnails/a.webp", "width": 240, "height": 180},
+                {"name": "listings/thumbnails/b.webp", "width": 480, "height": 360},
+            ],
+            "detail": [{"name": "listings/thumbnails/c.webp", "width": 600, "height": 450}],
+        }
+
+    def test_card_uses_srcset(self):
+        create_listings(self.user, 1, thumbnails=self.thumbnails())
+        response = self.client.get(reverse("index"))
+        self.assertContains(
+            response, 'srcset="/media/listings/thumbnails/a.webp 240w, /media/listings/thumbnails/b.webp 480w"'
+        )
+        self.assertContains(response, 'loading="lazy"')
+        self.assertContains(response, 'width="240" height="180"')
+
+    def test_detail_variant(self):
+        listing = create_listings(self.user, 1, thumbnails=self.thumbnails())[0]
+        response = self.client.get(reverse("listings", args=[listing.pk]))
+        self.assertContains(response, 'src="/media/listings/thumbnails/c.webp"')
+
+    def test_hot_linked_image_is_lazy(self):
+        create_listings(self.user, 1, imageURL="https://example.com/lamp.jpg")
+        self.assertContains(
+            self.client.get(reverse("index")), 'src="https://example.com/lamp.jpg" loading="lazy"'
+        )
+
+    def upload(self, data, name="lamp.png", process=False):
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=process):
+            self.client.post(reverse("new_listing"), {
+                "title": "Lamp", "description": "Old lamp", "startingPrice": "10",
+                "image": SimpleUploadedFile(name, data, content_type="image/png")
+            })
+        return Listing.objects.get(title="Lamp")
+
+    def png(self, size=(1000, 500)):
+        output = BytesIO()
+        PIL.Image.new("RGB", size, "red").save(output, "PNG")
+        return output.getvalue()
+
+    @skipUnless(PIL, "requires Pillow")
+    def test_upload_named_after_content(self):
+        data = self.png()
+        listing = self.upload(data)
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        self.assertEqual(listing.image.name, f"listings/originals/{digest}.png")
+
+    @skipUnless(PIL, "requires Pillow")
+    def test_same_upload_stored_once(self):
+        data = self.png()
+        first = self.upload(data)
+        first.title = "First lamp"
+        first.save()
+        second = self.upload(data, name="LAMP.PNG")
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertEqual(os.listdir(os.path.join(settings.MEDIA_ROOT, "listings/originals")), [
+            os.path.basename(first.image.name)
+        ])
+
+    @skipUnless(PIL, "requires Pillow")
+    def test_upload_rejects_files_named_like_images(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse("new_listing"), {
+            "title": "Lamp", "description": "Old lamp", "startingPrice": "10",
+            "image": SimpleUploadedFile("lamp.png", b"not really an image", content_type="image/png")
+        })
+        self.assertContains(response, "Your submission was invalid")
+        self.assertFalse(Listing.objects.exists())
+
+    def test_upload_rejects_other_files(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse("new_listing"), {
+            "title": "Lamp", "description": "Old lamp", "startingPrice": "10",
+            "image": SimpleUploadedFile("lamp.exe", b"MZ")
+        })
+        self.assertContains(response, "Your submission was invalid")
+        self.assertFalse(Listing.objects.exists())
+
+    @skipUnless(PIL, "requires Pillow")
+    def test_thumbnails_created(self):
+        listing = self.upload(self.png(), process=True)
+        widths = {name: [image["width"] for image in images] for name, images in listing.thumbnails.items()}
+        self.assertEqual(widths, {"card": [240, 480], "detail": [720, 1000]})
+        self.assertEqual(listing.thumbnails["card"][0]["height"], 120)
+        self.assertTrue(listing.thumbnails["card"][0]["name"].endswith(".webp"))
+
+    @skipUnless(PIL, "requires Pillow")
+    def test_thumbnails_purge_cached_pages(self):
+        listing = self.upload(self.png())
+        self.client.logout()
+        url = reverse("listings", args=[listing.pk])
+        self.assertNotContains(self.client.get(url), "listings/thumbnails/")
+        with self.captureOnCommitCallbacks(execute=True):
+            images.create_thumbnails(listing.pk)
+        self.assertContains(self.client.get(url), "listings/thumbnails/")
+
+    def test_fetch_only_public_urls(self):
+        for url in (
+            "file:///etc/passwd",
+            "ftp://example.com/lamp.jpg",
+            "http://localhost/lamp.jpg",
+            "http://127.0.0.1:8000/lamp.jpg",
+            "http://10.0.0.1/lamp.jpg",
+            "http://169.254.169.254/latest/meta-data/",
+            "http://[::1]/lamp.jpg",
+            "http://[::ffff:192.168.0.1]/lamp.jpg",
+        ):
+            with self.subTest(url=url), self.assertRaises(ValueError):
+                images.fetch_image(url)
+
+    def test_redirects_only_to_public_urls(self):
+        handler = images.PublicRedirectHandler()
+        request = urllib.request.Request("http://93.184.216.34/lamp.jpg")
+        with self.assertRaises(ValueError):
+            handler.redirect_request(request, None, 302, "Found", {}, "http://127.0.0.1/lamp.jpg")
+
+
+class StaticAssetTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        static_root = self.settings(STATIC_ROOT=self.root)
+        static_root.enable()
+        self.addCleanup(static_root.disable)
+        os.makedirs(os.path.join(self.root, "auctions"))
+        self.css = os.path.join(self.root, "auctions", "styles.0123456789ab.css")
+        with open(self.css, "w") as f:
+            f.write("body { margin: 0; }\n" * 100)
+        self.factory = RequestFactory()
+
+    def get(self, path, accept_encoding=""):
+        request = self.factory.get(f"/static/{path}", HTTP_ACCEPT_ENCODING=accept_encoding)
+        return assets.serve(request, path)
+
+    def test_write_compressed(self):
+        written = assets.write_compressed(self.css)
+        self.assertIn(self.css + ".gz", written)
+        with open(self.css + ".gz", "rb") as f:
+            self.assertEqual(gzip.decompress(f.read()), b"body { margin: 0; }\n" * 100)
+        # Images are not compressed again
+        self.assertEqual(assets.write_compressed(os.path.join(self.root, "lamp.jpg")), [])
+
+    def test_serves_precompressed_variant(self):
+        assets.write_compressed(self.css)
+        response = self.get("auctions/styles.0123456789ab.css", "deflate, gzip;q=0.8")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Content-Type"], "text/css")
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+        self.assertEqual(gzip.decompress(b"".join(response.streaming_content))[:5], b"body ")
+
+    def test_serves_identity_without_accept_encoding(self):
+        assets.write_compressed(self.css)
+        response = self.get("auctions/styles.0123456789ab.css", "gzip;q=0")
+        self.assertNotIn("Content-Encoding", response)
+
+    def test_unhashed_files_are_revalidated(self):
+        with open(os.path.join(self.root, "auctions", "styles.css"), "w") as f:
+            f.write("body {}")
+        self.assertEqual(self.get("auctions/styles.css")["Cache-Control"], "no-cache")
+
+    def test_missing_files(self):
+        assets.write_compressed(self.css)
+        for path in ("auctions/missing.css", "auctions/styles.0123456789ab.css.gz", "../secret.txt"):
+            with self.assertRaises(Http404):
+                self.get(path)
+
+    def test_sass_recompiles_after_partial_changes(self):
+        entry = os.path.join(self.root, "auctions", "site.scss")
+        partial = os.path.join(self.root, "auctions", "parts", "_colors.scss")
+        os.makedirs(os.path.dirname(partial))
+        with open(entry, "w") as f:
+            f.write("@import 'parts/colors';\nbody { color: $ink; }\n")
+        with open(partial, "w") as f:
+            f.write("$ink: #111111;\n")
+        self.assertEqual(assets.sass_sources(entry), {entry, partial})
+        compile_css = lambda: assets.CachedSassCompiler(None, filename=entry).input()
+        self.assertIn("#111111", compile_css())
+        with open(partial, "w") as f:
+            f.write("$ink: #222222;\n")
+        # Bump the mtime in case the edit lands within the same tick
+        stat = os.stat(partial)
+        os.utime(partial, (stat.st_atime, stat.st_mtime + 10))
+        self.assertIn("#222222", compile_css())
+
+
+class CachedAuthTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("bidder", "bidder@example.com", "password")
+        self.client.login(username="bidder", password="password")
+        # Warm up the session and user cache
+        self.client.get(reverse("index"))
+
+    def test_no_session_or_user_queries(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("index"))
+        self.assertEqual(response.context["user"], self.user)
+
+    def test_profile_change_invalidates(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = "Alice"
+            self.user.save()
+        self.assertEqual(self.client.get(reverse("index")).context["user"].first_name, "Alice")
+
+    def test_password_change_logs_out(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password("changed")
+            self.user.save()
+        self.assertFalse(self.client.get(reverse("index")).context["user"].is_authenticated)
+
+    def test_watchlist_change_invalidates(self):
+        listing = create_listings(self.user, 1)[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.watchlist.add(listing)
+        self.assertIsNone(cache.get(auth.user_cache_key(self.user.pk)))
+
+    def test_logout_invalidates(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse("logout"))
+        self.assertIsNone(cache.get(auth.user_cache_key(self.user.pk)))
+        self.assertFalse(self.client.get(reverse("index")).context["user"].is_authenticated)
+
+    def test_bulk_update_invalidates(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.filter(pk=self.user.pk).update(first_name="Alice")
+        self.assertEqual(self.client.get(reverse("index")).context["user"].first_name, "Alice")
+
+    def test_failed_login_checks_password_once(self):
+        self.assertEqual(
+            self.client.session["_auth_user_backend"], "auctions.auth.CachedModelBackend"
+        )
+        with mock.patch("django.contrib.auth.base_user.check_password", return_value=False) as check:
+            self.assertFalse(self.client.login(username="bidder", password="wrong"))
+        self.assertEqual(check.call_count, 1)
+        # Unknown users cost one hash as well, against timing attacks
+        with mock.patch("django.contrib.auth.base_user.make_password") as make:
+            self.assertFalse(self.client.login(username="nobody", password="wrong"))
+        self.assertEqual(make.call_count, 1)
+
+
+@override_settings(COMMENTS_PER_PAGE=5)
+class CommentPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("owner", "owner@example.com", "password")
+        cls.listing = create_listings(cls.user, 1)[0]
+        now = timezone.now()
+        for i in range(12):
+            commenter = User.objects.create_user(f"commenter{i}", f"c{i}@example.com", "password")
+            comment = Comment.objects.create(commenter=commenter, listing=cls.listing, content=f"Comment {i}")
+            Comment.objects.filter(pk=comment.pk).update(time=now - timedelta(minutes=i))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_first_page_inline(self):
+        # Listing and comments with their commenters
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("listings", args=[self.listing.pk]))
+        self.assertEqual([c.content for c in response.context["comments"]], [f"Comment {i}" for i in range(5)])
+        self.assertContains(response, "commenter4")
+        self.assertNotContains(response, "commenter5")
+        self.assertContains(response, "Load more comments")
+
+    def test_load_more_fragment(self):
+        page = self.client.get(reverse("listings", args=[self.listing.pk])).context["comments"]
+        url = reverse("listing_comments", args=[self.listing.pk])
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {"after": page.next_cursor})
+        self.assertTemplateUsed(response, "auctions/comments.html")
+        self.assertTemplateNotUsed(response, "auctions/layout.html")
+        self.assertContains(response, "Comment 5")
+        self.assertNotContains(response, "Comment 4")
+        self.assertContains(response, "Load more comments")
+
+    def test_load_more_json(self):
+        url = reverse("listing_comments", args=[self.listing.pk])
+        data = self.client.get(url, {"format": "json"}).json()
+        self.assertEqual(data["results"][0]["commenter_username"], "commenter0")
+        data = self.client.get(url, {"format": "json", "after": data["next"]}).json()
+        data = self.client.get(url, {"format": "json", "after": data["next"]}).json()
+        self.assertEqual([c["content"] for c in data["results"]], ["Comment 10", "Comment 11"])
+        self.assertIsNone(data["next"])
+
+
+@override_settings(BIDS_PER_PAGE=5)
+class BidHistoryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("owner", "owner@example.com", "password")
+        cls.listing = create_listings(cls.user, 1)[0]
+        cls.bidders = [User.objects.create_user(f"bidder{i}", f"b{i}@example.com", "password") for i in range(3)]
+        # Bids of 10.00, 11.50, ... 26.50, taking turns between the bidders
+        for i in range(12):
+            Bid.objects.create(bidder=cls.bidders[i % 3], listing=cls.listing, bid=Decimal("10.00") + Decimal("1.50") * i)
+
+    def setUp(self):
+        cache.clear()
+
+    def walk(self):
+        bids, after = [], None
+        while True:
+            page = bid_history(self.listing.pk, after)
+            bids.extend(page)
+            if not page.has_next:
+                return bids
+            after = page.next_cursor
+
+    def test_cursor_on_decimal_field(self):
+        bid = Bid.objects.first()
+        self.assertEqual(decode_cursor(encode_cursor(bid, "bid"), parse=Decimal), (bid.bid, bid.pk))
+        self.assertIsNone(decode_cursor(encode_cursor({"bid": "NaN", "id": 1}, "bid"), parse=Decimal))
+        self.assertIsNone(decode_cursor(encode_cursor({"bid": "ten", "id": 1}, "bid"), parse=Decimal))
+
+    def test_pages_cover_all_bids(self):
+        bids = self.walk()
+        self.assertEqual([b.bid for b in bids], [Decimal("10.00") + Decimal("1.50") * i for i in range(11, -1, -1)])
+        # Increments on the last row of a page are taken over the next page's first bid
+        self.assertEqual([b.increment for b in bids[:-1]], [Decimal("1.50")] * 11)
+        self.assertIsNone(bids[-1].increment)
+
+    def test_bidder_maximum(self):
+        maxima = {"bidder0": Decimal("23.50"), "bidder1": Decimal("25.00"), "bidder2": Decimal("26.50")}
+        for bid in self.walk():
+            self.assertEqual(bid.bidder_max, maxima[bid.bidder.username])
+
+    def test_page_is_one_query(self):
+        after = bid_history(self.listing.pk).next_cursor
+        with self.assertNumQueries(1):
+            page = bid_history(self.listing.pk, after)
+            [bid.bidder.username for bid in page]
+
+    def test_page_uses_index(self):
+        window = Bid.objects.filter(listing_id=self.listing.pk).order_by("-bid", "-pk").values("pk")[:6]
+        self.assertIn("bid_listing_bid_idx", window.explain())
+
+    def test_first_page_inline(self):
+        # Listing, comments and bids
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("listings", args=[self.listing.pk]))
+        self.assertTemplateUsed(response, "auctions/bid_history.html")
+        self.assertEqual(len(response.context["bids"]), 5)
+        self.assertContains(response, "$26.50")
+        self.assertNotContains(response, "$19.00")
+        self.assertContains(response, "Older bids")
+
+    def test_history_page(self):
+        url = reverse("listing_bids", args=[self.listing.pk])
+        page = self.client.get(url).context["bids"]
+        response = self.client.get(url, {"after": page.next_cursor})
+        self.assertContains(response, "$19.00")
+        self.assertNotContains(response, "$20.50")
+        self.assertContains(response, "Highest bids")
+        self.assertEqual(self.client.get(reverse("listing_bids", args=[0])).status_code, 404)
+
+    def test_json(self):
+        url = reverse("listing_bids", args=[self.listing.pk])
+        data = self.client.get(url, {"format": "json"}).json()
+        self.assertEqual(data["results"][0]["bidder_username"], "bidder2")
+        self.assertEqual(data["results"][0]["increment"], "1.50")
+        data = self.client.get(url, {"format": "json", "after": data["next"]}).json()
+        data = self.client.get(url, {"format": "json", "after": data["next"]}).json()
+        self.assertEqual([b["bid"] for b in data["results"]], ["11.50", "10.00"])
+        self.assertIsNone(data["results"][-1]["increment"])
+        self.assertIsNone(data["next"])
+
+    def test_amounts_are_exact(self):
+        listing = create_listings(self.user, 1)[0]
+        for amount in ("10.10", "10.30"):
+            Bid.objects.create(bidder=self.bidders[0], listing=listing, bid=Decimal(amount))
+        bid = list(bid_history(listing.pk))[0]
+        self.assertEqual(str(bid.increment), "0.20")
+        self.assertEqual(str(bid.bidder_max), "10.30")
+
+
+@override_settings(DASHBOARD_SECTION_SIZE=2, LISTINGS_PER_PAGE=2)
+class DashboardTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "seller@example.com", "password")
+        cls.alice = User.objects.create_user("alice", "alice@example.com", "password")
+        cls.bob = User.objects.create_user("bob", "bob@example.com", "password")
+        cls.listings = create_listings(cls.seller, 6)
+        create_listings(cls.alice, 3)
+        # Alice leads on 0, 1 and 2, is outbid on 3 and wins 4
+        for listing in cls.listings[:5]:
+            place_bid(listing.pk, cls.alice, Decimal(20))
+        place_bid(cls.listings[3].pk, cls.bob, Decimal(30))
+        Listing.objects.filter(pk=cls.listings[4].pk).close()
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.alice)
+
+    def test_counts(self):
+        self.assertEqual(dashboard.dashboard_counts(self.alice), {"listings": 3, "leading": 3, "outbid": 1, "won": 1})
+        self.assertEqual(dashboard.dashboard_counts(self.seller), {"listings": 6, "leading": 0, "outbid": 0, "won": 0})
+
+    def test_sections(self):
+        leading = dashboard.section(self.alice, "leading").order_by("-time")
+        self.assertEqual(list(leading), self.listings[:3])
+        outbid = dashboard.section(self.alice, "outbid").get()
+        self.assertEqual((outbid.my_bid, outbid.current_price), (Decimal(20), Decimal(30)))
+        self.assertEqual(outbid.currentBid.bidder.username, "bob")
+        self.assertEqual(dashboard.section(self.alice, "won").get(), self.listings[4])
+
+    def test_constant_queries(self):
+        url = reverse("dashboard")
+        self.client.get(url)
+        # One query per section, the counters are cached
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertContains(response, "All 3")
+        self.assertEqual(response.context["sections"][2]["count"], 1)
+        for listing in create_listings(self.seller, 10):
+            place_bid(listing.pk, self.alice, Decimal(20))
+        cache.delete(dashboard.DASHBOARD_COUNTS_KEY.format(self.alice.pk))
+        self.client.get(url)
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(response.context["sections"][1]["count"], 13)
+
+    def test_outbid_invalidates_counts(self):
+        self.assertEqual(dashboard.dashboard_counts(self.alice)["outbid"], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            place_bid(self.listings[0].pk, self.bob, Decimal(30))
+        self.assertEqual(dashboard.dashboard_counts(self.alice)["outbid"], 2)
+        Listing.objects.filter(pk=self.listings[1].pk).update(ends_at=timezone.now())
+        with self.captureOnCommitCallbacks(execute=True):
+            close_due_listings()
+        counts = dashboard.dashboard_counts(self.alice)
+        self.assertEqual((counts["leading"], counts["won"]), (1, 2))
+
+    def test_section_pages(self):
+        url = reverse("dashboard_section", args=["leading"])
+        page = self.client.get(url).context["page"]
+        self.assertEqual(list(page), self.listings[:2])
+        response = self.client.get(url, {"after": page.next_cursor})
+        self.assertEqual(list(response.context["page"]), self.listings[2:3])
+        self.assertEqual(self.client.get(reverse("dashboard_section", args=["nope"])).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse("dashboard")).status_code, 302)
+
+
+def hit_throttle_limit(requests):
+    """
+    Sends requests against a limit of 20 per hour from a worker process
+    and returns how many were allowed
+    """
+    limits = [("throttle:test", 20, 3600)]
+    return sum(throttling.hit(limits, now=100) == 0 for _ in range(requests))
+
+
+@override_settings(THROTTLE_RATES={
+    "new_bid": {"user": "2/min", "ip": "3/min"},
+    "watchlist": {"user": "1/min"},
+})
+class ThrottlingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "seller@example.com", "password")
+        cls.alice = User.objects.create_user("alice", "alice@example.com", "password")
+        cls.bob = User.objects.create_user("bob", "bob@example.com", "password")
+        cls.listing = create_listings(cls.seller, 1)[0]
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse("listings", args=[self.listing.pk])
+
+    def test_sliding_window(self):
+        limits = [("throttle:test", 4, 60)]
+        # 40 seconds into a window
+        for _ in range(4):
+            self.assertEqual(throttling.hit(limits, now=100), 0)
+        self.assertEqual(throttling.hit(limits, now=100), 35)
+        # The previous window's 4 requests still weigh 46/60 after 14 seconds, 45/60 after 15
+        self.assertGreater(throttling.hit(limits, now=134), 0)
+        self.assertEqual(throttling.hit(limits, now=135), 0)
+
+    def test_rejected_before_database_work(self):
+        self.client.force_login(self.alice)
+        self.client.get(self.url)
+        for amount in ("20", "21"):
+            self.assertEqual(self.client.post(self.url, {"new_bid": "", "bid": amount}).status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.post(self.url, {"new_bid": "", "bid": "22"})
+        self.assertEqual(response.status_code, 429)
+        # Until the two bids of the current window have decayed to one
+        self.assertTrue(1 <= int(response["Retry-After"]) <= 90)
+        self.assertEqual(Bid.objects.count(), 2)
+        # Other actions are counted separately
+        self.assertEqual(self.client.post(self.url, {"new_comment": "", "comment": "Hi"}).status_code, 200)
+
+    def test_limited_per_ip(self):
+        self.client.force_login(self.alice)
+        for amount in ("20", "21"):
+            self.client.post(self.url, {"new_bid": "", "bid": amount})
+        self.client.force_login(self.bob)
+        self.assertEqual(self.client.post(self.url, {"new_bid": "", "bid": "22"}).status_code, 200)
+        self.assertEqual(self.client.post(self.url, {"new_bid": "", "bid": "23"}).status_code, 429)
+        response = self.client.post(self.url, {"new_bid": "", "bid": "23"}, REMOTE_ADDR="10.0.0.2")
+        self.assertEqual(response.status_code, 200)
+
+    def test_bulk_watchlist(self):
+        self.client.force_login(self.alice)
+        url = reverse("watchlist_add")
+        self.assertEqual(self.client.post(url, {"listings": [self.listing.pk]}).status_code, 200)
+        self.assertEqual(self.client.post(url, {"listings": [self.listing.pk]}).status_code, 429)
+
+    def test_counters_shared_between_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_cache = {"BACKEND": "auctions.throttling.LockingFileBasedCache", "LOCATION": directory}
+            with self.settings(CACHES={"default": settings.CACHES["default"], "throttle": file_cache}, THROTTLE_CACHE="throttle"):
+                # Forked workers inherit the settings, like worker processes of a server
+                with multiprocessing.get_context("fork").Pool(8) as pool:
+                    allowed = pool.map(hit_throttle_limit, [25] * 8)
+                self.assertEqual(sum(allowed), 20)
+                # Rejected requests were taken back out
+                self.assertEqual(caches["throttle"].get("throttle:test:0"), 20)
+
+    def test_concurrent_requests_share_count(self):
+        limits = [("throttle:test", 5, 60)]
+        barrier = threading.Barrier(20)
+        results = []
+        get_many = LocMemCache.get_many
+
+        def read_together(cache, keys, **kwargs):
+            # All requests read the counters before any of them counts
+            values = get_many(cache, keys, **kwargs)
+            barrier.wait(timeout=5)
+            return values
+
+        def request():
+            results.append(throttling.hit(limits, now=100))
+        threads = [threading.Thread(target=request) for _ in range(20)]
+        with mock.patch.object(LocMemCache, "get_many", read_together):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(results.count(0), 5)
+        # Rejected requests are not counted
+        self.assertEqual(cache.get("throttle:test:1"), 5)
+
+    def test_client_ip_header(self):
+        request = RequestFactory().post(
+            self.url, REMOTE_ADDR="10.0.0.1", HTTP_X_FORWARDED_FOR="1.2.3.4, 203.0.113.7"
+        )
+        self.assertEqual(throttling.client_ip(request), "10.0.0.1")
+        with self.settings(THROTTLE_CLIENT_IP_HEADER="HTTP_X_FORWARDED_FOR"):
+            # The first entry is up to the client
+            self.assertEqual(throttling.client_ip(request), "203.0.113.7")
+            del request.META["HTTP_X_FORWARDED_FOR"]
+            self.assertEqual(throttling.client_ip(request), "10.0.0.1")
+
+
+@override_settings(ROOT_URLCONF="commerce.asgi_urls", LISTINGS_PER_PAGE=3, PROFILING_SAMPLE_RATE=1)
+class AsyncViewTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "seller@example.com", "password")
+        cls.bidder = User.objects.create_user("bidder", "bidder@example.com", "password")
+        cls.category = Category.objects.create(name="Lamps")
+        cls.listings = create_listings(cls.seller, 5, category=cls.category)
+        cls.bidder.watchlist.add(*cls.listings[:2])
+        place_bid(cls.listings[0].pk, cls.bidder, Decimal(20))
+        Comment.objects.create(commenter=cls.bidder, listing=cls.listings[0], content="Still available?")
+
+    def setUp(self):
+        cache.clear()
+
+    def test_routes(self):
+        for name, args in (("index", []), ("categories", []), ("category", ["lamps"]),
+                           ("listings", [1]), ("watchlist", ["bidder"])):
+            view = resolve(reverse(name, args=args)).func
+            self.assertTrue(asyncio.iscoroutinefunction(view), name)
+        # Everything else keeps its sync view
+        self.assertFalse(asyncio.iscoroutinefunction(resolve(reverse("search")).func))
+
+    async def test_index(self):
+        response = await self.async_client.get(reverse("index"))
+        self.assertEqual([listing.pk for listing in response.context["listings"]], [l.pk for l in self.listings[:3]])
+        page = response.context["page"]
+        response = await self.async_client.get(reverse("index"), {"after": page.next_cursor})
+        self.assertEqual([listing.pk for listing in response.context["listings"]], [l.pk for l in self.listings[3:]])
+
+    async def test_categories(self):
+        response = await self.async_client.get(reverse("categories"))
+        self.assertEqual(response.context["categories"][0]["listing_count"], 5)
+        response = await self.async_client.get(reverse("category", args=["lamps"]))
+        self.assertEqual(len(response.context["listings"]), 3)
+        response = await self.async_client.get(reverse("category", args=["nope"]))
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.get("/categories/Lamps")
+        self.assertEqual((response.status_code, response["Location"]), (301, reverse("category", args=["lamps"])))
+
+    async def test_listing(self):
+        # Staff gets the Server-Timing header
+        await User.objects.filter(pk=self.bidder.pk).aupdate(is_staff=True)
+        await sync_to_async(self.async_client.force_login)(self.bidder)
+        response = await self.async_client.get(reverse("listings", args=[self.listings[0].pk]))
+        self.assertTrue(response.context["watched"])
+        self.assertEqual([c.content for c in response.context["comments"]], ["Still available?"])
+        self.assertEqual(response.context["bids"].object_list[0].bid, Decimal(20))
+        self.assertContains(response, "$20.00")
+        # Queries run in the sync thread still reach the profiler
+        self.assertIn('desc="5 queries"', response["Server-Timing"])
+
+    async def test_listing_post_uses_sync_view(self):
+        await sync_to_async(self.async_client.force_login)(self.bidder)
+        url = reverse("listings", args=[self.listings[1].pk])
+        response = await self.async_client.post(url, {"new_bid": "", "bid": "25"})
+        self.assertContains(response, "Your bid has been added to the auction.")
+        self.assertEqual(await Bid.objects.filter(listing=self.listings[1]).acount(), 1)
+
+    async def test_watchlist(self):
+        url = reverse("watchlist", args=["bidder"])
+        response = await self.async_client.get(url)
+        # Like the sync view, redirects to settings.LOGIN_URL
+        self.assertRedirects(response, f"{settings.LOGIN_URL}?next={url}", fetch_redirect_response=False)
+        await sync_to_async(self.async_client.force_login)(self.bidder)
+        response = await self.async_client.get(url)
+        self.assertEqual([listing.pk for listing in response.context["listings"]], [l.pk for l in self.listings[:2]])
+
+
+@override_settings(PAGE_CACHE_TIMEOUT=60, PAGE_CACHE_MAX_AGE=0)
+class PageCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user("seller", "seller@example.com", "password")
+        cls.bidder = User.objects.create_user("bidder", "bidder@example.com", "password")
+        cls.category = Category.objects.create(name="Clocks")
+        cls.listings = create_listings(cls.seller, 3, category=cls.category)
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        # Cached pages and users would outlive the rolled back rows
+        cache.clear()
+
+    def assert_cached(self, url, cached=True):
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(len(queries) == 0, cached, url)
+        return response
+
+    def test_anonymous_pages_are_cached(self):
+        for url in (reverse("index"), reverse("categories"), reverse("category", args=["clocks"]),
+                    reverse("listings", args=[self.listings[0].pk])):
+            response = self.assert_cached(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("ETag", response)
+            self.assertIn("public", response["Cache-Control"])
+            self.assertIn("max-age=0", response["Cache-Control"])
+            self.assertIn("Cookie", response["Vary"])
+        # Query strings are part of the key
+        self.client.get(reverse("index"), {"sort": "ending"})
+        self.assertEqual(pagecache.page_cache_stats()["hits"], 4)
+        self.assertEqual(pagecache.page_cache_stats()["misses"], 5)
+
+    def test_conditional_get(self):
+        etag = self.client.get(reverse("index"))["ETag"]
+        response = self.client.get(reverse("index"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+    def test_logged_in_users_bypass_cache(self):
+        self.client.force_login(self.bidder)
+        url = reverse("listings", args=[self.listings[0].pk])
+        response = self.assert_cached(url, cached=False)
+        self.assertNotIn("ETag", response)
+        self.assertContains(response, "Place Bid")
+        self.client.logout()
+        self.assertNotContains(self.assert_cached(url), "Place Bid")
+
+    def test_errors_are_not_cached(self):
+        response = self.assert_cached(reverse("category", args=["nope"]), cached=False)
+        self.assertEqual(response.status_code, 404)
+
+    def test_bid_purges_listing_and_lists(self):
+        listing_url = reverse("listings", args=[self.listings[0].pk])
+        other_url = reverse("listings", args=[self.listings[1].pk])
+        for url in (listing_url, other_url, reverse("index")):
+            self.assert_cached(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            place_bid(self.listings[0].pk, self.bidder, Decimal(42))
+        self.assertContains(self.client.get(listing_url), "$42.00")
+        self.assertContains(self.client.get(reverse("index")), "$42.00")
+        self.assert_cached(other_url)
+        self.assertEqual(pagecache.page_cache_stats()["purges"], {"listing": 1, "lists": 1, "all": 0})
+
+    def test_comment_purges_only_listing(self):
+        url = reverse("listings", args=[self.listings[0].pk])
+        self.assert_cached(url)
+        self.assert_cached(reverse("index"))
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(commenter=self.bidder, listing=self.listings[0], content="Does it chime?")
+        self.assertContains(self.client.get(url), "Does it chime?")
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("index"))
+        self.assertEqual(len(queries), 0)
+
+    def test_category_change_purges_all(self):
+        self.assert_cached(reverse("categories"))
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.filter(pk=self.category.pk).update(name="Watches")
+            Category.objects.get(pk=self.category.pk).save()
+        self.assertContains(self.client.get(reverse("categories")), "Watches")
+
+    def test_purge_waits_for_commit(self):
+        url = reverse("listings", args=[self.listings[0].pk])
+        self.assert_cached(url)
+        with self.captureOnCommitCallbacks(execute=False):
+            Comment.objects.create(commenter=self.bidder, listing=self.listings[0], content="Uncommitted")
+        self.assertNotContains(self.client.get(url), "Uncommitted")
+
+    def test_closing_purges(self):
+        listing = self.listings[0]
+        Listing.objects.filter(pk=listing.pk).update(ends_at=timezone.now() - timedelta(minutes=1))
+        url = reverse("listings", args=[listing.pk])
+        self.assert_cached(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            close_due_listings()
+        self.assertContains(self.client.get(url), "This auction is closed!")
+
+    @override_settings(PAGE_CACHE_TIMEOUT=0)
+    def test_disabled(self):
+        self.assert_cached(reverse("index"), cached=False)
+
+    def test_stats_view(self):
+        url = reverse("page_cache_stats")
+        self.assert_cached(reverse("index"))
+        self.client.force_login(self.bidder)
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(User.objects.create_user("admin", "admin@example.com", "password", is_staff=True))
+        stats = self.client.get(url).json()
+        self.assertEqual((stats["hits"], stats["misses"], stats["hit_ratio"]), (1, 1, 0.5))
+
+    @override_settings(ROOT_URLCONF="commerce.asgi_urls")
+    async def test_async_views(self):
+        url = reverse("listings", args=[self.listings[0].pk])
+        first = await self.async_client.get(url)
+        second = await self.async_client.get(url)
+        self.assertIsNotNone(first.context)
+        # Served from the cache without rendering
+        self.assertIsNone(second.context)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first["ETag"], second["ETag"])
+        response = await self.async_client.get(url, headers={"If-None-Match": first["ETag"]})
+        self.assertEqual(response.status_code, 304)
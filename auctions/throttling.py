@@ -0,0 +1,191 @@
+"""
+Contains rate limiting of write actions
+
+Bids, comments and watchlist changes are limited per user and per
+client IP with sliding window counters: the count of the current fixed
+window plus the count of the previous one, weighted by how much of it
+still overlaps the sliding window. That takes two cache keys per limit
+instead of a log of every request. Requests are counted with the
+cache's add() and incr() before they are checked, so concurrent requests
+cannot all slip through on the same count. Rejected requests are taken
+back out, so clients get through again as soon as their rate drops.
+
+Behind a reverse proxy, client IPs are read from the header named by
+settings.THROTTLE_CLIENT_IP_HEADER instead of REMOTE_ADDR.
+
+Counters live in the cache named by settings.THROTTLE_CACHE. With
+several worker processes it has to be shared between them and increment
+atomically, otherwise each process counts on its own or concurrent
+requests overwrite each other's counts. Redis and Memcached do, on a
+single host so does LockingFileBasedCache below. Django's file and
+database caches read and write counters without a lock and do not.
+"""
+import fcntl
+import math
+import os
+import pickle
+import time
+import zlib
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.filebased import FileBasedCache
+from django.http import HttpResponse
+
+PERIODS = {"s": 1, "sec": 1, "m": 60, "min": 60, "h": 3600, "hour": 3600, "d": 86400, "day": 86400}
+
+
+class LockingFileBasedCache(FileBasedCache):
+    """
+    File based cache whose add() and incr() hold an exclusive lock on
+    the cache directory, so worker processes on one host count
+    atomically. Increments keep the expiry of the counter. POSIX only.
+    """
+    @contextmanager
+    def lock(self):
+        self._createdir()
+        with open(os.path.join(self._dir, "lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        with self.lock():
+            return super().add(key, value, timeout, version)
+
+    def incr(self, key, delta=1, version=None):
+        fname = self._key_to_file(key, version)
+        with self.lock():
+            try:
+                with open(fname, "rb") as f:
+                    expiry = pickle.load(f)
+                    value = pickle.loads(zlib.decompress(f.read()))
+            except FileNotFoundError:
+                raise ValueError(f"Key '{key}' not found")
+            timeout = None if expiry is None else expiry - time.time()
+            if timeout is not None and timeout <= 0:
+                raise ValueError(f"Key '{key}' not found")
+            value += delta
+            self.set(key, value, timeout, version)
+        return value
+
+
+def parse_rate(rate):
+    """
+    Parses a rate like "10/min" into (requests, seconds)
+    """
+    count, period = rate.split("/")
+    return int(count), PERIODS[period]
+
+
+def client_ip(request):
+    """
+    Returns the client IP of a request, from the header the proxy sets
+    if settings.THROTTLE_CLIENT_IP_HEADER names one. Of lists like
+    X-Forwarded-For only the last entry, added by the proxy, is trusted.
+    """
+    header = getattr(settings, "THROTTLE_CLIENT_IP_HEADER", None)
+    if header:
+        address = request.META.get(header, "").split(",")[-1].strip()
+        if address:
+            return address
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def get_limits(request, action):
+    """
+    Returns the (key, requests, seconds) limits applying to a request.
+    Anonymous requests are only limited by IP.
+    """
+    rates = getattr(settings, "THROTTLE_RATES", {}).get(action, {})
+    limits = []
+    if "user" in rates and request.user.is_authenticated:
+        limits.append((f"user:{request.user.pk}", *parse_rate(rates["user"])))
+    if "ip" in rates:
+        limits.append((f"ip:{client_ip(request)}", *parse_rate(rates["ip"])))
+    return [(f"throttle:{action}:{key}", count, period) for key, count, period in limits]
+
+
+def retry_after(limit, period, previous, current, elapsed):
+    """
+    Returns the seconds until a sliding window with 'previous' and
+    'current' requests in its fixed windows admits another request
+    """
+    if previous and current + 1 <= limit:
+        # The previous window's weight decays within the current one
+        wait = period * (1 - (limit - 1 - current) / previous) - elapsed
+    else:
+        # Only once the current window has become the previous one
+        wait = period - elapsed + period * (1 - (limit - 1) / current)
+    return max(1, math.ceil(wait))
+
+
+def increment(cache, key, timeout):
+    """
+    Counts a request in a window. Returns the new count.
+    """
+    if cache.add(key, 1, timeout=timeout):
+        return 1
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Expired between add() and incr()
+        cache.set(key, 1, timeout=timeout)
+        return 1
+
+
+def hit(limits, now=None):
+    """
+    Counts a request against limits, unless one of them is exhausted.
+    Returns 0 if the request is allowed, else the seconds to wait.
+
+    Args:
+        limits: (key, requests, seconds) tuples, as from 'get_limits'
+        now (optional): Current UNIX time. Defaults to time.time().
+    """
+    cache = caches[getattr(settings, "THROTTLE_CACHE", "default")]
+    now = now or time.time()
+    windows = []
+    for key, count, period in limits:
+        window = int(now // period)
+        windows.append((f"{key}:{window}", f"{key}:{window - 1}", count, period, now - window * period))
+    previous_counts = cache.get_many([previous for current, previous, *_ in windows])
+
+    wait = 0
+    for current, previous, count, period, elapsed in windows:
+        # Kept while they are the current or previous window
+        in_current = increment(cache, current, 2 * period)
+        in_previous = previous_counts.get(previous, 0)
+        if in_previous * (1 - elapsed / period) + in_current > count:
+            wait = max(wait, retry_after(count, period, in_previous, in_current - 1, elapsed))
+    if wait:
+        # Rejected requests are not counted
+        for current, *_ in windows:
+            try:
+                cache.decr(current)
+            except ValueError:
+                pass
+    return wait
+
+
+def throttle(request, action):
+    """
+    Counts a request performing an action. Returns a 429 response
+    if the client exceeded one of the action's limits, else None.
+
+    Args:
+        action: Key of settings.THROTTLE_RATES, e.g. "new_bid"
+    """
+    limits = get_limits(request, action)
+    wait = hit(limits) if limits else 0
+    if not wait:
+        return None
+    response = HttpResponse(
+        "Too many requests, please try again later.", status=429, content_type="text/plain"
+    )
+    response["Retry-After"] = str(wait)
+    return response
@@ -1,15 +1,31 @@
 from django.urls import path
 
-from . import views
+from . import api, views
 
 urlpatterns = [
     path("", views.index, name="index"),
     path("categories", views.categories, name="categories"),
-    path("categories/<str:name>", views.categories, name="category"),
+    path("categories/<slug:slug>", views.categories, name="category"),
+    # Old URLs containing the category's name, e.g. "/categories/Old Books"
+    path("categories/<str:slug>", views.categories),
     path("login", views.login_view, name="login"),
     path("logout", views.logout_view, name="logout"),
     path("register", views.register, name="register"),
     path("new_listing", views.new_listing, name="new_listing"),
+    path("search", views.search, name="search"),
     path("listings/<str:pk>", views.listings, name="listings"),
-    path("watchlist/<str:username>", views.watchlist, name="watchlist")
+    path("listings/<int:pk>/events", views.listing_events, name="listing_events"),
+    path("listings/<int:pk>/comments", views.listing_comments, name="listing_comments"),
+    path("listings/<int:pk>/bids", views.listing_bids, name="listing_bids"),
+    path("watchlist/<str:username>", views.watchlist, name="watchlist"),
+    path("dashboard", views.dashboard, name="dashboard"),
+    path("dashboard/<str:section>", views.dashboard, name="dashboard_section"),
+    path("watchlist/bulk/add", views.watchlist_bulk, {"action": "add"}, name="watchlist_add"),
+    path("watchlist/bulk/remove", views.watchlist_bulk, {"action": "remove"}, name="watchlist_remove"),
+    path("stats/page-cache", views.page_cache, name="page_cache_stats"),
+    # JSON API
+    path("api/v1/listings", api.listings, name="api_listings"),
+    path("api/v1/listings/<int:pk>", api.listing, name="api_listing"),
+    path("api/v1/listings/<int:pk>/bids", api.bids, name="api_bids"),
+    path("api/v1/categories", api.categories, name="api_categories")
 ]
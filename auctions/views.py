@@ -1,23 +1,81 @@
 """
 Contains view functions
 """
+import json
+
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.db import IntegrityError
-from django.http import HttpResponseRedirect
+from django.conf import settings
+from django.http import (
+    Http404, HttpResponse, HttpResponsePermanentRedirect, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+)
 from django.shortcuts import render
 from django.urls import reverse
+from django.utils import timezone
+from django.views.decorators.http import require_GET, require_POST
+
+from .models import Category, Comment, Listing, User
+from .bidding import BidStatus, bid_history, place_bid
+from .caching import category_counts, invalidate_category_counts
+from .dashboard import SECTIONS, dashboard_counts, invalidate_listing_dashboards, section as dashboard_section
+from .events import get_broker, listing_event, live_updates
+from .forms import ListingForm, AddBid, AddComment, SearchForm
+from .images import schedule_thumbnails, stored_original
+from .pagecache import cache_anonymous_page, page_cache_stats, purge_listing_pages
+from .pagination import get_page_size, paginate
+from .signals import publish_listing
+from .throttling import throttle
+from .search import search_listings
+
 
-from .models import Bid, Category, Comment, Listing, User
-from .forms import ListingForm, AddBid, AddComment
+# Listing page actions limited by settings.THROTTLE_RATES, by their POST keys
+THROTTLED_ACTIONS = ("new_bid", "new_comment", "watchlist")
 
 
+def listings_page(request, queryset, **kwargs):
+    """
+    Returns the page of a listing queryset selected by the
+    'after'/'before' cursors in the query string
+
+    Args:
+        queryset: Listings to paginate
+        **kwargs: Passed on to 'paginate'
+    """
+    return paginate(
+        queryset,
+        after=request.GET.get("after"),
+        before=request.GET.get("before"),
+        **kwargs
+    )
+
+
+@cache_anonymous_page("lists")
 def index(request):
     """
-    Default view displaying all active listings
+    Default view displaying all active listings, newest first.
+    With '?sort=ending' only listings still running until an end time
+    are shown, those ending soonest first. Listings past their end time
+    are left out until they are closed.
     """
+    listings = Listing.objects.filter(active=True).cards()
+    if request.GET.get("sort") == "ending":
+        page = listings_page(
+            request,
+            listings.filter(ends_at__gt=timezone.now()),
+            field="ends_at",
+            descending=False
+        )
+        sort = "ending"
+    else:
+        page = listings_page(request, listings)
+        sort = None
     return render(request, "auctions/index.html", {
-        "listings": Listing.objects.filter(active=True).order_by("-time")
+        "listings": page,
+        "page": page,
+        "sortable": True,
+        "sort": sort
     })
 
 
@@ -87,7 +145,7 @@ def new_listing(request):
         # Initialize new listing
         listing = Listing(owner=request.user)
         # Store submitted values
-        form = ListingForm(request.POST)
+        form = ListingForm(request.POST, request.FILES)
         # Validate form
         if form.is_valid():
             # Set required values
@@ -95,12 +153,18 @@ def new_listing(request):
             listing.description = form.cleaned_data["description"]
             listing.startingPrice = form.cleaned_data["startingPrice"]
             # Set optional values
+            if form.cleaned_data["image"]:
+                listing.image = stored_original(form.cleaned_data["image"])
             if form.cleaned_data["imageURL"]:
                 listing.imageURL = form.cleaned_data["imageURL"]
             if form.cleaned_data["category"]:
                 listing.category = form.cleaned_data["category"]
-            # Save listing
+            if form.cleaned_data["ends_at"]:
+                listing.ends_at = form.cleaned_data["ends_at"]
+            # Save listing and resize its image in the background
             listing.save()
+            if listing.image:
+                schedule_thumbnails(listing.pk)
             
         # If form is invalid, rerender page with current form values
         else:
@@ -109,9 +173,11 @@ def new_listing(request):
                 "message": "Your submission was invalid, please check again.",
                 "type": "danger"
             })
-        # Render index page
+        # Render first page of index
+        page = listings_page(request, Listing.objects.filter(active=True).cards())
         return render(request, "auctions/index.html", {
-            "listings": Listing.objects.filter(active=True).order_by("-time"),
+            "listings": page,
+            "page": page,
             "message": "Your listing has been added",
             "type": "success"
             })
@@ -123,6 +189,37 @@ def new_listing(request):
         })
 
 
+def is_watched(user, listing):
+    """
+    Returns whether a listing is on a user's watchlist, using a
+    single indexed lookup instead of loading the whole watchlist
+    """
+    return user.is_authenticated and user.watchlist.filter(pk=listing.pk).exists()
+
+
+def comments_query(listing_id):
+    """
+    Returns a listing's comments with the commenters joined, loading
+    only what the comment list shows
+    """
+    return (Comment.objects
+        .filter(listing_id=listing_id)
+        .select_related("commenter")
+        .only("content", "time", "commenter__username"))
+
+
+def comments_page(listing_id, after=None):
+    """
+    Returns one page of a listing's comments, newest first
+
+    Args:
+        listing_id: Primary key of the listing
+        after (optional): Cursor of the last comment of the previous page
+    """
+    return paginate(comments_query(listing_id), after=after, page_size=getattr(settings, "COMMENTS_PER_PAGE", 10))
+
+
+@cache_anonymous_page("listing")
 def listings(request, pk):
     """
     Displays listing details and allows interacting
@@ -133,8 +230,16 @@ def listings(request, pk):
     Args:
         pk: Primary key of a listing
     """
-    # Get matching listing object
-    listing = Listing.objects.get(pk=pk)
+    # Rate limit bids, comments and watchlist changes before touching the database
+    if request.method == "POST":
+        for action in THROTTLED_ACTIONS:
+            if action in request.POST:
+                limited = throttle(request, action)
+                if limited:
+                    return limited
+                break
+    # Get matching listing object with its owner
+    listing = Listing.objects.select_related("owner").get(pk=pk)
     # Handle various POST requests
     if request.method == "POST":
         # Get current user
@@ -153,31 +258,31 @@ def listings(request, pk):
                 user.watchlist.add(listing)
                 message = "The listing has been added to your watchlist."
                 message_type = "success"
-        # Handle new bid        
+            # Reload the watcher count maintained by the signal handlers
+            listing.refresh_from_db(fields=["watcher_count"])
+        # Handle new bid
         elif "new_bid" in request.POST:
-            # Get bid value
-            new_bid = float(request.POST["bid"])
-            # If bid is too low, set respective message variables
-            if (listing.currentBid is not None and new_bid < listing.currentBid.bid):
-                message = "Your bid must be higher than the current bid."
+            bid_form = AddBid(request.POST, auto_id=False)
+            if not bid_form.is_valid():
+                message = "Please enter a valid bid."
                 message_type = "danger"
-            elif new_bid < listing.startingPrice:
-                message = "Your bid must be higher than the starting bid."
-                message_type = "danger"
-            # If bid is valid
             else:
-                # Create and save the bid
-                bid = Bid()
-                bid.bidder = user
-                bid.listing = listing
-                bid.bid = new_bid
-                bid.save()
-                # Update listing
-                listing.currentBid = bid
-                listing.save()
-                # Set message variables
-                message = "Your bid has been added to the auction."
-                message_type = "success"
+                result = place_bid(listing.pk, user, bid_form.cleaned_data["bid"])
+                # Reload listing to show the latest price
+                listing.refresh_from_db()
+                # Set message variables according to the outcome
+                if result.status == BidStatus.ACCEPTED:
+                    message = "Your bid has been added to the auction."
+                    message_type = "success"
+                elif result.status == BidStatus.CLOSED:
+                    message = "This auction has been closed."
+                    message_type = "danger"
+                elif listing.bid_count:
+                    message = "Your bid must be higher than the current bid."
+                    message_type = "danger"
+                else:
+                    message = "Your bid must be at least the starting price."
+                    message_type = "danger"
         # Handle new comment
         elif "new_comment" in request.POST:
             # Create and save comment
@@ -191,37 +296,45 @@ def listings(request, pk):
             message_type = "success"
         # Handle closing of auction by the owner
         elif "close" in request.POST:
-            # If there has been a bid, set the winner
-            if listing.currentBid:
-                listing.winner = listing.currentBid.bidder
-            # Set listing to inactive and save
-            listing.active = False
-            listing.save()
+            # Set listing to inactive and the current bidder as winner
+            Listing.objects.filter(pk=listing.pk).close()
+            publish_listing(listing.pk)
+            invalidate_category_counts()
+            invalidate_listing_dashboards([listing.pk])
+            purge_listing_pages([listing.pk])
             # Set message variables
             message = "Your auction has been closed"
             message_type = "success"
-            # Render index page with appropriate message
+            # Render first page of index with appropriate message
+            page = listings_page(request, Listing.objects.filter(active=True).cards())
             return render (request, "auctions/index.html", {
-                "listings": Listing.objects.filter(active=True).order_by("-time"),
+                "listings": page,
+                "page": page,
                 "message": message,
                 "type": message_type
             })
-        # Render listing page passing message variables, comments, and forms
+        # Render listing page passing message variables, comments, bids, and forms
         return render(request, "auctions/listing.html", {
             "listing": listing,
+            "watched": is_watched(user, listing),
             "message": message,
             "type": message_type,
-            "comments": listing.comments.all().order_by("-time"),
+            "comments": comments_page(listing.pk),
+            "bids": bid_history(listing.pk) if listing.bid_count else None,
             "bid_form": AddBid(auto_id=False),
-            "comment_form": AddComment(auto_id=False)
+            "comment_form": AddComment(auto_id=False),
+            "live_updates": live_updates(request)
         })
-    # On GET request, render listing page passing comments and forms
+    # On GET request, render listing page passing comments, bids, and forms
     else:
         return render(request, "auctions/listing.html", {
             "listing": listing,
-            "comments": listing.comments.all().order_by("-time"),
+            "watched": is_watched(request.user, listing),
+            "comments": comments_page(listing.pk),
+            "bids": bid_history(listing.pk) if listing.bid_count else None,
             "bid_form": AddBid(auto_id=False),
-            "comment_form": AddComment(auto_id=False)
+            "comment_form": AddComment(auto_id=False),
+            "live_updates": live_updates(request)
         })
 
 
@@ -234,31 +347,257 @@ def watchlist(request, username):
         username: Username of the logged in user.
                   Only for aesthetic purpose.
     """
-    listings = request.user.watchlist.all()
+    page = listings_page(request, request.user.watchlist.cards())
     return render(request, "auctions/watchlist.html", {
-        "listings": listings
+        "listings": page,
+        "page": page
+    })
+
+
+@login_required
+def dashboard(request, section=None):
+    """
+    Displays the user's listings, the auctions they lead or have been
+    outbid on, and their winnings, the newest few of each with counters.
+    Each section costs one query, the counters are cached.
+
+    Args:
+        section (optional): Name of a section to page through on its own
+    """
+    if section is not None:
+        if section not in SECTIONS:
+            raise Http404("No such section.")
+        page = listings_page(request, dashboard_section(request.user, section))
+        return render(request, "auctions/dashboard_section.html", {
+            "section": section,
+            "title": SECTIONS[section],
+            "listings": page,
+            "page": page
+        })
+    counts = dashboard_counts(request.user)
+    size = getattr(settings, "DASHBOARD_SECTION_SIZE", 5)
+    return render(request, "auctions/dashboard.html", {
+        "sections": [{
+            "name": name,
+            "title": title,
+            "count": counts[name],
+            "listings": paginate(dashboard_section(request.user, name), page_size=size)
+        } for name, title in SECTIONS.items()]
     })
 
 
-def categories(request, name=None):
+@require_GET
+def listing_comments(request, pk):
+    """
+    Returns the page of a listing's comments after the 'after' cursor,
+    as an HTML fragment for the "load more" button or as JSON if the
+    'format' parameter is "json"
+
+    Args:
+        pk: Primary key of a listing
+    """
+    page = comments_page(pk, request.GET.get("after"))
+    if request.GET.get("format") == "json":
+        return JsonResponse({
+            "results": [{
+                "id": comment.pk,
+                "commenter_username": comment.commenter.username,
+                "content": comment.content,
+                "time": comment.time,
+            } for comment in page],
+            "next": page.next_cursor
+        })
+    return render(request, "auctions/comments.html", {
+        "listing_id": pk,
+        "comments": page
+    })
+
+
+@require_GET
+def listing_bids(request, pk):
+    """
+    Displays the bid history of a listing, highest bid first, one page
+    after the 'after' cursor at a time. Returns JSON if the 'format'
+    parameter is "json".
+
+    Args:
+        pk: Primary key of a listing
+    """
+    listing = Listing.objects.filter(pk=pk).only("title").first()
+    if listing is None:
+        raise Http404("No such listing.")
+    page = bid_history(pk, request.GET.get("after"))
+    if request.GET.get("format") == "json":
+        return JsonResponse({
+            "results": [{
+                "id": bid.pk,
+                "bidder_username": bid.bidder.username,
+                "bid": bid.bid,
+                "increment": bid.increment,
+                "bidder_max": bid.bidder_max,
+                "time": bid.time,
+            } for bid in page],
+            "next": page.next_cursor
+        })
+    return render(request, "auctions/bids.html", {
+        "listing": listing,
+        "bids": page,
+        "first_page": "after" not in request.GET
+    })
+
+
+@login_required
+@require_POST
+def watchlist_bulk(request, action):
+    """
+    Adds or removes several listings to/from the user's watchlist
+    at once. Listings are passed as repeated 'listings' ids.
+    Only active listings can be added. Responds with the number of
+    listings on the watchlist.
+
+    Args:
+        action: Either "add" or "remove"
+    """
+    limited = throttle(request, "watchlist")
+    if limited:
+        return limited
+    ids = [pk for pk in request.POST.getlist("listings") if pk.isdigit()]
+    if action == "add":
+        request.user.watchlist.add(*Listing.objects
+            .filter(pk__in=ids, active=True)
+            .values_list("pk", flat=True))
+    else:
+        request.user.watchlist.remove(*ids)
+    return JsonResponse({"count": request.user.watchlist.count()})
+
+
+def category_by_name(name):
+    """
+    Redirects old category URLs, which contained the category's name,
+    to the slug URL. Raises Http404 for unknown names.
+    """
+    category = Category.objects.filter(name=name).only("slug").first()
+    if category is None:
+        raise Http404("No such category.")
+    return HttpResponsePermanentRedirect(reverse("category", args=[category.slug]))
+
+
+@cache_anonymous_page("lists")
+def categories(request, slug=None):
     """
     Handles both displaying a list of all categories,
     as well as pages for the individual categories.
+    Old URLs containing a category's name are redirected.
 
     Args:
-        name (optional): Category name. Defaults to None.
+        slug (optional): Category slug. Defaults to None.
     """
-    # If no argument is passed, render a list of categories
-    if name is None:
-        categories = Category.objects.all().order_by("name")
+    # If no argument is passed, render a list of categories with their
+    # number of active listings
+    if slug is None:
         return render(request, "auctions/categories.html", {
-            "categories": categories
+            "categories": category_counts()
         })
-    # If a category name is passed, render all listings of that category
+    # If a category slug is passed, render all listings of that category
     else:
-        category = Category.objects.get(name=name)
-        listings = category.listings.filter(active=True).order_by("-time")
+        category = Category.objects.filter(slug=slug).first()
+        if category is None:
+            return category_by_name(slug)
+        page = listings_page(request, category.listings.filter(active=True).cards())
         return render(request, "auctions/category.html", {
             "category": category,
-            "listings": listings
+            "listings": page,
+            "page": page
         })
+
+
+def search(request):
+    """
+    Displays listings matching a full-text search, best match first.
+    Results can be narrowed down to a category and include closed
+    auctions on request.
+    """
+    form = SearchForm(request.GET)
+    results = []
+    previous_url = next_url = None
+    if form.is_valid():
+        page_size = get_page_size()
+        page_number = form.cleaned_data["page"] or 1
+        results = search_listings(
+            form.cleaned_data["q"],
+            category=form.cleaned_data["category"],
+            active=not form.cleaned_data["closed"],
+            limit=page_size,
+            offset=(page_number - 1) * page_size
+        )
+        # Build links to neighbouring pages keeping the search parameters
+        query = request.GET.copy()
+        if len(results) > page_size:
+            results = results[:page_size]
+            query["page"] = page_number + 1
+            next_url = f"?{query.urlencode()}"
+        if page_number > 1:
+            query["page"] = page_number - 1
+            previous_url = f"?{query.urlencode()}"
+    return render(request, "auctions/search.html", {
+        "form": form,
+        "listings": results,
+        "previous_url": previous_url,
+        "next_url": next_url
+    })
+
+
+async def listing_events(request, pk):
+    """
+    Streams price and status changes of a listing as Server-Sent
+    Events. The current state is sent right away, followed by every
+    change published by the bid and close paths. Comment lines are
+    sent as heartbeats, which also detect disconnected clients.
+
+    Under WSGI the stream would never reach the client, so the request
+    is answered with 204, which tells EventSource not to reconnect.
+    Listing pages only open the stream under ASGI.
+
+    Args:
+        pk: Primary key of a listing
+    """
+    if not live_updates(request):
+        return HttpResponse(status=204)
+    listing = await (Listing.objects
+        .filter(pk=pk)
+        .values("id", "current_price", "bid_count", "active")
+        .afirst())
+    if listing is None:
+        raise Http404("No such listing.")
+    heartbeat = getattr(settings, "LIVE_UPDATES_HEARTBEAT", 15)
+
+    async def stream():
+        broker = get_broker()
+        subscription = broker.subscribe(listing["id"])
+        try:
+            event = listing_event(listing)
+            while True:
+                if event is None:
+                    yield ": heartbeat\n\n"
+                else:
+                    yield f"event: listing\ndata: {json.dumps(event)}\n\n"
+                    # Nothing changes after an auction is closed
+                    if not event["active"]:
+                        break
+                event = await subscription.get(timeout=heartbeat)
+        finally:
+            broker.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Keep proxies like nginx from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@staff_member_required
+def page_cache(request):
+    """
+    Returns hit ratio and purge counts of the anonymous page cache as JSON
+    """
+    return JsonResponse(page_cache_stats())
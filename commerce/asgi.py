@@ -2,6 +2,27 @@
 ASGI config for commerce project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Under ASGI the index, category, listing and watchlist pages are served
+by the async views in auctions/async_views.py and live update streams
+no longer hold a worker each.
+
+Run it with an ASGI server, e.g. uvicorn workers under gunicorn:
+
+    gunicorn commerce.asgi:application -k uvicorn.workers.UvicornWorker --workers 4
+
+or uvicorn on its own:
+
+    uvicorn commerce.asgi:application --workers 4 --no-access-log
+
+One worker per CPU core is enough, as each worker serves any number of
+concurrent requests on its event loop. Queries and the sync views
+(bids, comments, new listings) run one at a time in a single thread per
+worker, which suits SQLite's single writer. With more than one worker,
+caches, throttling counters and live updates have to be shared between
+them (see CACHES and LIVE_UPDATES_BROKER in commerce/settings.py).
+
+Compare both servers on the same dataset with
+'python manage.py benchmark_servers'.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
@@ -12,5 +33,9 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'commerce.settings')
+# Routes the read-heavy pages to their async views, see commerce/asgi_urls.py
+os.environ.setdefault('COMMERCE_SERVER', 'asgi')
+# Switches SQLite to WAL, see SQLITE_PRAGMAS in commerce/settings.py
+os.environ.setdefault('COMMERCE_SQLITE_WAL', '1')
 
 application = get_asgi_application()
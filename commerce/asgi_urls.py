@@ -0,0 +1,13 @@
+"""commerce URL Configuration under ASGI
+
+Routes the read-heavy pages to their async views and everything else
+as commerce.urls does. Selected by commerce.asgi through the
+COMMERCE_SERVER environment variable.
+"""
+from django.urls import include, path
+
+from . import urls
+
+urlpatterns = [
+    path("", include("auctions.async_urls"))
+] + urls.urlpatterns
@@ -45,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'auctions.middleware.ProfilingMiddleware',
+    'auctions.middleware.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,7 +56,9 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'commerce.urls'
+# The ASGI entry point sets COMMERCE_SERVER to "asgi" to route the
+# read-heavy pages to their async views, see commerce/asgi.py
+ROOT_URLCONF = 'commerce.asgi_urls' if os.environ.get('COMMERCE_SERVER') == 'asgi' else 'commerce.urls'
 
 TEMPLATES = [
     {
@@ -82,11 +86,135 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Keep connections open across requests
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Read replicas: SQLite files kept in sync with the primary, e.g. by
+# LiteFS, listed in the COMMERCE_REPLICAS environment variable separated
+# by commas. Reads stay on the primary for REPLICA_PIN_SECONDS after a
+# write, see auctions/routers.py
+
+DATABASE_REPLICAS = []
+for number, name in enumerate(filter(None, os.environ.get('COMMERCE_REPLICAS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {**DATABASES['default'], 'NAME': name, 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['auctions.routers.PrimaryReplicaRouter']
+REPLICA_PIN_SECONDS = 5
+
+# Pragmas applied to every new SQLite connection, see auctions/db.py
+SQLITE_PRAGMAS = {
+    # Milliseconds a connection waits for a lock before giving up
+    'busy_timeout': 20000,
+    'mmap_size': 268435456,
+    'cache_size': -20000,
+    'temp_store': 'memory',
+}
+# The WAL journal mode is stored in the database file and leaves -wal and
+# -shm files next to it, so it is only switched on with COMMERCE_SQLITE_WAL,
+# which the WSGI and ASGI entry points set. manage.py commands leave the
+# database file's journal mode alone.
+if os.environ.get('COMMERCE_SQLITE_WAL') == '1':
+    SQLITE_PRAGMAS = {'journal_mode': 'wal', 'synchronous': 'normal', **SQLITE_PRAGMAS}
+
 AUTH_USER_MODEL = 'auctions.User'
 
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+# Invalidations only reach the cache of the process they happen in, so
+# deployments with several processes need a shared cache such as Redis
+# or Memcached.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Sessions are read from the cache and written through to the database,
+# users are loaded from the cache, see auctions/auth.py. The cached backend
+# replaces ModelBackend rather than being listed next to it, so a failed
+# login checks the password only once. Sessions started before the switch
+# name ModelBackend and have to log in again.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+AUTHENTICATION_BACKENDS = [
+    'auctions.auth.CachedModelBackend',
+]
+
+# Anonymous visitors get index, category and listing pages from a page
+# cache purged by writes, see auctions/pagecache.py. Pages are never more
+# than PAGE_CACHE_TIMEOUT seconds stale, e.g. should a purge only reach
+# another process's cache. Browsers and proxies may reuse them for
+# PAGE_CACHE_MAX_AGE seconds on top, 0 makes them revalidate every time.
+# A PAGE_CACHE_TIMEOUT of 0 turns the cache off.
+PAGE_CACHE = 'default'
+PAGE_CACHE_TIMEOUT = 60
+PAGE_CACHE_MAX_AGE = 0
+
+# Broker for live listing updates and seconds between heartbeats
+LIVE_UPDATES_BROKER = 'auctions.events.InProcessBroker'
+LIVE_UPDATES_HEARTBEAT = 15
+
+# Number of listings per page on index, category and watchlist pages
+LISTINGS_PER_PAGE = 20
+
+# Number of comments per page on listing pages
+COMMENTS_PER_PAGE = 10
+
+# Number of bids per page of the bid history, the first page is shown on listing pages
+BIDS_PER_PAGE = 10
+
+# Number of listings per section on the dashboard, sections page through LISTINGS_PER_PAGE
+DASHBOARD_SECTION_SIZE = 5
+
+# Rate limits of listing actions per user and per client IP, as
+# "requests/period" with periods s, min, h or day. Counters are kept
+# in THROTTLE_CACHE, which has to be shared by all worker processes and
+# increment atomically: Redis, Memcached or, on a single host,
+# 'auctions.throttling.LockingFileBasedCache'. Django's file and database
+# caches lose concurrent increments.
+THROTTLE_RATES = {
+    'new_bid': {'user': '10/min', 'ip': '30/min'},
+    'new_comment': {'user': '5/min', 'ip': '15/min'},
+    'watchlist': {'user': '30/min', 'ip': '90/min'},
+}
+THROTTLE_CACHE = 'default'
+# Header carrying the client IP behind a reverse proxy, as a request.META
+# key, e.g. 'HTTP_X_FORWARDED_FOR'. Only set it if the proxy overwrites or
+# appends to it, clients can send any value. None uses REMOTE_ADDR.
+THROTTLE_CLIENT_IP_HEADER = None
+
+# Request profiling: fraction of requests profiled, whether everyone rather
+# than just staff gets their Server-Timing header, threshold of slow request
+# logging and number of slowest queries logged per request
+PROFILING_SAMPLE_RATE = 0.01
+PROFILING_SERVER_TIMING = False
+SLOW_REQUEST_THRESHOLD_MS = 500
+SLOW_REQUEST_QUERIES = 5
+
+# Logging
+# https://docs.djangoproject.com/en/3.0/topics/logging/
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'auctions.profiling': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -123,9 +251,35 @@ USE_TZ = True
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
-STATIC_ROOT = 'auctions/static/auctions/'
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 STATIC_URL = '/static/'
 
+# Production builds ('manage.py build_assets') collect static files under
+# content-hashed names with gzip and brotli variants, see auctions/assets.py
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+        else 'auctions.assets.PrecompressedManifestStaticFilesStorage',
+    },
+}
+
+# Uploaded files. Listing images and thumbnails have content-hashed
+# names and never change, so the web server can serve MEDIA_URL with
+# "Cache-Control: public, max-age=31536000, immutable".
+
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+MEDIA_URL = '/media/'
+
+# Largest accepted image upload or download in bytes
+MAX_IMAGE_SIZE = 10 * 1024 * 1024
+
+# Processes (and feeding threads) creating thumbnails, 0 for inline
+THUMBNAIL_WORKERS = 2
+
 # SASS settings
 STATICFILES_FINDERS = (
     'django.contrib.staticfiles.finders.FileSystemFinder',
@@ -135,5 +289,11 @@ STATICFILES_FINDERS = (
 )
 
 COMPRESS_PRECOMPILERS = (
-    ('text/x-scss', 'django_libsass.SassCompiler'),
-)
\ No newline at end of file
+    ('text/x-scss', 'auctions.assets.CachedSassCompiler'),
+)
+
+# Stylesheets are compiled at build time, requests only read the manifest
+COMPRESS_OFFLINE = not DEBUG
+COMPRESS_STORAGE = 'auctions.assets.PrecompressedCompressorStorage'
+# In development, CachedSassCompiler (see COMPRESS_PRECOMPILERS) compiles
+# SCSS again only after styles.scss or one of its imports changed.
\ No newline at end of file
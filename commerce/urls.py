@@ -13,10 +13,20 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import include, path
+from django.urls import include, path, re_path
+
+from auctions import assets
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("", include("auctions.urls"))
-]
\ No newline at end of file
+] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+
+# The development server serves static files itself
+if not settings.DEBUG:
+    urlpatterns.append(
+        re_path(rf"^{settings.STATIC_URL.lstrip('/')}(?P<path>.*)$", assets.serve, name="static")
+    )
\ No newline at end of file
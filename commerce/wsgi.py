@@ -12,5 +12,7 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'commerce.settings')
+# Switches SQLite to WAL, see SQLITE_PRAGMAS in commerce/settings.py
+os.environ.setdefault('COMMERCE_SQLITE_WAL', '1')
 
 application = get_wsgi_application()